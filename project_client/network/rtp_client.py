@@ -5,7 +5,6 @@ import time
 import uuid
 import cv2
 import ffmpeg
-import pyaudio
 import threading
 import numpy as np
 from collections import deque
@@ -13,15 +12,37 @@ from asyncio import Queue
 
 from shared.Video_packet_assembler import VideoPacketAssembler
 from shared.media_manager import MediaManager
+from shared.audio_codec import create_encoder
 from shared.audio_player import AudioPlayer
-
-MAX_UDP_PACKET_SIZE = 1500  # 定义一个最大 UDP 数据包大小，通常是 65535 字节
+from shared.packetizer import (MAX_DATAGRAM_SIZE, GRO_CMSG_SPACE, Packetizer, enable_gro,
+                               split_gro_segments)
+from shared.fec import FEC_HEADER, FecEncoder
+from shared.pacer import (DEFAULT_PACING_RATE, PACING_FACTOR, PRIORITY_AUDIO, PRIORITY_REPAIR, PRIORITY_VIDEO,
+                          Pacer)
+from shared.path_mtu import DEFAULT_MTU, PathMTUProber, probe_ack
+from shared.rtcp import REPORT_INTERVAL, ReceiveStatistics, ReportTable
+from shared.resampler import Resampler
+from shared.slice_codec import SliceAssembler, SliceCompositor
+from shared.protocols import (AUDIO_CODEC_PCM, AUDIO_PAYLOAD_TYPES, COMPACT_HEADER, FLAG_RETRANSMIT, FLAG_SLICE,
+                              LEGACY_DOWNLINK_HEADER, LEGACY_FRAME_SAMPLES, LEGACY_SAMPLE_RATE, LEGACY_UPLINK_HEADER,
+                              PAYLOAD_AUDIO, PAYLOAD_NACK, PAYLOAD_PROBE, PAYLOAD_PROBE_ACK, PAYLOAD_REPORT,
+                              PAYLOAD_VIDEO, PAYLOAD_VIDEO_FEC, PAYLOAD_VIDEO_SLICE, RTP_VERSION_COMPACT,
+                              RTP_VERSION_LEGACY, PacketView, media_timestamp, pack_nack, pack_report, unpack_nack,
+                              unpack_report)
+
+CLIENT_HEADER_FORMAT = LEGACY_UPLINK_HEADER.format  # 客户端 → 服务器
+P2P_HEADER_FORMAT = LEGACY_DOWNLINK_HEADER.format  # 点对点（与服务器 → 客户端一致）
+# 经服务器转发的 v2 数据包可能被改写为更长的旧版包头（发给旧版接收端），分包时预留差值
+COMPACT_SERVER_RESERVE = LEGACY_DOWNLINK_HEADER.size - COMPACT_HEADER.size
+NACK_CHECK_INTERVAL = 0.02  # 检查未完成视频帧并发送 NACK 的周期（秒）
 
 media_manager = MediaManager(None)
 
 
 class RTPClient:
-    def __init__(self, server_ip, server_port, client_port, client_id, meeting_id, client_ip="0.0.0.0", mode="unconnected"):
+    def __init__(self, server_ip, server_port, client_port, client_id, meeting_id, client_ip="0.0.0.0", mode="unconnected",
+                 offload=False, mtu=DEFAULT_MTU, fec=False, pacing=True,
+                 priority=True, dscp=False):
         """
         初始化 RTP 客户端。
         :param server_ip: RTP 服务器 IP
@@ -29,6 +50,12 @@ class RTPClient:
         :param client_ip: 客户端本地 IP
         :param client_port: 客户端本地端口（默认 0 表示随机端口）
         :param client_id: 客户端 ID (UUID 格式)
+        :param offload: 是否启用 Linux UDP GSO/GRO 卸载（内核不支持时自动退回；启用发送调度时只启用 GRO）
+        :param mtu: 配置的 MTU 上限，服务器和 P2P 路径分别在此范围内探测
+        :param fec: 是否为视频帧发送 XOR 校验包（仅 v2 包头）
+        :param pacing: 是否平滑发送视频数据包（音频不受发送速率限制）
+        :param priority: 是否按优先级调度发送（音频 > 视频 > 重传/FEC）；开启平滑发送或优先级调度时视频不使用 GSO
+        :param dscp: 是否按类别标记 DSCP（音频 EF，视频 AF41），需要网络按 DSCP 区分优先级
         """
         self.data_queue = Queue()
         self.server_ip = server_ip
@@ -36,19 +63,25 @@ class RTPClient:
         self.p2p_ip = None
         self.p2p_port = None
         self.client_id = client_id
+        self.client_id_bytes = uuid.UUID(client_id).bytes  # 16 字节客户端 ID，只转换一次
         self.meeting_id = meeting_id
         self.mode = mode
+        self.rtp_version = RTP_VERSION_LEGACY  # 与服务器协商的包头版本
+        self.p2p_rtp_version = RTP_VERSION_LEGACY  # 与 P2P 对端协商的包头版本
+        self.audio_encoder = create_encoder(AUDIO_CODEC_PCM)  # 与服务器协商的音频编码
+        self.p2p_audio_encoder = create_encoder(AUDIO_CODEC_PCM)  # 与 P2P 对端协商的音频编码
+        self.sample_rate = LEGACY_SAMPLE_RATE  # 与服务器协商的音频采样率（采集和播放都使用该采样率）
+        self.frame_samples = LEGACY_FRAME_SAMPLES  # 与服务器协商的每帧采样点数
+        self.p2p_resampler = None  # P2P 对端协商的采样率与本端不同时，发送前转换为对端的采样率
+        self.p2p_sample_rate = None  # P2P 对端的采样率（旧客户端为 44.1 kHz），收到的音频播放前转换为本端的采样率
+        self.stream_id = None  # 服务器在 REGISTER_RTP_ACK 中分配的流 ID
+        self.mtu = mtu
+        self.server_mtu = mtu  # 到服务器的路径 MTU
+        self.p2p_mtu = mtu  # 到 P2P 对端的路径 MTU
 
         # 接收缓冲区
         self.buffer = deque(maxlen=20)  # 设置缓冲区大小（可根据需求调整）
 
-        # 音频播放初始化
-        self.audio_player = pyaudio.PyAudio()
-        self.audio_stream = self.audio_player.open(format=pyaudio.paInt16,
-                                                   channels=1,
-                                                   rate=44100,
-                                                   output=True)
-
         # UDP 套接字
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setblocking(False)
@@ -67,6 +100,8 @@ class RTPClient:
         self.frame_interval = 1 / 30  # 视频帧之间的时间间隔（30 FPS）
         asyncio.create_task(self.receive_data())  # 启动接收任务
         asyncio.create_task(self.process_data())  # 启动处理任务
+        asyncio.create_task(self.nack_loop())  # 启动重传请求任务
+        asyncio.create_task(self.report_loop())  # 启动接收报告任务
         self.pipeline = (
             f"udpsrc port={self.server_port} ! application/x-rtp, payload=96 ! rtph264depay ! avdec_h264 "
             f"! videoconvert ! appsink"
@@ -75,19 +110,271 @@ class RTPClient:
         self.running = False
         self.thread = None  # 用于接收和播放视频的线程
 
-        self.audio_player = AudioPlayer()
+        self.audio_player = AudioPlayer(self.sample_rate, frame_size=self.frame_samples)
 
         # 自动启动视频接收
         # self.start_video_thread()
         self.video_assemblers = {}  # 存储每个视频流的 VideoPacketAssembler
+        self.slice_assemblers = {}  # 存储每个条带模式视频流的 SliceAssembler（仅 v2 流）
+        self.slice_compositors = {}  # 存储每个条带模式视频流的 SliceCompositor
+        self.video_packetizer = Packetizer(CLIENT_HEADER_FORMAT, mtu)  # 发往服务器的视频流
+        self.p2p_video_packetizer = Packetizer(P2P_HEADER_FORMAT, mtu)  # 点对点视频流
+        self.compact_video_packetizer = Packetizer(COMPACT_HEADER.format, mtu)  # v2 视频流（服务器和 P2P 通用）
+        self.compact_video_packetizer.enable_history()  # 保存最近发送的视频包，响应 NACK 重传
+        self.compact_audio_packetizer = Packetizer(COMPACT_HEADER.format, mtu)  # v2 音频流
+        self.mtu_prober = PathMTUProber(self.sock)
+        self.pacing = pacing
+        self.pacer = None
+        self.audio_sock = self.video_sock = self.repair_sock = self.sock  # 媒体数据包按类别经过发送调度器
+        if pacing or priority:
+            self.pacer = Pacer(self.sock, rate=DEFAULT_PACING_RATE if pacing else None, dscp=dscp)
+            self.audio_sock = self.pacer.channel(PRIORITY_AUDIO)
+            self.video_sock = self.pacer.channel(PRIORITY_VIDEO)
+            self.repair_sock = self.pacer.channel(PRIORITY_REPAIR)
+        self.fec = FecEncoder() if fec else None  # 组大小随接收报告中的丢包率调整
+        self.receive_stats = {}  # 存储 {(流 ID, 媒体类型): ReceiveStatistics}，仅 v2 流
+        self.reports = ReportTable()  # 接收端发回的、关于本客户端媒体流的接收报告
+        self.gro = False
+        if offload:
+            self.enable_offload()
+
+    def enable_offload(self):
+        """
+        启用 UDP GSO（整帧一次 sendmsg）和 GRO（一次 recvmsg 收取多个数据报）。
+        """
+        gso = False
+        if self.pacer is None:  # 经过发送调度器时逐包出队，不能整帧交给内核分段
+            gso = self.video_packetizer.enable_offload(self.sock)
+            self.p2p_video_packetizer.enable_offload(self.sock)
+            self.compact_video_packetizer.enable_offload(self.sock)
+        else:
+            print("UDP offload: GSO stays off while the pacer is enabled, paced packets are sent one at a time.")
+        self.gro = enable_gro(self.sock)
+        print(f"UDP offload: GSO {'on' if gso else 'off'}, GRO {'on' if self.gro else 'off'}")
 
-    def connect_to_p2p(self, ip, port):
+    def connect_to_p2p(self, ip, port, rtp_version=RTP_VERSION_LEGACY, audio_codec=AUDIO_CODEC_PCM, sample_rate=None):
         self.p2p_ip = ip
         self.p2p_port = port
+        self.p2p_rtp_version = rtp_version or RTP_VERSION_LEGACY
+        self.p2p_audio_encoder = create_encoder(audio_codec)
+        self.p2p_resampler = None
+        self.p2p_sample_rate = sample_rate
+        self.audio_player.remove_all_sources()  # 经服务器收到的音频源（混音或其他参与者）不会再有数据
+        if sample_rate and sample_rate != self.sample_rate:
+            self.p2p_resampler = Resampler(self.sample_rate, sample_rate)
         self.mode = "p2p"
+        self.set_p2p_mtu(self.mtu)
+        asyncio.create_task(self.probe_p2p_mtu())  # 每个对端单独探测
 
     def stop_p2p(self):
         self.mode = "CS"
+        self.audio_player.remove_all_sources()  # P2P 对端的音频不会再有数据
+
+    def set_server_mtu(self, mtu):
+        """
+        设置到服务器的路径 MTU，从下一帧开始生效。
+        """
+        self.server_mtu = mtu
+        self.video_packetizer.set_mtu(mtu)
+
+    def set_p2p_mtu(self, mtu):
+        """
+        设置到 P2P 对端的路径 MTU，从下一帧开始生效。
+        """
+        self.p2p_mtu = mtu
+        self.p2p_video_packetizer.set_mtu(mtu)
+
+    async def probe_server_mtu(self):
+        """
+        探测到服务器的路径 MTU。
+        :return: 路径 MTU
+        """
+        self.set_server_mtu(await self.mtu_prober.probe((self.server_ip, self.server_port), self.mtu))
+        return self.server_mtu
+
+    async def probe_p2p_mtu(self):
+        """
+        探测到当前 P2P 对端的路径 MTU，对端切换时结果作废。
+        """
+        address = (self.p2p_ip, self.p2p_port)
+        mtu = await self.mtu_prober.probe(address, self.mtu)
+        if self.mode == "p2p" and (self.p2p_ip, self.p2p_port) == address:
+            self.set_p2p_mtu(mtu)
+
+    def set_pacing_rate(self, bitrate, fps=None):
+        """
+        按目标码率设置视频发送速率（目标码率的 PACING_FACTOR 倍，给单帧的突发留出余量）。
+        :param bitrate: 目标码率（bit/s）
+        :param fps: 帧率（None 表示保持不变）
+        """
+        if self.pacing:
+            self.pacer.set_rate(bitrate * PACING_FACTOR / 8, 1 / fps if fps else None)
+
+    def reset_pacing_rate(self):
+        """
+        恢复默认的视频发送速率（码率自适应退回固定档位时）。
+        """
+        if self.pacing:
+            self.pacer.set_rate(DEFAULT_PACING_RATE)
+
+    def get_pacer_stats(self):
+        """
+        获取发送调度器的统计（发送速率、各类别的排队时延等），未启用调度器时返回 None。
+        """
+        return self.pacer.get_stats() if self.pacer is not None else None
+
+    def set_stream(self, stream_id, rtp_version):
+        """
+        设置服务器分配的流 ID 和协商的包头版本。
+        :param stream_id: 流 ID
+        :param rtp_version: 包头版本
+        """
+        self.stream_id = stream_id
+        self.rtp_version = rtp_version or RTP_VERSION_LEGACY
+        print(f"RTP stream {stream_id} using header version {self.rtp_version}")
+
+    def set_audio_codec(self, audio_codec):
+        """
+        设置与服务器协商的音频编码（INIT_ACK 中给出）。
+        :param audio_codec: 编码名称，None 表示服务器不支持协商，使用原始 PCM
+        """
+        self.audio_encoder = create_encoder(audio_codec or AUDIO_CODEC_PCM)
+        print(f"Audio codec: {self.audio_encoder.name}")
+
+    def set_audio_format(self, sample_rate, frame_samples):
+        """
+        设置与服务器协商的音频格式（INIT_ACK 中给出），需在打开麦克风之前调用。
+        :param sample_rate: 采样率
+        :param frame_samples: 每帧采样点数
+        """
+        self.sample_rate = sample_rate
+        self.frame_samples = frame_samples
+        self.audio_player.set_format(sample_rate, frame_samples)
+        print(f"Audio format: {sample_rate} Hz, {frame_samples} samples per frame")
+
+    def use_compact_header(self):
+        """
+        当前路径（服务器或 P2P 对端）是否使用 v2 紧凑包头。
+        """
+        version = self.p2p_rtp_version if self.mode == "p2p" else self.rtp_version
+        return self.stream_id is not None and version == RTP_VERSION_COMPACT
+
+    def path_address(self):
+        """
+        当前媒体路径的目标地址（P2P 对端或服务器）。
+        """
+        return (self.p2p_ip, self.p2p_port) if self.mode == "p2p" else (self.server_ip, self.server_port)
+
+    def handle_nack(self, payload):
+        """
+        响应对端或服务器转发的 NACK，从发送历史中重传丢失的视频包。
+        :param payload: NACK 负载
+        """
+        _, sequences = unpack_nack(payload)
+        self.compact_video_packetizer.retransmit(self.repair_sock, self.path_address(), sequences)
+
+    async def nack_loop(self):
+        """
+        周期性地为仍在等待期限内的未完成视频帧请求重传。只有 v2 流（以流 ID 标识发送端）带有序列号。
+        """
+        while True:
+            await asyncio.sleep(NACK_CHECK_INTERVAL)
+            if self.stream_id is None:
+                continue
+            assemblers = [*self.video_assemblers.items(), *self.slice_assemblers.items()]
+            for media_stream_id, assembler in assemblers:
+                if not isinstance(media_stream_id, int):
+                    continue  # 旧版包头以 UUID 字符串标识发送端，不支持重传
+                sequences = assembler.collect_nacks()
+                if sequences:
+                    try:
+                        self.sock.sendto(pack_nack(media_stream_id, self.stream_id, sequences), self.path_address())
+                    except OSError as e:
+                        print(f"Error sending NACK: {e}")
+
+    def record_packet(self, packet):
+        """
+        把收到的 v2 媒体包计入该流的接收统计。同一流的视频（含条带和校验包）与音频使用不同的序列号空间，分开统计。
+        :param packet: PacketView
+        """
+        if packet.flags & FLAG_RETRANSMIT:
+            return  # 重传包的序列号已经统计过
+        media_type = PAYLOAD_AUDIO if packet.payload_type in AUDIO_PAYLOAD_TYPES else PAYLOAD_VIDEO
+        stats = self.receive_stats.get((packet.stream_id, media_type))
+        if stats is None:
+            stats = self.receive_stats[(packet.stream_id, media_type)] = ReceiveStatistics()
+        stats.update(packet.stream_sequence, packet.timestamp, len(packet.view))
+
+    async def report_loop(self):
+        """
+        周期性地为收到的每个 v2 媒体流发送接收报告，经服务器转发（或直接发给 P2P 对端）给发送端。
+        """
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            if self.stream_id is None:
+                continue
+            for (media_stream_id, media_type), stats in list(self.receive_stats.items()):
+                if not stats.interval_packets:
+                    continue  # 本周期没有收到该流的数据包
+                try:
+                    self.sock.sendto(pack_report(media_stream_id, self.stream_id, media_type, stats.report()),
+                                     self.path_address())
+                except OSError as e:
+                    print(f"Error sending receiver report: {e}")
+
+    def handle_report(self, payload):
+        """
+        记录接收端发回的接收报告，并按最差接收端的视频丢包率调整 FEC 冗余。
+        :param payload: 接收报告负载
+        """
+        reporter_stream_id, media_type, report = unpack_report(payload)
+        self.reports.add(reporter_stream_id, media_type, report)
+        if self.fec and media_type == PAYLOAD_VIDEO:
+            self.fec.update_loss_rate(self.reports.aggregate(PAYLOAD_VIDEO)["fraction_lost"])
+
+    def get_stream_statistics(self):
+        """
+        获取媒体路径的质量统计。
+        :return: {"sent": 各媒体类型的汇总（最差接收端）, "receivers": 各接收端的最新报告,
+                  "received": 本客户端收到的各媒体流的最新报告}
+        """
+        return {
+            "sent": {"video": self.reports.aggregate(PAYLOAD_VIDEO), "audio": self.reports.aggregate(PAYLOAD_AUDIO)},
+            "receivers": self.reports.snapshot(),
+            "received": {key: stats.last_report for key, stats in self.receive_stats.items()},
+        }
+
+    def send_compact(self, packetizer, payload_type, payload):
+        """
+        以 v2 紧凑包头发送一帧数据。
+        :param packetizer: 对应媒体流的分包器
+        :param payload_type: 数据类型
+        :param payload: 数据内容
+        """
+        frame_id = packetizer.next_frame()
+        timestamp = media_timestamp()  # 同一帧的所有包共用一个时间戳
+
+        def header_fields(fragment_index, fragment_count, payload_length):
+            return (RTP_VERSION_COMPACT << 4 | payload_type, 0, packetizer.next_sequence(), self.stream_id,
+                    frame_id, fragment_index, fragment_count, timestamp)
+
+        fec = self.fec if payload_type in (PAYLOAD_VIDEO, PAYLOAD_VIDEO_SLICE) else None
+        parity_flags = FLAG_SLICE if payload_type == PAYLOAD_VIDEO_SLICE else 0
+        reserve = FEC_HEADER.size if fec else 0  # 校验包的负载 = 前缀 + 一个分片
+        address = self.path_address()
+        if self.mode == "p2p":
+            packetizer.set_mtu(self.p2p_mtu, reserve)
+        else:
+            packetizer.set_mtu(self.server_mtu, reserve + COMPACT_SERVER_RESERVE)
+        sock = self.audio_sock if payload_type in AUDIO_PAYLOAD_TYPES else self.video_sock
+        packetizer.send_frame(sock, address, payload, header_fields)
+        if fec:
+            for group, group_count, prefix, parity in fec.encode(payload, packetizer.payload_size):
+                packetizer.send_packet(self.repair_sock, address,
+                                       (RTP_VERSION_COMPACT << 4 | PAYLOAD_VIDEO_FEC, parity_flags,
+                                        packetizer.next_sequence(), self.stream_id, frame_id, group, group_count,
+                                        timestamp),
+                                       (prefix, parity))
 
     def create_rtp_packet(self, payload_type, payload, sequence_number, total_packets):
         """
@@ -179,74 +466,64 @@ class RTPClient:
 
     def parse_rtp_packet(self, packet):
         """
-        解析 RTP 数据包。
+        解析 RTP 数据包（服务器转发或点对点对端发来的旧版包头，或 v2 紧凑包头）。
         :param packet: RTP 数据包（二进制字节流）
-        :return: 包含头部信息和负载数据的字典
+        :return: PacketView，包头字段按需解析，负载为零拷贝切片
         """
-        # RTP 头部格式：1 字节 payload_type + 2 字节 payload_length + 8 字节时间戳 + 2 字节 sequence_number + 2 字节 total_packets
-        header_format = '!BBH8sHH16s'
-        header_size = struct.calcsize(header_format)
-
-        if len(packet) < header_size:
-            raise ValueError("Invalid RTP packet: Header size is too small")
+        return PacketView.parse(packet)
 
-        # 解析头部
-        header = packet[:header_size]
-        payload = packet[header_size:]
-
-        payload_type, high_length, low_length, timestamp_bytes, sequence_number, total_packets, client_id_bytes = struct.unpack(
-            header_format, header)
-
-        # 将 client_id 转换为 UUID 字符串
-        client_id = str(uuid.UUID(bytes=client_id_bytes))
+    async def send_video(self, video_payload):
+        """
+        发送视频数据。整帧只遍历一次，负载切片与包头通过 sendmsg 一起发送，不拷贝负载。
+        :param video_payload: 捕获的视频帧数据
+        """
+        if not self.meeting_id:
+            raise ValueError("Meeting ID is not set. Please set meeting_id before sending data.")
+        if self.use_compact_header():
+            self.send_compact(self.compact_video_packetizer, PAYLOAD_VIDEO, video_payload)
+            return
+        # 同一帧的所有包共用一个时间戳
+        timestamp_bytes = struct.pack('!Q', int(time.time() * 1000))
+        if self.mode == "p2p":
+            def header_fields(sequence_number, total_packets, payload_length):
+                return (0x01, (payload_length >> 8) & 0xFF, payload_length & 0xFF, timestamp_bytes,
+                        sequence_number, total_packets, self.client_id_bytes)
 
-        # 计算负载长度
-        payload_length = (high_length << 8) | low_length
+            self.p2p_video_packetizer.send_frame(self.video_sock, (self.p2p_ip, self.p2p_port), video_payload, header_fields)
+        else:
+            meeting_id_bytes = self.meeting_id.encode('utf-8').ljust(4, b'\0')[:4]
 
-        # if len(payload) != payload_length:
-        #     raise ValueError("Payload length mismatch")
+            def header_fields(sequence_number, total_packets, payload_length):
+                return (0x01, (payload_length >> 8) & 0xFF, payload_length & 0xFF, self.client_id_bytes,
+                        meeting_id_bytes, sequence_number, total_packets, timestamp_bytes)
 
-        # 解析时间戳
-        timestamp = struct.unpack('!Q', timestamp_bytes)[0]
-        # 返回解析结果
-        return {
-            "payload_type": payload_type,
-            "payload_length": payload_length,
-            "timestamp": timestamp,
-            "sequence_number": sequence_number,
-            "total_packets": total_packets,
-            "payload": payload,
-            "client_id": client_id
-        }
+            self.video_packetizer.send_frame(self.video_sock, (self.server_ip, self.server_port), video_payload, header_fields)
 
-    async def send_video(self, video_payload):
+    async def send_slices(self, bands):
         """
-        发送视频数据。
-        :param video_payload: 捕获的视频帧数据
+        发送条带模式的一帧：每个条带作为一个独立的 v2 帧发送（有自己的帧 ID），调用方保证当前路径使用 v2 包头。
+        :param bands: 条带负载列表（SliceEncoder.encode 的结果）
         """
-        total_packets = len(video_payload) // MAX_UDP_PACKET_SIZE + 1  # 计算视频帧的总包数
-        sequence_number = 0  # 初始化序列号
-        while len(video_payload) > MAX_UDP_PACKET_SIZE:
-            packet_part = video_payload[:MAX_UDP_PACKET_SIZE]
-            # 检查数据包大小
-            # print(f"Packet size: {len(packet_part)} bytes")
-            sequence_number = sequence_number + 1
-            await self.send_data(payload_type=0x01, payload=packet_part, sequence_number=sequence_number,
-                                 total_packets=total_packets)
-            video_payload = video_payload[MAX_UDP_PACKET_SIZE:]
-        sequence_number = sequence_number + 1
-        # 发送剩余的部分（如果有的话）
-        if video_payload:
-            await self.send_data(payload_type=0x01, payload=video_payload, sequence_number=sequence_number,
-                                 total_packets=total_packets)
+        if not self.meeting_id:
+            raise ValueError("Meeting ID is not set. Please set meeting_id before sending data.")
+        for band in bands:
+            self.send_compact(self.compact_video_packetizer, PAYLOAD_VIDEO_SLICE, band)
 
     async def send_audio(self, audio_data):
         """
-        发送音频数据。
-        :param audio_data: 捕获的音频数据
+        发送音频数据，按当前路径协商的编码压缩，负载类型标识编码。
+        :param audio_data: 捕获的音频数据（16 位单声道 PCM）
         """
-        # 音频数据无需进一步编码（假设它已经是适合 RTP 传输的格式）
-        await self.send_data(payload_type=0x02, payload=audio_data, sequence_number=0, total_packets=1)
+        encoder = self.audio_encoder
+        if self.mode == "p2p":
+            encoder = self.p2p_audio_encoder
+            if self.p2p_resampler is not None:
+                audio_data = self.p2p_resampler.process(audio_data)
+        payload = encoder.encode(audio_data)
+        if self.use_compact_header():
+            self.send_compact(self.compact_audio_packetizer, encoder.payload_type, payload)
+            return
+        await self.send_data(payload_type=encoder.payload_type, payload=payload, sequence_number=0, total_packets=1)
 
     async def send_data(self, payload_type, payload, sequence_number, total_packets):
         """
@@ -262,7 +539,8 @@ class RTPClient:
             packet = self.create_rtp_packet_p2p(payload_type, payload, sequence_number, total_packets)
         else:
             packet = self.create_rtp_packet(payload_type, payload, sequence_number, total_packets)
-        self.sock.sendto(packet, (self.p2p_ip, self.p2p_port) if self.mode == "p2p" else (self.server_ip, self.server_port))
+        sock = self.audio_sock if payload_type in AUDIO_PAYLOAD_TYPES else self.video_sock
+        sock.sendto(packet, (self.p2p_ip, self.p2p_port) if self.mode == "p2p" else (self.server_ip, self.server_port))
         # print(f"Sent RTP packet to {self.server_ip}:{self.server_port}")
 
     async def receive_data(self):
@@ -272,14 +550,44 @@ class RTPClient:
         loop = asyncio.get_event_loop()
         while True:
             try:
-                # 接收批量 RTP 数据包
-                data = await loop.sock_recv(self.sock, MAX_UDP_PACKET_SIZE + 100)
-                data_ = self.parse_rtp_packet(data)
-                # 将数据放入队列中
-                await self.data_queue.put(data_)
+                if self.gro:
+                    # GRO 开启时一次收取多个合并的数据报，按分段大小拆开
+                    await self.wait_readable(loop)
+                    data, ancdata, _, address = self.sock.recvmsg(MAX_DATAGRAM_SIZE, GRO_CMSG_SPACE)
+                    packets = split_gro_segments(data, ancdata)
+                else:
+                    # 接收批量 RTP 数据包
+                    data, address = await loop.sock_recvfrom(self.sock, MAX_DATAGRAM_SIZE)
+                    packets = (data,)
+                for data in packets:
+                    if not data:
+                        continue
+                    if data[0] == PAYLOAD_PROBE:
+                        self.sock.sendto(probe_ack(data), address)  # P2P 对端的路径 MTU 探测
+                        continue
+                    if data[0] == PAYLOAD_PROBE_ACK:
+                        self.mtu_prober.handle_ack(data)
+                        continue
+                    try:
+                        data_ = self.parse_rtp_packet(data)
+                    except ValueError:
+                        continue  # 丢弃过短的数据包
+                    # 将数据放入队列中
+                    await self.data_queue.put(data_)
             except BlockingIOError:
                 await asyncio.sleep(0.01)  # 避免高 CPU 占用
 
+    async def wait_readable(self, loop):
+        """
+        等待套接字可读（用于需要 recvmsg 的 GRO 接收路径）。
+        """
+        future = loop.create_future()
+        loop.add_reader(self.sock.fileno(), lambda: future.done() or future.set_result(None))
+        try:
+            await future
+        finally:
+            loop.remove_reader(self.sock.fileno())
+
     async def process_data(self):
         """
         从队列中处理数据包。
@@ -287,19 +595,33 @@ class RTPClient:
         while True:
             data_ = await self.data_queue.get()  # 从队列获取数据
             try:
-                payload_type = data_["payload_type"]
-                payload = data_["payload"]
-                sequence_number = data_["sequence_number"]
-                total_packets = data_["total_packets"]
-                client_id = data_["client_id"]
+                payload_type = data_.payload_type
+                payload = data_.payload
+                sequence_number, total_packets = data_.fragment
+                client_id = data_.client_id
+                if data_.compact and (payload_type in AUDIO_PAYLOAD_TYPES or
+                                      payload_type in (PAYLOAD_VIDEO, PAYLOAD_VIDEO_SLICE, PAYLOAD_VIDEO_FEC)):
+                    self.record_packet(data_)
 
                 # print(f"Received RTP packet from {client_id} ({len(payload)} bytes)")
                 # print(f"Payload type: {payload_type}, Sequence number: {sequence_number}, Total packets: {total_packets}")
                 # 根据负载类型来播放数据
                 if payload_type == 0x01:  # 视频类型
-                    asyncio.create_task(self.play_video(payload, sequence_number, total_packets, client_id))
-                elif payload_type == 0x02:  # 音频类型
-                    asyncio.create_task(self.play_audio(payload, client_id))
+                    asyncio.create_task(self.play_video(payload, sequence_number, total_packets, client_id,
+                                                        data_.frame_id, data_.stream_sequence))
+                elif payload_type in AUDIO_PAYLOAD_TYPES:  # 音频类型（PCM、μ-law 或 ADPCM）
+                    asyncio.create_task(self.play_audio(bytes(payload), client_id, data_.stream_sequence,
+                                                        data_.timestamp, payload_type))
+                elif payload_type == PAYLOAD_VIDEO_SLICE:  # 视频条带
+                    asyncio.create_task(self.play_slice(payload, sequence_number, total_packets, client_id,
+                                                        data_.frame_id, data_.stream_sequence))
+                elif payload_type == PAYLOAD_VIDEO_FEC:  # 视频校验包
+                    asyncio.create_task(self.play_parity(payload, client_id, data_.frame_id,
+                                                         bool(data_.flags & FLAG_SLICE)))
+                elif payload_type == PAYLOAD_NACK and data_.stream_id == self.stream_id:  # 针对本客户端视频流的重传请求
+                    self.handle_nack(payload)
+                elif payload_type == PAYLOAD_REPORT and data_.stream_id == self.stream_id:  # 关于本客户端媒体流的接收报告
+                    self.handle_report(payload)
             except Exception as e:
                 print(f"Error processing data: {e}")
 
@@ -313,10 +635,10 @@ class RTPClient:
                 continue
             rtp_data = self.parse_rtp_packet(packet)
             print(f"Processing RTP packet: {rtp_data}")
-            if rtp_data["payload_type"] == 0x01:  # 视频数据
-                self.handle_video_data(rtp_data["payload"])
-            elif rtp_data["payload_type"] == 0x02:  # 音频数据
-                self.handle_audio_data(rtp_data["payload"])
+            if rtp_data.payload_type == 0x01:  # 视频数据
+                self.handle_video_data(rtp_data.payload)
+            elif rtp_data.payload_type in AUDIO_PAYLOAD_TYPES:  # 音频数据
+                self.handle_audio_data(rtp_data.payload, rtp_data.payload_type)
 
     def handle_video_data(self, video_payload):
         """
@@ -329,12 +651,13 @@ class RTPClient:
             cv2.imshow("Video Stream", frame)
             cv2.waitKey(1)
 
-    def handle_audio_data(self, audio_payload):
+    def handle_audio_data(self, audio_payload, payload_type=PAYLOAD_AUDIO):
         """
         处理音频数据并播放。
         :param audio_payload: 音频负载数据
+        :param payload_type: 负载类型（标识音频编码）
         """
-        self.audio_stream.write(audio_payload)
+        self.audio_player.put(None, audio_payload, payload_type=payload_type)
 
     def set_meeting_id(self, meeting_id):
         """
@@ -343,26 +666,74 @@ class RTPClient:
         """
         self.meeting_id = meeting_id
 
-    async def play_audio(self, audio_payload, client_id):
+    async def play_audio(self, audio_payload, client_id, sequence=None, timestamp=None, payload_type=PAYLOAD_AUDIO):
         """
-        播放音频数据。
+        播放音频数据（解码后放入该音频源的抖动缓冲）。P2P 时对端的采样率可能与本端不同，播放前重采样；
+        经服务器时由服务器转换为本端协商的采样率。
         :param audio_payload: 音频数据
+        :param sequence: v2 流内序列号（旧版包头为 None）
+        :param timestamp: 媒体时间戳（毫秒）
+        :param payload_type: 负载类型（标识音频编码）
+        """
+        sample_rate = self.p2p_sample_rate if self.mode == "p2p" else None
+        await self.audio_player.add_audio(client_id, audio_payload, sequence, timestamp, payload_type, sample_rate)
+
+    async def play_parity(self, parity_payload, client_id, frame_id, slice_=False):
+        """
+        用 FEC 校验包恢复丢失的视频分片，恢复出完整帧时显示。
+        :param parity_payload: 校验负载
+        :param frame_id: 帧 ID
+        :param slice_: 校验包是否保护视频条带
+        """
+        assembler = (self.slice_assemblers if slice_ else self.video_assemblers).get(client_id)
+        if assembler is None:
+            return  # 还没有收到该流的视频包
+        frame = await assembler.add_parity(parity_payload, frame_id)
+        if frame is None:
+            return
+        if slice_:
+            frame = self.slice_compositors[client_id].add_band(*frame)
+            if frame is None:
+                return
+        await media_manager.add_video(client_id, frame)
+
+    async def play_slice(self, slice_payload, sequence_number, total_packets, client_id, frame_id, stream_sequence):
         """
-        await self.audio_player.add_audio(client_id, audio_payload)
+        重组视频条带并合成画面，缺失的条带沿用上一幅画面的内容。
+        :param slice_payload: 条带分片数据
+        :param sequence_number: 条带内分片序号
+        :param total_packets: 条带的分片总数
+        :param frame_id: 条带的帧 ID
+        :param stream_sequence: 流内序列号
+        """
+        if client_id not in self.slice_assemblers:
+            self.slice_assemblers[client_id] = SliceAssembler()
+            self.slice_compositors[client_id] = SliceCompositor()
+        band = await self.slice_assemblers[client_id].add_packet(slice_payload, sequence_number, total_packets,
+                                                                 frame_id, stream_sequence)
+        if band is None:
+            return
+        frame = self.slice_compositors[client_id].add_band(*band)
+        if frame is not None:
+            await media_manager.add_video(client_id, frame)
 
-    async def play_video(self, video_payload, sequence_number, total_packets, client_id):
+    async def play_video(self, video_payload, sequence_number, total_packets, client_id, frame_id=None,
+                         stream_sequence=None):
         """
         解析视频数据并显示，处理视频包的合并。
         :param video_payload: 视频数据
         :param sequence_number: 视频包的序列号
         :param total_packets: 视频总包数
+        :param frame_id: 帧 ID（v2 包头，旧版包头为 None）
+        :param stream_sequence: 流内序列号（v2 包头，旧版包头为 None）
         """
         if client_id not in self.video_assemblers:
             self.video_assemblers[client_id] = VideoPacketAssembler(frame_width=960, frame_height=540)
             self.video_assemblers[client_id].start_assembling(total_packets)
 
         # 将视频包添加到组装器中
-        frame = await self.video_assemblers[client_id].add_packet(video_payload, sequence_number, total_packets)
+        frame = await self.video_assemblers[client_id].add_packet(video_payload, sequence_number, total_packets, frame_id,
+                                                                  stream_sequence)
 
         if frame is not None:
             # # 获取当前时间戳
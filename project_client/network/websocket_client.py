@@ -7,6 +7,9 @@ import uuid
 
 from user_interface import OperationInterface
 from shared.uiHandler import UIHandler
+from shared.protocols import (AUDIO_CODEC_PCM, LEGACY_SAMPLE_RATE, RTP_VERSION_LEGACY, SUPPORTED_AUDIO_CODECS,
+                              SUPPORTED_FRAME_DURATIONS, SUPPORTED_RTP_VERSIONS, SUPPORTED_SAMPLE_RATES,
+                              audio_frame_samples)
 
 ui = UIHandler()
 
@@ -31,6 +34,9 @@ class WebSocketClient:
         # self.ui = UIHandler()
         self.cil = OperationInterface(self)
         self.websocket_lock = asyncio.Lock()  # 在类初始化时创建锁
+        self.rtp_version = RTP_VERSION_LEGACY  # INIT 握手中与服务器协商的 RTP 包头版本
+        self.audio_codec = AUDIO_CODEC_PCM  # INIT 握手中与服务器协商的音频编码
+        self.audio_format = (LEGACY_SAMPLE_RATE, audio_frame_samples(LEGACY_SAMPLE_RATE, None))  # (采样率, 每帧采样点数)
 
     async def connect(self):
         """
@@ -40,9 +46,17 @@ class WebSocketClient:
             try:
                 # self.ui.update_text("尝试连接服务器...")
                 self.websocket = await websockets.connect(self.server_url)
-                init_message = {"action": "INIT", "client_id": self.client_id}
+                init_message = {"action": "INIT", "client_id": self.client_id, "rtp_versions": SUPPORTED_RTP_VERSIONS,
+                                "audio_codecs": SUPPORTED_AUDIO_CODECS, "sample_rates": SUPPORTED_SAMPLE_RATES,
+                                "frame_durations": SUPPORTED_FRAME_DURATIONS}
                 await self.websocket.send(json.dumps(init_message))
-                response = await self.websocket.recv()
+                response = json.loads(await self.websocket.recv())
+                # 旧服务器不返回 rtp_version、audio_codec 和 audio_format，此时继续使用旧版包头和 44.1 kHz 原始 PCM
+                self.rtp_version = response.get("rtp_version") or RTP_VERSION_LEGACY
+                self.audio_codec = response.get("audio_codec") or AUDIO_CODEC_PCM
+                audio_format = response.get("audio_format") or {}
+                sample_rate = audio_format.get("sample_rate") or LEGACY_SAMPLE_RATE
+                self.audio_format = (sample_rate, audio_frame_samples(sample_rate, audio_format.get("frame_duration")))
                 # self.ui.update_text(f"INIT Response:, {response}")
                 ui.update_text(f"INIT Response:, {response}")
                 break  # 成功连接后退出循环
@@ -112,6 +126,13 @@ class WebSocketClient:
         }
         await self._send_message(register_message)
 
+    async def set_rtp_mtu(self, mtu):
+        """
+        告知服务器到本客户端的路径 MTU。
+        :param mtu: 探测到的路径 MTU
+        """
+        await self._send_message({"action": "SET_MTU", "mtu": mtu})
+
     async def heartbeat(self):
         """
         定时发送心跳消息。
@@ -218,8 +239,14 @@ class WebSocketClient:
             elif action == "REGISTER_RTP_ACK":
                 # 处理 RTP 地址注册确认
                 message = data.get("message")
+                stream_id = data.get("stream_id")
+                if stream_id is not None:
+                    self.cil.set_stream(stream_id, data.get("rtp_version") or self.rtp_version)
                 ui.update_text(f"[服务器响应] {message}")
 
+            elif action == "SET_MTU_ACK":
+                ui.update_text(f"[服务器响应] {data.get('message')}")
+
             elif action == "PONG":
                 # 处理心跳确认
                 ui.update_text(f"[服务器响应] 心跳回复: {data}")
@@ -236,7 +263,8 @@ class WebSocketClient:
                 message = data.get("message")
                 ui.update_text(
                     f"[服务器响应] P2P 地址分配: {message}, 客户端 ID: {to_client_id}, IP: {ip}, 端口: {port}")
-                self.cil.connect_to_p2p(ip, port)
+                self.cil.connect_to_p2p(ip, port, data.get("rtp_version"), data.get("audio_codec"),
+                                        data.get("sample_rate"))
 
             elif action == "STOP_P2P":
                 self.cil.stop_p2p()
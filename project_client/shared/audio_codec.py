@@ -0,0 +1,182 @@
+# 音频编码：G.711 μ-law（每个采样 1 字节，码率为 PCM 的一半）和 IMA-ADPCM（每个采样 4 位，码率为 PCM 的四分之一）。
+# 编码在 INIT 握手时按会话协商，数据包的负载类型标识实际使用的编码，接收端（客户端播放器和服务器混音）按负载类型解码。
+# ADPCM 每个采样 1～2 µs 的 Python 运算（20 ms 一帧约 0.3～0.4 ms），只用于点对点；经服务器的会话协商 μ-law（服务器为每个接收端编码一路混音）。
+# μ-law 用整张查找表做向量化编解码；ADPCM 的预测值逐采样递推，无法向量化，用预先计算的
+# (步长索引, 编码) → (差值, 下一个步长索引) 表把每个采样的运算减到两次查表，半字节的打包和拆包是向量化的
+
+import numpy as np
+
+from shared.protocols import (ADPCM_HEADER, AUDIO_CODEC_ADPCM, AUDIO_CODEC_PCM, AUDIO_CODEC_PCMU, PAYLOAD_AUDIO,
+                              PAYLOAD_AUDIO_ADPCM, PAYLOAD_AUDIO_PCMU)
+
+MULAW_BIAS = 0x84
+MULAW_CLIP = 32635
+
+IMA_INDEX_TABLE = (-1, -1, -1, -1, 2, 4, 6, 8, -1, -1, -1, -1, 2, 4, 6, 8)
+IMA_STEP_TABLE = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45, 50, 55, 60, 66, 73, 80, 88, 97,
+    107, 118, 130, 143, 157, 173, 190, 209, 230, 253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796,
+    876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871,
+    5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623,
+    27086, 29794, 32767)
+
+
+def _build_mulaw_tables():
+    """
+    μ-law 编码表（按 int16 的无符号位模式索引，65536 项）和解码表（256 项）。
+    """
+    samples = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.int32)
+    sign = np.where(samples < 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(samples), MULAW_CLIP) + MULAW_BIAS
+    exponent = np.floor(np.log2(magnitude >> 7)).astype(np.int32)
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    encode = (~(sign | exponent << 4 | mantissa) & 0xFF).astype(np.uint8)
+
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    magnitude = (((codes & 0x0F) << 3) + MULAW_BIAS << exponent) - MULAW_BIAS
+    decode = np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+    return encode, decode
+
+
+def _build_adpcm_tables():
+    """
+    ADPCM 递推表，按 步长索引 × 16 + 编码 索引：该编码对应的有符号差值和下一个步长索引。
+    """
+    deltas, next_indexes = [], []
+    for index, step in enumerate(IMA_STEP_TABLE):
+        for code in range(16):
+            delta = step >> 3
+            if code & 4:
+                delta += step
+            if code & 2:
+                delta += step >> 1
+            if code & 1:
+                delta += step >> 2
+            deltas.append(-delta if code & 8 else delta)
+            next_indexes.append(min(max(index + IMA_INDEX_TABLE[code], 0), len(IMA_STEP_TABLE) - 1))
+    return deltas, next_indexes
+
+
+MULAW_ENCODE, MULAW_DECODE = _build_mulaw_tables()
+ADPCM_DELTAS, ADPCM_NEXT_INDEX = _build_adpcm_tables()
+
+
+def pcm_samples(data):
+    """
+    把 16 位 PCM 数据（bytes、memoryview 或 int16 数组）转换为 int16 数组（不拷贝）。
+    """
+    if isinstance(data, np.ndarray):
+        return data.astype(np.int16, copy=False).ravel()
+    return np.frombuffer(data, dtype=np.int16, count=len(data) // 2)
+
+
+class PcmCodec:
+    """
+    原始 16 位 PCM（不压缩），兼容未协商编码的旧客户端。
+    """
+    name = AUDIO_CODEC_PCM
+    payload_type = PAYLOAD_AUDIO
+
+    def encode(self, data):
+        return pcm_samples(data).tobytes()
+
+    @staticmethod
+    def decode(payload):
+        return bytes(payload[:len(payload) // 2 * 2])
+
+
+class MulawCodec:
+    """
+    G.711 μ-law：每个 16 位采样查表压缩为 1 字节。
+    """
+    name = AUDIO_CODEC_PCMU
+    payload_type = PAYLOAD_AUDIO_PCMU
+
+    def encode(self, data):
+        return MULAW_ENCODE[pcm_samples(data).view(np.uint16)].tobytes()
+
+    @staticmethod
+    def decode(payload):
+        return MULAW_DECODE[np.frombuffer(payload, dtype=np.uint8)].tobytes()
+
+
+class AdpcmCodec:
+    """
+    IMA-ADPCM：每个采样编码为 4 位，两个采样一个字节（低半字节在前）。
+    每个数据包以 ADPCM_HEADER 开头，记录本包第一个采样之前的预测值和步长索引，
+    因此每个包可以独立解码，丢包不会影响后续数据包；编码端的预测状态跨数据包连续。
+    """
+    name = AUDIO_CODEC_ADPCM
+    payload_type = PAYLOAD_AUDIO_ADPCM
+
+    def __init__(self):
+        self.predictor = 0
+        self.index = 0
+
+    def encode(self, data):
+        samples = pcm_samples(data)
+        header = ADPCM_HEADER.pack(self.predictor, self.index, len(samples) & 1)
+        predictor, index = self.predictor, self.index
+        codes = []
+        append = codes.append
+        for sample in samples.tolist():
+            diff = sample - predictor
+            step = IMA_STEP_TABLE[index]
+            if diff < 0:
+                code = 8 | min((-diff << 2) // step, 7)
+            else:
+                code = min((diff << 2) // step, 7)
+            append(code)
+            position = index << 4 | code
+            predictor = min(max(predictor + ADPCM_DELTAS[position], -32768), 32767)
+            index = ADPCM_NEXT_INDEX[position]
+        self.predictor, self.index = predictor, index
+
+        nibbles = np.zeros(len(codes) + (len(codes) & 1), dtype=np.uint8)
+        nibbles[:len(codes)] = codes
+        return header + (nibbles[0::2] | nibbles[1::2] << 4).tobytes()
+
+    @staticmethod
+    def decode(payload):
+        if len(payload) < ADPCM_HEADER.size:
+            return b''
+        predictor, index, padding = ADPCM_HEADER.unpack_from(payload)
+        packed = np.frombuffer(payload, dtype=np.uint8, offset=ADPCM_HEADER.size)
+        nibbles = np.empty(2 * len(packed), dtype=np.uint8)
+        nibbles[0::2] = packed & 0x0F
+        nibbles[1::2] = packed >> 4
+        if padding:
+            nibbles = nibbles[:-1]
+        index = min(index, len(IMA_STEP_TABLE) - 1)
+        samples = []
+        append = samples.append
+        for code in nibbles.tolist():
+            position = index << 4 | code
+            predictor = min(max(predictor + ADPCM_DELTAS[position], -32768), 32767)
+            index = ADPCM_NEXT_INDEX[position]
+            append(predictor)
+        return np.array(samples, dtype=np.int16).tobytes()
+
+
+CODECS = {codec.name: codec for codec in (PcmCodec, MulawCodec, AdpcmCodec)}
+DECODERS = {codec.payload_type: codec.decode for codec in (PcmCodec, MulawCodec, AdpcmCodec)}
+
+
+def create_encoder(name):
+    """
+    创建某个音频编码的编码器（ADPCM 编码器带有跨数据包的状态，每个发送的音频流一个实例）。
+    :param name: 协商的编码名称，未知的名称使用原始 PCM
+    """
+    return CODECS.get(name, PcmCodec)()
+
+
+def decode_audio(payload_type, payload):
+    """
+    按负载类型把音频负载解码为 16 位 PCM。
+    :param payload_type: PAYLOAD_AUDIO、PAYLOAD_AUDIO_PCMU 或 PAYLOAD_AUDIO_ADPCM
+    :param payload: 音频负载（bytes 或 memoryview）
+    :return: PCM 数据（bytes），未知的负载类型返回 None
+    """
+    decode = DECODERS.get(payload_type)
+    return decode(payload) if decode else None
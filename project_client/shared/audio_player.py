@@ -1,73 +1,192 @@
-import asyncio
+import threading
+import time
+
+import numpy as np
 import pyaudio
 
+from shared.audio_codec import decode_audio
+from shared.jitter_buffer import JitterBuffer
+from shared.protocols import PAYLOAD_AUDIO
+from shared.resampler import Resampler
+
+SOURCE_TIMEOUT = 5.0  # 音频源超过该时间（秒）没有数据包时移除（参与者离开时客户端不会收到通知）
+EXPIRE_CHECK_CALLBACKS = 50  # 每隔多少次回调检查一次超时的音频源
+
 
 class AudioPlayer:
-    def __init__(self, sample_rate=44100, channels=1, format=pyaudio.paInt16):
+    def __init__(self, sample_rate=44100, channels=1, format=pyaudio.paInt16, frame_size=1024):
         """
-        初始化异步音频播放器。
+        初始化异步音频播放器。所有远端音频源共用一个回调模式的输出流：每个音频源有自己的抖动缓冲，
+        音频线程在回调中从各抖动缓冲取数据、按增益混合后交给设备，事件循环只负责把收到的数据包放入抖动缓冲。
         :param sample_rate: 音频采样率（默认 44100 Hz）。
         :param channels: 通道数（默认单声道）。
         :param format: 音频格式（默认 16 位 PCM）。
+        :param frame_size: 每次回调的采样点数（会话建立后由 set_format 设置为协商的帧长）。
         """
         self.sample_rate = sample_rate
         self.channels = channels
         self.format = format
-        self.audio_queues = {}  # 存储每个客户端的音频队列
+        self.frame_size = frame_size
+        self.jitter_buffers = {}  # 存储每个客户端的 JitterBuffer
+        self.gains = {}  # 存储每个客户端的增益
+        self.last_seen = {}  # 存储每个客户端最近一次收到数据包的时刻
+        self.resamplers = {}  # 存储 {client_id: Resampler}，音频源的采样率与播放采样率不同时（如 P2P 对端是旧客户端）使用
+        self.lock = threading.Lock()  # 保护抖动缓冲（事件循环写入、音频线程读取）
         self.running = True
         self.pyaudio_instance = pyaudio.PyAudio()
+        self.stream = None  # 第一个音频源出现时打开
+        self.frames = np.zeros((0, frame_size), dtype=np.int16)  # 混音时各音频源的一帧，按音频源数扩容
+        self.gain_vector = np.zeros(0, dtype=np.float32)
+        self.output = np.zeros(frame_size, dtype=np.int16)
+        self.callbacks = 0  # 回调次数（音频线程取数据的次数）
 
-    async def play_audio_stream(self, client_id, audio_queue):
-        """
-        异步播放某个客户端的音频流。
-        :param client_id: 客户端 ID。
-        :param audio_queue: 客户端的音频队列。
-        """
-        stream = self.pyaudio_instance.open(
+    def _open_stream(self):
+        self.stream = self.pyaudio_instance.open(
             format=self.format,
             channels=self.channels,
             rate=self.sample_rate,
-            output=True
+            output=True,
+            frames_per_buffer=self.frame_size,
+            stream_callback=self._callback
         )
+        self.stream.start_stream()
 
-        while self.running:
-            audio_data = await audio_queue.get()
-            if audio_data is None:  # 退出信号
-                break
+    def set_format(self, sample_rate, frame_size):
+        """
+        设置协商的音频格式。格式变化时清空各音频源的抖动缓冲，已打开的输出流关闭后在下一个数据包到达时按新格式重新打开。
+        :param sample_rate: 采样率
+        :param frame_size: 每次回调的采样点数
+        """
+        if (sample_rate, frame_size) == (self.sample_rate, self.frame_size):
+            return
+        stream, self.stream = self.stream, None
+        if stream is not None:
+            stream.stop_stream()
+            stream.close()
+        with self.lock:
+            self.sample_rate = sample_rate
+            self.frame_size = frame_size
+            self.jitter_buffers.clear()
+            self.last_seen.clear()
+        self.resamplers.clear()
 
-            try:
-                # 播放音频数据
-                stream.write(audio_data)
-            except Exception as e:
-                raise ValueError(f"Error playing audio for client {client_id}: {e}")
+    def _callback(self, in_data, frame_count, time_info, status):
+        """
+        PyAudio 回调（在音频线程中运行）：从每个抖动缓冲取 frame_count 个采样，加权求和并裁剪到 int16。
+        """
+        with self.lock:
+            if self.callbacks % EXPIRE_CHECK_CALLBACKS == 0:
+                self._expire_sources()
+            sources = list(self.jitter_buffers.items())
+            if len(sources) > len(self.frames) or frame_count != self.frames.shape[1]:
+                capacity = len(self.frames)
+                if len(sources) > capacity:
+                    capacity = max(len(sources), 2 * capacity)  # 音频源增加时容量加倍
+                self.frames = np.zeros((capacity, frame_count), dtype=np.int16)
+                self.gain_vector = np.zeros(capacity, dtype=np.float32)
+                self.output = np.zeros(frame_count, dtype=np.int16)
+            for row, (client_id, jitter_buffer) in enumerate(sources):
+                jitter_buffer.read(frame_count, out=self.frames[row])
+                self.gain_vector[row] = self.gains.get(client_id, 1.0)
+        count = len(sources)
+        mixed = self.gain_vector[:count] @ self.frames[:count]
+        np.clip(mixed, -32768, 32767, out=mixed)
+        np.copyto(self.output, mixed, casting='unsafe')
+        self.callbacks += 1
+        return self.output.tobytes(), pyaudio.paContinue if self.running else pyaudio.paComplete
 
-        stream.stop_stream()
-        stream.close()
+    def _expire_sources(self):
+        """
+        移除超过 SOURCE_TIMEOUT 没有数据包的音频源（调用时持有锁），混音的开销不随离开的参与者累积。
+        """
+        now = time.monotonic()
+        for client_id in [client_id for client_id, seen in self.last_seen.items() if now - seen > SOURCE_TIMEOUT]:
+            self.jitter_buffers.pop(client_id, None)
+            self.last_seen.pop(client_id)
+            self.resamplers.pop(client_id, None)
 
-    async def add_audio(self, client_id, audio_data):
+    def put(self, client_id, audio_data, sequence=None, timestamp=None, payload_type=PAYLOAD_AUDIO, sample_rate=None):
         """
-        添加音频数据到对应客户端的队列。
-        如果客户端不存在，则创建新的队列和任务。
+        把音频数据解码后放入对应客户端的抖动缓冲，客户端不存在时创建新的抖动缓冲。
         :param client_id: 客户端 ID。
-        :param audio_data: 音频数据（PCM 格式）。
+        :param audio_data: 音频数据（按 payload_type 编码）。
+        :param sequence: v2 流内序列号（旧版包头为 None）。
+        :param timestamp: 媒体时间戳（毫秒）。
+        :param payload_type: 负载类型（PCM、μ-law 或 ADPCM）。
+        :param sample_rate: 音频源的采样率，与播放采样率不同时先重采样（None 表示与播放采样率相同）。
         """
-        if client_id not in self.audio_queues:
-            # 创建新的音频队列和任务
-            audio_queue = asyncio.Queue()
-            self.audio_queues[client_id] = audio_queue
-            await asyncio.create_task(self.play_audio_stream(client_id, audio_queue))
+        if not self.running:
+            return
+        audio_data = decode_audio(payload_type, audio_data)
+        if not audio_data:
+            return
+        if sample_rate and sample_rate != self.sample_rate:
+            resampler = self.resamplers.get(client_id)
+            if resampler is None or (resampler.input_rate, resampler.output_rate) != (sample_rate, self.sample_rate):
+                resampler = self.resamplers[client_id] = Resampler(sample_rate, self.sample_rate)
+            audio_data = resampler.process(audio_data).tobytes()
+        with self.lock:
+            jitter_buffer = self.jitter_buffers.get(client_id)
+            if jitter_buffer is None:
+                jitter_buffer = self.jitter_buffers[client_id] = JitterBuffer(self.sample_rate)
+            jitter_buffer.put(audio_data, sequence, timestamp)
+            self.last_seen[client_id] = time.monotonic()
+        if self.stream is None:
+            self._open_stream()
 
-        # 将音频数据放入队列
-        await self.audio_queues[client_id].put(audio_data)
+    async def add_audio(self, client_id, audio_data, sequence=None, timestamp=None, payload_type=PAYLOAD_AUDIO,
+                        sample_rate=None):
+        """
+        添加音频数据到对应客户端的抖动缓冲（见 put）。
+        """
+        self.put(client_id, audio_data, sequence, timestamp, payload_type, sample_rate)
+
+    def set_gain(self, client_id, gain):
+        """
+        设置某个音频源的增益（1.0 为原音量，0 为静音）。
+        :param client_id: 客户端 ID。
+        :param gain: 增益
+        """
+        with self.lock:
+            self.gains[client_id] = max(float(gain), 0.0)
+
+    def remove_source(self, client_id):
+        """
+        移除某个客户端的音频源。
+        :param client_id: 客户端 ID。
+        """
+        with self.lock:
+            self.jitter_buffers.pop(client_id, None)
+            self.gains.pop(client_id, None)
+            self.last_seen.pop(client_id, None)
+        self.resamplers.pop(client_id, None)
+
+    def remove_all_sources(self):
+        """
+        移除所有音频源（离开会议、P2P 与服务器转发切换时，之前的音频源不会再有数据）。
+        """
+        for client_id in list(self.jitter_buffers):
+            self.remove_source(client_id)
+
+    def get_stats(self):
+        """
+        获取每个音频源的抖动缓冲统计（播放时延、填补、丢弃等）和增益。
+        :return: {client_id: 统计}
+        """
+        with self.lock:
+            return {client_id: dict(jitter_buffer.get_stats(), gain=self.gains.get(client_id, 1.0))
+                    for client_id, jitter_buffer in self.jitter_buffers.items()}
 
     async def stop(self):
         """
-        停止所有音频流。
+        停止输出流。
         """
         self.running = False
-        for client_id, audio_queue in self.audio_queues.items():
-            # 发送退出信号
-            await audio_queue.put(None)
-        self.audio_queues.clear()
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        with self.lock:
+            self.jitter_buffers.clear()
+            self.last_seen.clear()
         self.pyaudio_instance.terminate()
-
@@ -0,0 +1,91 @@
+# 前向纠错（FEC）：把一帧的数据分片按 K 个一组，每组额外发送一个 XOR 校验分片
+# 接收端丢失组内任意一个分片时可以直接由校验分片恢复，不需要重传；组大小 K 按丢包率自适应
+
+import struct
+
+FEC_HEADER = struct.Struct('!HHHH')  # 校验负载前缀：帧的分片总数, 组内首个分片序号, 组大小, 组内各分片长度的异或
+FEC_GROUP_SIZES = (4, 6, 8, 12, 16, 24, 32)  # 可选的组大小，越小冗余越高
+DEFAULT_GROUP_SIZE = 16
+TARGET_GROUP_LOSS = 0.01  # 一组内丢失 2 个及以上分片（无法恢复）的目标概率
+
+
+def xor_bytes(chunks, size):
+    """
+    把各分片末尾补零到 size 字节后逐字节异或。
+    :param chunks: 分片列表（bytes/memoryview）
+    :param size: 结果长度
+    """
+    value = 0
+    for chunk in chunks:
+        value ^= int.from_bytes(chunk, 'big') << (8 * (size - len(chunk)))
+    return value.to_bytes(size, 'big')
+
+
+def group_loss_probability(group_size, loss_rate):
+    """
+    独立丢包模型下，group_size 个数据分片加 1 个校验分片中丢失 2 个及以上的概率。
+    """
+    n = group_size + 1
+    keep = 1 - loss_rate
+    return 1 - keep ** n - n * loss_rate * keep ** (n - 1)
+
+
+def recover_fragment(parity, chunks, lengths, length_xor):
+    """
+    由校验分片和组内其余分片恢复丢失的分片。
+    :param parity: 校验分片（长度等于分片大小）
+    :param chunks: 组内其余分片
+    :param lengths: 组内其余分片的长度
+    :param length_xor: 组内所有分片长度的异或
+    :return: 恢复出的分片
+    """
+    length = length_xor
+    for chunk_length in lengths:
+        length ^= chunk_length
+    return xor_bytes([parity, *chunks], len(parity))[:length]
+
+
+class FecEncoder:
+    def __init__(self, group_size=DEFAULT_GROUP_SIZE, adaptive=True):
+        """
+        XOR 校验编码器，每个发送的视频流一个实例。
+        :param group_size: 初始组大小 K
+        :param adaptive: 是否按 update_loss_rate 报告的丢包率调整 K
+        """
+        self.group_size = group_size
+        self.adaptive = adaptive
+        self.loss_rate = 0.0
+
+    def update_loss_rate(self, loss_rate):
+        """
+        根据测得的丢包率选择组大小：在组不可恢复概率不超过 TARGET_GROUP_LOSS 的前提下取最大的 K（冗余最小）。
+        :param loss_rate: 丢包率（0~1）
+        """
+        self.loss_rate = loss_rate
+        if not self.adaptive:
+            return
+        group_size = FEC_GROUP_SIZES[0]
+        for candidate in FEC_GROUP_SIZES:
+            if group_loss_probability(candidate, loss_rate) <= TARGET_GROUP_LOSS:
+                group_size = candidate
+        self.group_size = group_size
+
+    def encode(self, payload, fragment_size):
+        """
+        为一帧生成校验分片，分片方式必须与数据包的分包一致。
+        :param payload: 编码后的帧数据
+        :param fragment_size: 数据分片大小（分包器的 payload_size）
+        :return: 依次生成 (组序号, 组数, 校验负载前缀, 校验分片)，组序号从 1 开始
+        """
+        view = memoryview(payload)
+        total_packets = max(1, -(-len(view) // fragment_size))
+        group_count = -(-total_packets // self.group_size)
+        for group in range(group_count):
+            first = group * self.group_size + 1
+            last = min(total_packets, first + self.group_size - 1)
+            chunks = [view[(index - 1) * fragment_size:index * fragment_size] for index in range(first, last + 1)]
+            length_xor = 0
+            for chunk in chunks:
+                length_xor ^= len(chunk)
+            prefix = FEC_HEADER.pack(total_packets, first, last - first + 1, length_xor)
+            yield group + 1, group_count, prefix, xor_bytes(chunks, fragment_size)
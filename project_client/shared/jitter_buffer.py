@@ -0,0 +1,184 @@
+# 音频抖动缓冲：每个远端音频源一个，按流内序列号排序，播放端按固定帧长取数据。
+# 目标深度随测得的到达抖动（RFC 3550 6.4.1）调整；缓冲积压超过目标较多时丢弃最旧的数据包，防止时延越积越大；
+# 缺包或欠载时用衰减后的上一帧（只重复一次）或静音填补
+
+import time
+
+import numpy as np
+
+from shared.rtcp import wrap_transit
+
+MIN_DELAY = 0.04  # 目标深度下限（秒）
+MAX_DELAY = 0.4  # 目标深度上限（秒）
+JITTER_MULTIPLIER = 3.0  # 目标深度 = 抖动 × 该倍数 + MIN_DELAY
+DRIFT_MARGIN = 0.06  # 缓冲深度超过 目标 + 该值 时丢弃最旧的数据包（秒）
+CONCEAL_GAIN = 0.5  # 重复上一帧填补时的衰减系数
+
+
+class JitterBuffer:
+    def __init__(self, sample_rate=44100, min_delay=MIN_DELAY, max_delay=MAX_DELAY):
+        """
+        单个音频源的抖动缓冲（16 位单声道 PCM）。
+        :param sample_rate: 采样率
+        :param min_delay: 目标深度下限（秒）
+        :param max_delay: 目标深度上限（秒）
+        """
+        self.sample_rate = sample_rate
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.packets = {}  # 存储 {扩展序列号: 采样数组}
+        self.next_sequence = None  # 下一个要播放的扩展序列号
+        self.highest_sequence = None  # 收到的最大扩展序列号
+        self.arrivals = 0  # 没有序列号（旧版包头）时按到达顺序编号
+        self.offset = 0  # 当前数据包已播放的采样数
+        self.buffered = 0  # 缓冲中尚未播放的采样数
+        self.playing = False  # False 时正在预缓冲，深度达到目标后才开始播放
+        self.transit = None
+        self.jitter = 0.0  # 到达抖动（毫秒）
+        self.target = round(sample_rate * min_delay)  # 目标深度（采样数）
+        self.packet_size = 0  # 最近播放的数据包的采样数，用于估计缺失数据包的长度
+        self.gap = 0  # 尚未填补的缺包采样数
+        self.last_frame = None  # 最近一次完整播放的帧，用于填补
+        self.concealing = False  # 是否已经在填补（连续缺失时不再重复上一帧）
+        self.stats = {"received": 0, "played": 0, "concealed": 0, "lost": 0, "discarded": 0, "late": 0,
+                      "underruns": 0, "playout_delay": 0.0}
+
+    def _extend(self, sequence):
+        """
+        把 16 位序列号扩展为单调递增的整数（以收到的最大序列号为参照）。
+        """
+        if self.highest_sequence is None:
+            return sequence
+        delta = (sequence - self.highest_sequence + 0x8000) % 0x10000 - 0x8000
+        return self.highest_sequence + delta
+
+    def put(self, payload, sequence=None, timestamp=None, arrival=None):
+        """
+        放入一个收到的音频包。
+        :param payload: PCM 数据
+        :param sequence: v2 流内序列号（旧版包头为 None，按到达顺序播放）
+        :param timestamp: 媒体时间戳（毫秒），用于估计抖动
+        :param arrival: 到达时刻（毫秒，默认为当前时间）
+        """
+        samples = np.frombuffer(payload, dtype=np.int16, count=len(payload) // 2)
+        if not len(samples):
+            return
+        if sequence is None:
+            sequence = self.arrivals & 0xFFFF
+            self.arrivals += 1
+        sequence = self._extend(sequence)
+        self.stats["received"] += 1
+        if self.next_sequence is not None and sequence < self.next_sequence or sequence in self.packets:
+            self.stats["late"] += 1  # 已经播放过（或被填补跳过）的序号，或重复的包
+            return
+        if self.highest_sequence is None or sequence > self.highest_sequence:
+            self.highest_sequence = sequence
+        if self.next_sequence is None:
+            self.next_sequence = sequence
+        self.packets[sequence] = samples
+        self.buffered += len(samples)
+
+        if timestamp is not None:
+            transit = wrap_transit((time.time() * 1000 if arrival is None else arrival) - timestamp)
+            if self.transit is not None:
+                self.jitter += (abs(transit - self.transit) - self.jitter) / 16
+            self.transit = transit
+            delay = min(self.jitter * JITTER_MULTIPLIER / 1000 + self.min_delay, self.max_delay)
+            self.target = round(self.sample_rate * delay)
+
+    def read(self, count, out=None):
+        """
+        取出 count 个采样用于播放，数据不足时填补。
+        :param out: 写入的 int16 数组（长度为 count），为 None 时新建
+        :return: int16 数组
+        """
+        if out is None:
+            output = np.zeros(count, dtype=np.int16)
+        else:
+            output = out
+            output[:] = 0
+        if not self.playing:
+            if self.buffered < self.target:
+                return output  # 预缓冲
+            self.playing = True
+
+        filled = 0
+        concealed = False
+        while filled < count:
+            if self.gap:
+                take = min(self.gap, count - filled)
+                self._conceal(output, filled, take)
+                filled += take
+                self.gap -= take
+                concealed = True
+                continue
+            if not self.packets:
+                break
+            packet = self.packets.get(self.next_sequence)
+            if packet is None:
+                # 缺包：缓冲深度达到目标时不再等待，按上一个包的长度填补后跳过该序号
+                if self.buffered < self.target:
+                    break
+                self.next_sequence += 1
+                self.offset = 0
+                self.gap = self.packet_size
+                self.stats["lost"] += 1
+                continue
+            take = min(count - filled, len(packet) - self.offset)
+            output[filled:filled + take] = packet[self.offset:self.offset + take]
+            filled += take
+            self.offset += take
+            self.buffered -= take
+            self.concealing = False
+            if self.offset == len(packet):
+                del self.packets[self.next_sequence]
+                self.next_sequence += 1
+                self.offset = 0
+                self.packet_size = len(packet)
+
+        if filled < count:
+            self._conceal(output, filled, count - filled)
+            concealed = True
+            if not self.packets:
+                self.stats["underruns"] += 1
+                self.playing = False  # 缓冲耗尽，重新预缓冲到目标深度
+        if concealed:
+            self.stats["concealed"] += 1
+        elif self.last_frame is None or len(self.last_frame) != count:
+            self.last_frame = output.copy()
+        else:
+            np.copyto(self.last_frame, output)
+        self.stats["played"] += 1
+        self._drop_excess()
+        self.stats["playout_delay"] += (self.buffered / self.sample_rate - self.stats["playout_delay"]) / 16
+        return output
+
+    def _conceal(self, output, start, count):
+        """
+        填补帧中 [start, start + count) 的部分：刚开始缺失时重复上一帧的末尾（衰减），连续缺失时为静音。
+        """
+        if self.last_frame is not None and not self.concealing:
+            source = self.last_frame[-count:]
+            output[start:start + len(source)] = (source * CONCEAL_GAIN).astype(np.int16)
+        self.concealing = True
+
+    def _drop_excess(self):
+        """
+        缓冲深度超过 目标 + DRIFT_MARGIN 时丢弃最旧的数据包，直到回到目标深度。
+        """
+        if self.buffered <= self.target + round(self.sample_rate * DRIFT_MARGIN):
+            return
+        while self.buffered > self.target and self.packets:
+            packet = self.packets.pop(self.next_sequence, None)
+            if packet is not None:
+                self.buffered -= len(packet) - self.offset
+                self.stats["discarded"] += 1
+            self.next_sequence += 1
+            self.offset = 0
+
+    def get_stats(self):
+        """
+        获取统计：当前和平均播放时延（秒）、目标深度（秒）、抖动（毫秒），以及收到、播放、填补、丢弃、迟到的计数。
+        """
+        return dict(self.stats, buffered=self.buffered / self.sample_rate, target=self.target / self.sample_rate,
+                    jitter=self.jitter)
@@ -0,0 +1,150 @@
+# 码率受控的 JPEG 编码：按每帧字节预算选择质量，预测模型为 ln(每像素字节数) = a + b × 质量（对数线性），
+# 由上一帧的大小和质量校准；预测偏差过大时最多重新编码一次，最低质量仍超出预算时缩小分辨率
+
+import math
+import time
+from collections import deque
+
+import cv2
+
+MIN_QUALITY = 20
+MAX_QUALITY = 95
+DEFAULT_SLOPE = 0.025  # ln(大小) 对质量的斜率初值：质量每提高 10，大小约增加 28%
+SLOPE_RANGE = (0.005, 0.1)
+DEFAULT_INTERCEPT = -3.5  # ln(每像素字节数) 在质量 0 处的初值（质量 75 时约 0.2 字节/像素）
+OVERSHOOT = 1.1  # 实际大小超过预算的该倍数时重新编码
+UNDERSHOOT = 0.6  # 实际大小低于预算的该倍数时（还可以提高质量）重新编码
+SCALED_QUALITY_MARGIN = 15  # 缩小分辨率时，使质量回到 最低质量 + 该值 附近，而不是停在最低质量
+SCALE_STEP = 0.125  # 缩放比例的量化步长，避免在两个分辨率之间来回切换
+MIN_SCALE = 0.25
+BITRATE_WINDOW = 1.0  # 统计实际码率的时间窗口（秒）
+
+
+def encode_jpeg(frame, quality):
+    """
+    把一帧编码为 JPEG。
+    :return: JPEG 字节串
+    """
+    _, buffer = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    return buffer.tobytes()
+
+
+def encoded_size(data):
+    """
+    编码结果的总字节数（整帧为 bytes，条带模式为条带列表）。
+    """
+    return len(data) if isinstance(data, (bytes, bytearray)) else sum(len(part) for part in data)
+
+
+class RateControlledEncoder:
+    def __init__(self, min_quality=MIN_QUALITY, max_quality=MAX_QUALITY):
+        """
+        按字节预算编码的 JPEG 编码器，每个发送的视频流一个实例。
+        :param min_quality: 允许的最低质量，低于它时改为缩小分辨率
+        :param max_quality: 允许的最高质量
+        """
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.intercept = DEFAULT_INTERCEPT
+        self.slope = DEFAULT_SLOPE
+        self.quality = None  # 上一帧使用的质量
+        self.scale = 1.0  # 上一帧使用的缩放比例
+        self.history = deque()  # 最近 BITRATE_WINDOW 内的 (时刻, 字节数)
+        self.stats = {"frames": 0, "reencoded": 0, "over_budget": 0}
+
+    def predict_quality(self, budget, pixels):
+        """
+        预测使一帧大小等于预算的质量（未限制范围）。
+        """
+        return (math.log(budget / pixels) - self.intercept) / self.slope
+
+    def encode(self, frame, budget=None, quality=None, encode=encode_jpeg, max_quality=None):
+        """
+        编码一帧。
+        :param frame: BGR 图像
+        :param budget: 每帧字节预算，为 None 时按 quality 固定质量编码
+        :param quality: 固定质量（budget 为 None 时使用）
+        :param encode: 编码函数 encode(frame, quality)，返回 bytes 或条带列表
+        :param max_quality: 本帧的质量上限（默认为 self.max_quality）
+        :return: 编码结果
+        """
+        if budget is None:
+            data = encode(frame, quality)
+            self._observe(quality, encoded_size(data), frame.shape[0] * frame.shape[1])
+            self._record(encoded_size(data))
+            return data
+
+        max_quality = min(max_quality or self.max_quality, self.max_quality)
+        height, width = frame.shape[:2]
+        frame = self._scaled(frame, budget, width * height)
+        pixels = frame.shape[0] * frame.shape[1]
+
+        quality = self._clamp(self.predict_quality(budget, pixels), max_quality)
+        data = encode(frame, quality)
+        size = encoded_size(data)
+        self._observe(quality, size, pixels)
+        if (size > budget * OVERSHOOT and quality > self.min_quality) or \
+                (size < budget * UNDERSHOOT and quality < max_quality):
+            retry_quality = self._clamp(self.predict_quality(budget, pixels), max_quality)
+            if retry_quality != quality:
+                retry = encode(frame, retry_quality)
+                retry_size = encoded_size(retry)
+                self.stats["reencoded"] += 1
+                # 同一帧两个质量下的大小直接给出斜率
+                slope = (math.log(retry_size) - math.log(size)) / (retry_quality - quality)
+                self.slope += 0.5 * (min(max(slope, SLOPE_RANGE[0]), SLOPE_RANGE[1]) - self.slope)
+                self._observe(retry_quality, retry_size, pixels)
+                if retry_size <= budget * OVERSHOOT or retry_size < size:
+                    data, size, quality = retry, retry_size, retry_quality
+                else:
+                    self.quality = quality  # 保留较小的第一次结果
+        if size > budget * OVERSHOOT:
+            self.stats["over_budget"] += 1
+        self._record(size)
+        return data
+
+    def _clamp(self, quality, max_quality):
+        return int(min(max(round(quality), self.min_quality), max_quality))
+
+    def _scaled(self, frame, budget, pixels):
+        """
+        最低质量下的预测大小仍超出预算时，按面积比例缩小分辨率；预算足够时恢复原分辨率。
+        """
+        scale = 1.0
+        if budget < pixels * math.exp(self.intercept + self.slope * self.min_quality):
+            fits = budget / (pixels * math.exp(self.intercept + self.slope * (self.min_quality + SCALED_QUALITY_MARGIN)))
+            scale = min(1.0, max(MIN_SCALE, math.floor(math.sqrt(fits) / SCALE_STEP) * SCALE_STEP))
+        self.scale = scale
+        if scale >= 1:
+            return frame
+        height, width = frame.shape[:2]
+        size = (max(16, int(width * scale)) & ~1, max(16, int(height * scale)) & ~1)
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+    def _observe(self, quality, size, pixels):
+        """
+        用一次编码结果校准模型截距（画面内容变化主要体现为截距变化）。
+        """
+        self.quality = quality
+        if size > 0:
+            self.intercept = math.log(size / pixels) - self.slope * quality
+
+    def _record(self, size):
+        now = time.monotonic()
+        self.history.append((now, size))
+        while self.history and now - self.history[0][0] > BITRATE_WINDOW:
+            self.history.popleft()
+        self.stats["frames"] += 1
+
+    @property
+    def bitrate(self):
+        """
+        最近 BITRATE_WINDOW 内实际编码输出的码率（bit/s）。
+        """
+        return sum(size for _, size in self.history) * 8 / BITRATE_WINDOW
+
+    def get_stats(self):
+        """
+        获取编码统计：实际码率、最近的质量和缩放比例、重新编码和超出预算的帧数。
+        """
+        return dict(self.stats, bitrate=self.bitrate, quality=self.quality, scale=self.scale)
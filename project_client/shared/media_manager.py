@@ -6,6 +6,12 @@ import threading
 import pyautogui
 import numpy as np
 
+from shared.jpeg_encoder import RateControlledEncoder, encode_jpeg
+from shared.rate_control import MAX_BITRATE, MIN_BITRATE, START_BITRATE, BandwidthController, QualityLadder
+from shared.resampler import Resampler
+from shared.rtcp import REPORT_INTERVAL
+from shared.slice_codec import SliceEncoder
+
 
 class MediaManager:
     _instance = None
@@ -15,10 +21,11 @@ class MediaManager:
             cls._instance = super(MediaManager, cls).__new__(cls)
         return cls._instance
 
-    def __init__(self, rtp_client, target_fps=24):
+    def __init__(self, rtp_client, target_fps=24, slice_bands=0):
         """
         初始化媒体管理器，负责管理摄像头、麦克风和屏幕录制。
         :param rtp_client: RTP 客户端实例，用于发送音视频数据
+        :param slice_bands: 条带模式的条带数（0 表示整帧编码）
         """
         self.rtp_client = rtp_client
         self.camera_running = False
@@ -27,6 +34,7 @@ class MediaManager:
         self.display_running = False
         self.target_fps = target_fps
         self.frame_interval = 1 / target_fps
+        self.preset_fps = target_fps  # 固定档位（low/medium/high）使用的帧率
         self.frame_queue = []  # 用于存储待显示的帧
 
         # 视频质量设置
@@ -42,7 +50,17 @@ class MediaManager:
             "high": 90
         }
         self.width, self.height = self.resolution_settings[self.video_quality]
+        self.jpeg_quality = self.compression_quality[self.video_quality]
+        self.rate_controller = None  # 码率自适应（"auto" 质量）时的 BandwidthController
+        self.preset_quality = self.video_quality  # 码率自适应收到接收报告之前（及报告中断时）使用的固定档位
+        self.adaptive_engaged = False  # 码率自适应是否已根据接收报告接管编码参数
+        self.quality_ladder = None
+        self.sent_bytes = 0  # 已发送的视频编码数据量，用于测量实际码率
+        self.encoder = RateControlledEncoder()
+        self.frame_budget = None  # 手动设置的每帧字节预算（码率自适应开启时由目标码率决定）
         self.set_video_quality(self.video_quality)
+        self.slice_encoder = None
+        self.set_slice_mode(slice_bands)
 
         # 视频播放相关
         self.video_queues = {}  # 每个客户端的视频队列
@@ -51,14 +69,137 @@ class MediaManager:
 
     def set_video_quality(self, quality):
         """
-        设置视频质量，包括分辨率和压缩率。
+        设置视频质量，包括分辨率和压缩率。"auto" 表示根据接收报告自动调整，选择固定档位时关闭自动调整。
         """
+        if quality == "auto":
+            self.enable_adaptive_bitrate()
+            return
         if quality not in self.resolution_settings:
-            raise ValueError("Invalid video quality. Choose from 'low', 'medium', 'high'.")
-        self.video_quality = quality
-        self.width, self.height = self.resolution_settings[quality]
+            raise ValueError("Invalid video quality. Choose from 'low', 'medium', 'high', 'auto'.")
+        self.rate_controller = None
+        self.adaptive_engaged = False
+        self.video_quality = self.preset_quality = quality
+        self._apply_preset()
         print(f"Video quality set to {quality}. Resolution: {self.width}x{self.height}, Compression Quality: {self.compression_quality[quality]}")
 
+    def _apply_preset(self):
+        """
+        按固定档位设置分辨率、压缩质量和帧率。
+        """
+        self.width, self.height = self.resolution_settings[self.preset_quality]
+        self.jpeg_quality = self.compression_quality[self.preset_quality]
+        self.target_fps = self.preset_fps
+        self.frame_interval = 1 / self.preset_fps
+
+    def set_frame_budget(self, budget):
+        """
+        设置每帧字节预算，编码质量按预算自动选择。
+        :param budget: 每帧字节数，None 表示按固定质量编码
+        """
+        self.frame_budget = budget
+        print(f"Frame budget set to {budget} bytes." if budget else "Frame budget cleared.")
+
+    def current_frame_budget(self):
+        """
+        当前的每帧字节预算：码率自适应接管编码参数后为 目标码率 / 帧率，否则为手动设置的预算。
+        """
+        if self.adaptive_engaged:
+            return int(self.rate_controller.target / 8 / self.target_fps)
+        return self.frame_budget
+
+    def get_encoder_stats(self):
+        """
+        获取视频编码统计（实际码率、质量、缩放比例等）。
+        """
+        return self.encoder.get_stats()
+
+    def set_encoding(self, width, height, quality, fps):
+        """
+        设置发送画面的分辨率、JPEG 质量和帧率，从下一帧开始生效。
+        """
+        self.width, self.height = width, height
+        self.jpeg_quality = quality
+        self.target_fps = fps
+        self.frame_interval = 1 / fps
+        print(f"Video encoding set to {width}x{height}, quality {quality}, {fps} fps.")
+
+    def enable_adaptive_bitrate(self):
+        """
+        开启码率自适应：根据接收报告估计可用带宽，持续调整分辨率、JPEG 质量和帧率。
+        只有 v2 接收端会发送接收报告，因此在使用 v2 包头且收到报告之前（旧版服务器或对端、会议中没有其他人）
+        保持当前的固定档位，不会因为没有反馈而停留在最低档。
+        """
+        if self.rate_controller is not None:
+            return
+        self.rate_controller = BandwidthController()
+        self.video_quality = "auto"
+        asyncio.create_task(self.rate_control_loop(self.rate_controller))
+        print("Adaptive bitrate enabled, waiting for receiver reports.")
+
+    async def rate_control_loop(self, controller):
+        """
+        每个接收报告周期更新一次目标码率和质量档位，切换到固定档位后退出。
+        第一次收到接收报告时，以固定档位的实际码率作为初始码率，并从与之相符的档位开始；
+        报告中断时（接收端离开、改用旧版路径）回到固定档位，再次收到报告时重新开始。
+        :param controller: 本次开启的 BandwidthController
+        """
+        last_bytes, last_time = self.sent_bytes, time.monotonic()
+        while self.rate_controller is controller:
+            await asyncio.sleep(REPORT_INTERVAL)
+            if self.rate_controller is not controller:
+                break
+            now = time.monotonic()
+            measured = (self.sent_bytes - last_bytes) * 8 / (now - last_time)
+            last_bytes, last_time = self.sent_bytes, now
+            aggregate = None
+            if self.rtp_client.use_compact_header():
+                aggregate = self.rtp_client.get_stream_statistics()["sent"]["video"]
+            if aggregate is None:
+                if self.adaptive_engaged:
+                    self.adaptive_engaged = False
+                    self._apply_preset()
+                    self.rtp_client.reset_pacing_rate()
+                    print(f"Receiver reports stopped, video back to {self.preset_quality} preset.")
+                continue
+            if not self.adaptive_engaged:
+                start_bitrate = min(max(measured, MIN_BITRATE), MAX_BITRATE) if measured else START_BITRATE
+                controller = self.rate_controller = BandwidthController(start_bitrate)
+                self.quality_ladder = QualityLadder(start_bitrate=start_bitrate)
+                self.adaptive_engaged = True
+                self.set_encoding(*self.quality_ladder.rung)
+            target = controller.update(aggregate, now)
+            self.rtp_client.set_pacing_rate(target, self.target_fps)
+            self.quality_ladder.calibrate(measured)
+            if self.quality_ladder.select(target, now, fast=controller.state == "startup"):
+                self.set_encoding(*self.quality_ladder.rung)
+
+    def set_slice_mode(self, bands):
+        """
+        设置条带模式：每帧切成 bands 个水平条带分别编码发送，丢包只损失一个条带。
+        :param bands: 条带数，0 表示关闭（整帧编码）
+        """
+        if self.slice_encoder:
+            self.slice_encoder.close()
+        self.slice_encoder = SliceEncoder(bands) if bands > 0 else None
+        print(f"Slice mode {'set to ' + str(bands) + ' bands' if bands > 0 else 'off'}.")
+
+    async def send_frame(self, frame):
+        """
+        编码并发送一帧画面。条带只能用 v2 包头发送，旧版路径仍按整帧编码。
+        :param frame: BGR 图像
+        """
+        slices = self.slice_encoder is not None and self.rtp_client.use_compact_header()
+        encode = self.slice_encoder.encode if slices else encode_jpeg
+        # 有预算时质量由编码器预测（不超过当前档位的质量），否则使用固定质量
+        data = self.encoder.encode(frame, self.current_frame_budget(), self.jpeg_quality, encode,
+                                   max_quality=self.jpeg_quality if self.adaptive_engaged else None)
+        if slices:
+            self.sent_bytes += sum(len(band) for band in data)
+            await self.rtp_client.send_slices(data)
+        else:
+            self.sent_bytes += len(data)
+            await self.rtp_client.send_video(data)
+
     def start_camera(self):
         """
         打开摄像头，捕获视频帧并发送。
@@ -81,9 +222,7 @@ class MediaManager:
             frame = cv2.resize(frame, (self.width, self.height))
 
             # 立即压缩和发送
-            encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), self.compression_quality[self.video_quality]]
-            _, buffer = cv2.imencode(".jpg", frame, encode_param)
-            await self.rtp_client.send_video(buffer.tobytes())
+            await self.send_frame(frame)
 
             # 确保帧率稳定
             elapsed_time = time.time() - start_time
@@ -99,16 +238,30 @@ class MediaManager:
 
     def start_microphone(self):
         """
-        打开麦克风，捕获音频数据并发送。
+        打开麦克风，按协商的采样率和帧长捕获音频数据并发送。
+        设备不支持协商的采样率时，以设备默认采样率打开，捕获的每一帧重采样到协商的采样率。
         """
+        sample_rate, frame_samples = self.rtp_client.sample_rate, self.rtp_client.frame_samples
         audio = pyaudio.PyAudio()
-        stream = audio.open(format=pyaudio.paInt16, channels=1, rate=44100, input=True, frames_per_buffer=1024)
+        resampler = None
+        try:
+            stream = audio.open(format=pyaudio.paInt16, channels=1, rate=sample_rate, input=True,
+                                frames_per_buffer=frame_samples)
+        except (OSError, ValueError) as e:
+            device_rate = int(audio.get_default_input_device_info()["defaultSampleRate"])
+            print(f"Microphone does not support {sample_rate} Hz ({e}), capturing at {device_rate} Hz and resampling.")
+            resampler = Resampler(device_rate, sample_rate)
+            frame_samples = round(frame_samples * device_rate / sample_rate)  # 设备采样率下同样时长的一帧
+            stream = audio.open(format=pyaudio.paInt16, channels=1, rate=device_rate, input=True,
+                                frames_per_buffer=frame_samples)
         self.microphone_running = True
 
         def capture_audio():
             while self.microphone_running:
                 try:
-                    audio_data = stream.read(1024, exception_on_overflow=False)
+                    audio_data = stream.read(frame_samples, exception_on_overflow=False)
+                    if resampler is not None:
+                        audio_data = resampler.process(audio_data)
                     self.process_and_send(audio_data=audio_data)
                 except Exception as e:
                     print("Error capturing audio:", e)
@@ -187,24 +340,18 @@ class MediaManager:
                 combined_frame = screen_frame.copy()
                 combined_frame[y_offset:y_offset + small_frame_height, x_offset:x_offset + small_frame_width] = small_frame
 
-                # 压缩合成后的图像
-                encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), self.compression_quality[self.video_quality]]
-                _, combined_buffer = cv2.imencode(".jpg", combined_frame, encode_param)
-                asyncio.run(self.rtp_client.send_video(combined_buffer.tobytes()))
+                # 压缩并发送合成后的图像
+                asyncio.run(self.send_frame(combined_frame))
 
             # 单独处理视频帧
             elif video_data is not None:
                 frame = cv2.resize(video_data, (self.width, self.height))
-                encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), self.compression_quality[self.video_quality]]
-                _, buffer = cv2.imencode(".jpg", frame, encode_param)
-                asyncio.run(self.rtp_client.send_video(buffer.tobytes()))
+                asyncio.run(self.send_frame(frame))
 
             # 单独处理屏幕帧
             elif screen_data is not None:
                 frame = cv2.resize(screen_data, (self.width, self.height))
-                encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), self.compression_quality[self.video_quality]]
-                _, buffer = cv2.imencode(".jpg", frame, encode_param)
-                asyncio.run(self.rtp_client.send_video(buffer.tobytes()))
+                asyncio.run(self.send_frame(frame))
 
         # 处理音频数据
         if audio_data is not None:
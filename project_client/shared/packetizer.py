@@ -0,0 +1,336 @@
+# 零拷贝分包器：在 memoryview 上按固定大小切片，包头写入预分配缓冲区，用 sendmsg 把包头和负载切片一起发送
+
+import socket
+import struct
+import sys
+import time
+
+from shared.path_mtu import DEFAULT_MTU, payload_size_for_mtu
+from shared.protocols import FLAG_RETRANSMIT, UINT16_FIELD
+
+MAX_DATAGRAM_SIZE = 65535  # 接收缓冲区大小（一个 UDP 数据报的上限）
+
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')  # Windows 上没有 sendmsg
+
+# Linux UDP 分段卸载（GSO）/ 接收合并（GRO），旧版本 Python 的 socket 模块中没有这些常量
+SOL_UDP = getattr(socket, 'SOL_UDP', 17)
+UDP_SEGMENT = getattr(socket, 'UDP_SEGMENT', 103)
+UDP_GRO = getattr(socket, 'UDP_GRO', 104)
+GSO_MAX_SEGMENTS = 64  # 内核单次 sendmsg 允许的最大分段数
+GSO_MAX_BYTES = 65000  # 单次 sendmsg 的最大字节数（不能超过一个 UDP 数据报的上限）
+GRO_CMSG_SPACE = socket.CMSG_SPACE(4) if hasattr(socket, 'CMSG_SPACE') else 0
+
+HISTORY_SLOTS = 512  # 发送历史保存的数据包数（30fps 下约 0.5~1 秒的视频）
+HISTORY_SLOT_SIZE = 2048  # 每个历史槽位的大小，超过的包不保存
+RETRANSMIT_RATE = 256 * 1024  # 默认重传带宽预算（字节/秒）
+
+
+def send_buffers(sock, buffers, address):
+    """
+    以 scatter-gather 方式发送一个数据包，不拼接包头和负载。
+    :param sock: UDP 套接字
+    :param buffers: 组成数据包的缓冲区列表（如 [包头, 负载切片]）
+    :param address: 目标地址 (IP, Port)
+    """
+    if HAS_SENDMSG:
+        sock.sendmsg(buffers, (), 0, address)
+    else:
+        sock.sendto(b''.join(buffers), address)
+
+
+def enable_gso(sock):
+    """
+    检测套接字是否支持 UDP_SEGMENT。
+    :return: 支持时返回 True
+    """
+    if not sys.platform.startswith('linux') or not HAS_SENDMSG:
+        return False
+    try:
+        sock.getsockopt(SOL_UDP, UDP_SEGMENT)
+        return True
+    except OSError:
+        return False
+
+
+def enable_gro(sock):
+    """
+    在套接字上开启 UDP_GRO，开启后必须用 recvmsg 接收并按 split_gro_segments 拆分。
+    :return: 开启成功时返回 True
+    """
+    if not sys.platform.startswith('linux') or not hasattr(sock, 'recvmsg'):
+        return False
+    try:
+        sock.setsockopt(SOL_UDP, UDP_GRO, 1)
+        return True
+    except OSError:
+        return False
+
+
+def split_gro_segments(data, ancdata):
+    """
+    将 GRO 合并后的缓冲区拆回原始数据报。
+    :param data: recvmsg 收到的数据
+    :param ancdata: recvmsg 收到的辅助数据
+    :return: 各数据报的 memoryview 切片列表
+    """
+    segment_size = 0
+    for level, cmsg_type, cmsg_data in ancdata:
+        if level == SOL_UDP and cmsg_type == UDP_GRO:
+            segment_size = struct.unpack('=i', cmsg_data[:4])[0]
+    view = memoryview(data)
+    if segment_size <= 0 or segment_size >= len(view):
+        return [view]
+    return [view[offset:offset + segment_size] for offset in range(0, len(view), segment_size)]
+
+
+class PacketHistory:
+    def __init__(self, slots=HISTORY_SLOTS, slot_size=HISTORY_SLOT_SIZE):
+        """
+        发送历史环形缓冲区：按 v2 包头的流内序列号（偏移 2）把最近发送的数据包拷贝到预分配的槽位中，用于 NACK 重传。
+        :param slots: 槽位数
+        :param slot_size: 每个槽位的大小
+        """
+        self.slots = slots
+        self.slot_size = slot_size
+        self.buffer = bytearray(slots * slot_size)
+        self.sequences = [-1] * slots  # 每个槽位中数据包的序列号（-1 表示空）
+        self.lengths = [0] * slots
+
+    def store(self, header, *chunks):
+        """
+        保存一个数据包。
+        :param header: 已写好的包头
+        :param chunks: 负载缓冲区
+        """
+        sequence = UINT16_FIELD.unpack_from(header, 2)[0]
+        slot = sequence % self.slots
+        length = len(header) + sum(len(chunk) for chunk in chunks)
+        if length > self.slot_size:
+            self.sequences[slot] = -1
+            return
+        offset = slot * self.slot_size
+        end = offset + len(header)
+        self.buffer[offset:end] = header
+        for chunk in chunks:
+            self.buffer[end:end + len(chunk)] = chunk
+            end += len(chunk)
+        self.sequences[slot] = sequence
+        self.lengths[slot] = length
+
+    def get(self, sequence):
+        """
+        获取已保存的数据包，已被覆盖时返回 None。
+        :return: 槽位的 memoryview
+        """
+        slot = sequence % self.slots
+        if self.sequences[slot] != sequence:
+            return None
+        offset = slot * self.slot_size
+        return memoryview(self.buffer)[offset:offset + self.lengths[slot]]
+
+
+class RetransmitBudget:
+    def __init__(self, rate=RETRANSMIT_RATE, burst=None):
+        """
+        重传带宽预算（令牌桶），丢包严重时限制重传，避免挤占正常发送。
+        :param rate: 每秒允许重传的字节数
+        :param burst: 桶容量（默认 1/4 秒的预算）
+        """
+        self.rate = rate
+        self.burst = burst or rate / 4
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def consume(self, nbytes):
+        """
+        尝试消耗 nbytes 的预算。
+        :return: 预算足够时返回 True
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < nbytes:
+            return False
+        self.tokens -= nbytes
+        return True
+
+
+class Packetizer:
+    def __init__(self, header_format, mtu=DEFAULT_MTU, reserve=0):
+        """
+        初始化分包器，每个媒体流一个实例。
+        :param header_format: 包头的 struct 格式
+        :param mtu: 路径 MTU，每个数据包（含 IP/UDP/RTP 头）不超过 MTU，避免 IP 分片
+        :param reserve: 预留的字节数（如服务器把 v2 包头转换为更长的旧版包头，或 FEC 校验包的负载前缀）
+        """
+        self.header_struct = struct.Struct(header_format)
+        self.header = bytearray(self.header_struct.size)  # 预分配的包头缓冲区，每个包原地改写
+        self.mtu = mtu
+        self.reserve = reserve
+        self.payload_size = payload_size_for_mtu(mtu, self.header_struct.size + reserve)
+        self.sequence_number = 0  # 流内序列号（v2 包头，每个包递增，16 位回绕）
+        self.frame_id = 0  # 帧 ID（v2 包头，每帧递增，16 位回绕）
+        self.gso = False  # 是否使用 UDP_SEGMENT 一次发送多个分片
+        self.gso_buffer = None
+        self.history = None  # 发送历史（enable_history 后启用，仅用于 v2 包头）
+        self.retransmit_budget = None
+
+    def next_sequence(self):
+        """
+        获取下一个流内序列号。
+        """
+        self.sequence_number = (self.sequence_number + 1) & 0xFFFF
+        return self.sequence_number
+
+    def next_frame(self):
+        """
+        获取下一个帧 ID。
+        """
+        self.frame_id = (self.frame_id + 1) & 0xFFFF
+        return self.frame_id
+
+    def set_mtu(self, mtu, reserve=None):
+        """
+        按新的路径 MTU 调整每个数据包的负载大小，从下一帧开始生效。
+        :param mtu: 路径 MTU
+        :param reserve: 包头改写或 FEC 前缀的预留字节数（None 表示保持不变）
+        """
+        if reserve is not None:
+            self.reserve = reserve
+        self.mtu = mtu
+        self.payload_size = payload_size_for_mtu(mtu, self.header_struct.size + self.reserve)
+
+    def enable_history(self, slots=HISTORY_SLOTS, retransmit_rate=RETRANSMIT_RATE):
+        """
+        保存最近发送的数据包，收到 NACK 时可以按序列号重传。只适用于 v2 包头（序列号位于偏移 2）。
+        :param slots: 保存的数据包数
+        :param retransmit_rate: 重传带宽预算（字节/秒）
+        """
+        self.history = PacketHistory(slots, max(HISTORY_SLOT_SIZE, self.mtu))
+        self.retransmit_budget = RetransmitBudget(retransmit_rate)
+
+    def retransmit(self, sock, address, sequences):
+        """
+        重传 NACK 请求的数据包，超出重传预算时停止。
+        :param sock: UDP 套接字
+        :param address: 目标地址 (IP, Port)
+        :param sequences: 请求重传的流内序列号
+        :return: 重传的包数
+        """
+        if self.history is None:
+            return 0
+        sent = 0
+        for sequence in sequences:
+            packet = self.history.get(sequence)
+            if packet is None:
+                continue  # 已被新的数据包覆盖
+            if not self.retransmit_budget.consume(len(packet)):
+                break
+            packet[1] |= FLAG_RETRANSMIT
+            sock.sendto(packet, address)
+            sent += 1
+        return sent
+
+    def enable_offload(self, sock):
+        """
+        在支持的 Linux 内核上启用 GSO，不支持时保持逐包发送。
+        :param sock: 发送使用的 UDP 套接字
+        :return: 是否启用成功
+        """
+        self.gso = enable_gso(sock)
+        if self.gso:
+            self.gso_buffer = bytearray(GSO_MAX_BYTES)
+        return self.gso
+
+    def packetize(self, payload):
+        """
+        单次遍历把负载切分为若干片，切片是 memoryview，不拷贝数据。
+        :param payload: 编码后的帧数据
+        :return: 依次生成 (sequence_number, total_packets, chunk)，序列号从 1 开始
+        """
+        view = memoryview(payload)
+        total_packets = max(1, -(-len(view) // self.payload_size))
+        for index in range(total_packets):
+            offset = index * self.payload_size
+            yield index + 1, total_packets, view[offset:offset + self.payload_size]
+
+    def send_frame(self, sock, address, payload, header_fields):
+        """
+        分包并发送整帧数据。
+        :param sock: UDP 套接字
+        :param address: 目标地址 (IP, Port)
+        :param payload: 编码后的帧数据
+        :param header_fields: 回调 header_fields(sequence_number, total_packets, payload_length)，返回包头各字段
+        :return: 发送的包数
+        """
+        packets = self.packetize(payload)
+        if self.gso:
+            packets = self._send_segmented(sock, address, packets, header_fields)
+        for sequence_number, total_packets, chunk in packets:
+            self.header_struct.pack_into(self.header, 0, *header_fields(sequence_number, total_packets, len(chunk)))
+            send_buffers(sock, [self.header, chunk], address)
+            if self.history is not None:
+                self.history.store(self.header, chunk)  # 只保存实际发出的包
+        return max(1, -(-len(payload) // self.payload_size))
+
+    def send_packet(self, sock, address, fields, buffers):
+        """
+        发送单个数据包（如 FEC 校验包），包头写入预分配缓冲区后与负载一起 scatter-gather 发送。
+        :param fields: 包头各字段
+        :param buffers: 负载缓冲区列表
+        """
+        self.header_struct.pack_into(self.header, 0, *fields)
+        send_buffers(sock, [self.header, *buffers], address)
+        if self.history is not None:
+            self.history.store(self.header, *buffers)
+
+    def _send_segmented(self, sock, address, packets, header_fields):
+        """
+        用 UDP_SEGMENT 发送：把等长的 "包头 + 负载" 分段连续写入缓冲区，一次 sendmsg 由内核切分成多个数据报。
+        内核不支持时关闭 GSO：已写好包头的当前批次按原包头逐段发送（不重新分配序列号），其余分片交回逐包发送。
+        :return: 需要逐包发送的剩余分片
+        """
+        header_size = self.header_struct.size
+        segment_size = header_size + self.payload_size
+        batch_limit = min(GSO_MAX_SEGMENTS, GSO_MAX_BYTES // segment_size)
+        batch = []
+        for packet in packets:
+            batch.append(packet)
+            # 只有最后一个分段可以短于 segment_size，所以短分片（帧尾）必须结束当前批次
+            if len(batch) == batch_limit or len(packet[2]) < self.payload_size:
+                if not self._send_batch(sock, address, batch, header_fields, segment_size):
+                    return packets
+                batch = []
+        if batch:
+            self._send_batch(sock, address, batch, header_fields, segment_size)
+        return []
+
+    def _send_batch(self, sock, address, batch, header_fields, segment_size):
+        """
+        把一批分片写入 GSO 缓冲区（每个分片只生成一次包头），一次 sendmsg 发出，发送成功后才保存到发送历史。
+        :return: GSO 是否可用，不可用时这批分片已按写好的包头逐段发出
+        """
+        header_size = self.header_struct.size
+        view = memoryview(self.gso_buffer)
+        segments = []
+        offset = 0
+        for sequence_number, total_packets, chunk in batch:
+            self.header_struct.pack_into(self.gso_buffer, offset, *header_fields(sequence_number, total_packets, len(chunk)))
+            end = offset + header_size + len(chunk)
+            self.gso_buffer[offset + header_size:end] = chunk
+            segments.append(view[offset:end])
+            offset = end
+        gso = True
+        try:
+            sock.sendmsg([view[:offset]], [(SOL_UDP, UDP_SEGMENT, struct.pack('=H', segment_size))], 0, address)
+        except BlockingIOError:
+            raise
+        except OSError as e:
+            print(f"UDP GSO unavailable ({e}), falling back to per-packet send.")
+            self.gso = gso = False
+        for segment in segments:
+            if not gso:
+                sock.sendto(segment, address)
+            if self.history is not None:
+                self.history.store(segment[:header_size], segment[header_size:])
+        return gso
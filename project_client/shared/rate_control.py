@@ -0,0 +1,187 @@
+# 发送端码率自适应（思路参照 Google Congestion Control）：
+# 根据接收报告中的排队时延梯度和丢包率估计可用带宽，再把目标码率映射为分辨率、JPEG 质量和帧率的组合
+
+import time
+from collections import deque
+
+START_BITRATE = 600_000  # 初始目标码率（bit/s），启动探测从这里开始翻倍
+MIN_BITRATE = 100_000
+MAX_BITRATE = 20_000_000
+STARTUP_DURATION = 2.0  # 启动探测的最长时间（秒）
+TRENDLINE_WINDOW = 8  # 计算时延梯度使用的最近报告数
+INITIAL_THRESHOLD = 10.0  # 时延梯度的初始过载阈值（毫秒/秒），之后自适应调整
+THRESHOLD_RANGE = (4.0, 100.0)
+THRESHOLD_GAIN_UP = 2.0  # |梯度| 高于阈值时阈值每秒上调的比例（快，避免与 TCP 流竞争时长期判为过载而饿死）
+THRESHOLD_GAIN_DOWN = 0.1  # |梯度| 低于阈值时阈值每秒下调的比例（慢）
+MAX_QUEUE_DELAY = 250.0  # 排队时延超过该值（毫秒）时直接视为过载：队列稳定在高位时梯度为 0，但时延不可接受
+DECREASE_FACTOR = 0.85  # 过载时目标码率降为接收端实际吞吐的比例
+INCREASE_RATE = 1.08  # 正常状态下每秒的码率增长倍数
+INCOMING_RATE_CAP = 3.0  # 目标码率不超过接收端实际吞吐的倍数（需大于相邻档位的码率比，受档位限制时仍能升档试探）
+LOSS_HIGH = 0.10  # 丢包率高于该值时按丢包率降低码率
+LOSS_LOW = 0.02  # 丢包率低于该值时才允许提高码率
+
+# 质量档位：(宽, 高, JPEG 质量, 帧率)，按码率从高到低排列
+QUALITY_LADDER = [
+    (1920, 1080, 85, 24),
+    (1280, 720, 80, 24),
+    (1280, 720, 70, 20),
+    (960, 540, 70, 20),
+    (960, 540, 60, 15),
+    (640, 360, 60, 15),
+    (640, 360, 50, 12),
+    (480, 270, 45, 10),
+    (320, 180, 40, 8),
+]
+UPGRADE_MARGIN = 1.15  # 目标码率比上一档的预测码率高出该比例时才升档
+UPGRADE_HOLD = 2.0  # 两次升档之间的最短间隔（秒），降档不受限制
+
+
+def nominal_bitrate(width, height, quality, fps):
+    """
+    档位的名义码率（bit/s）：JPEG 每像素比特数随质量近似线性增长，实际码率由 QualityLadder 按测量值校准。
+    """
+    return width * height * fps * (0.1 + quality / 100)
+
+
+class DelayGradientDetector:
+    """
+    过载检测：对最近若干个接收报告的排队时延做最小二乘拟合，斜率（毫秒/秒）与自适应阈值比较。
+    """
+
+    def __init__(self, window=TRENDLINE_WINDOW, threshold=INITIAL_THRESHOLD):
+        self.samples = deque(maxlen=window)  # [(时刻, 排队时延)]
+        self.threshold = threshold
+        self.last_update = None
+
+    def update(self, now, delay):
+        """
+        :param now: 报告时刻（秒）
+        :param delay: 排队时延（毫秒）
+        :return: "overuse"、"underuse" 或 "normal"
+        """
+        self.samples.append((now, delay))
+        if delay > MAX_QUEUE_DELAY:
+            return "overuse"
+        if len(self.samples) < 3:
+            return "normal"
+        mean_t = sum(t for t, _ in self.samples) / len(self.samples)
+        mean_d = sum(d for _, d in self.samples) / len(self.samples)
+        variance = sum((t - mean_t) ** 2 for t, _ in self.samples)
+        if variance <= 0:
+            return "normal"
+        trend = sum((t - mean_t) * (d - mean_d) for t, d in self.samples) / variance
+
+        # 阈值跟随梯度幅度缓慢变化，明显的突变不参与调整
+        if self.last_update is not None and abs(trend) < self.threshold + 50:
+            gain = THRESHOLD_GAIN_UP if abs(trend) > self.threshold else THRESHOLD_GAIN_DOWN
+            self.threshold += min(gain * (now - self.last_update), 1.0) * (abs(trend) - self.threshold)
+            self.threshold = min(max(self.threshold, THRESHOLD_RANGE[0]), THRESHOLD_RANGE[1])
+        self.last_update = now
+
+        if trend > self.threshold:
+            return "overuse"
+        if trend < -self.threshold:
+            return "underuse"
+        return "normal"
+
+
+class BandwidthController:
+    """
+    目标码率控制：启动阶段每个报告周期翻倍直到出现过载或丢包；之后过载时降到实际吞吐的 85%，
+    时延下降（排空队列）时保持，正常时缓慢乘性增长。丢包控制与时延控制取较小值。
+    """
+
+    def __init__(self, start_bitrate=START_BITRATE, min_bitrate=MIN_BITRATE, max_bitrate=MAX_BITRATE):
+        self.target = start_bitrate
+        self.min_bitrate = min_bitrate
+        self.max_bitrate = max_bitrate
+        self.detector = DelayGradientDetector()
+        self.state = "startup"
+        self.started = None
+        self.last_update = None
+
+    def update(self, aggregate, now=None):
+        """
+        用最新的接收报告汇总更新目标码率。
+        :param aggregate: RTPClient.get_stream_statistics()["sent"]["video"]，没有报告时为 None
+        :param now: 当前时刻（秒）
+        :return: 目标码率（bit/s）
+        """
+        if aggregate is None:
+            return self.target  # 没有反馈时保持
+        now = time.monotonic() if now is None else now
+        if self.started is None:
+            self.started = now
+        elapsed = min(now - self.last_update, 2.0) if self.last_update is not None else 0.0
+        self.last_update = now
+
+        usage = self.detector.update(now, aggregate["delay"])
+        loss = aggregate["fraction_lost"]
+        incoming = aggregate["goodput"] * 8
+        if self.state == "startup":
+            if usage == "overuse" or loss > LOSS_LOW or now - self.started > STARTUP_DURATION:
+                self.state = "normal"
+            else:
+                self.target *= 2
+        if self.state != "startup":
+            if usage == "overuse":
+                self.target = min(self.target, DECREASE_FACTOR * incoming) if incoming else self.target * DECREASE_FACTOR
+            elif usage == "normal" and loss < LOSS_LOW:
+                self.target *= INCREASE_RATE ** elapsed
+            if loss > LOSS_HIGH:
+                self.target *= 1 - 0.5 * loss
+            if incoming:
+                self.target = min(self.target, INCOMING_RATE_CAP * incoming)
+        self.target = min(max(self.target, self.min_bitrate), self.max_bitrate)
+        return self.target
+
+
+class QualityLadder:
+    """
+    把目标码率映射为质量档位。各档的预测码率 = 名义码率 × 校准系数，校准系数由当前档位的实测码率平滑得到，
+    因此屏幕共享和摄像头画面（压缩率差别很大）都能选到合适的档位。
+    """
+
+    def __init__(self, ladder=QUALITY_LADDER, start_bitrate=START_BITRATE):
+        """
+        :param ladder: 质量档位
+        :param start_bitrate: 初始码率，从名义码率不超过它的最高档位开始，由启动探测逐档上调
+        """
+        self.ladder = ladder
+        self.index = next((index for index, rung in enumerate(ladder) if nominal_bitrate(*rung) <= start_bitrate),
+                          len(ladder) - 1)
+        self.scale = 1.0
+        self.last_upgrade = 0.0
+
+    @property
+    def rung(self):
+        return self.ladder[self.index]
+
+    def predicted_bitrate(self, index):
+        return nominal_bitrate(*self.ladder[index]) * self.scale
+
+    def calibrate(self, measured_bitrate):
+        """
+        :param measured_bitrate: 当前档位最近一个周期的实际发送码率（bit/s）
+        """
+        if measured_bitrate > 0:
+            self.scale += 0.3 * (measured_bitrate / nominal_bitrate(*self.rung) - self.scale)
+
+    def select(self, target_bitrate, now=None, fast=False):
+        """
+        选择档位：预测码率超过目标时立即降档，目标充裕时每次最多升一档。
+        :param target_bitrate: 目标码率
+        :param fast: 启动探测阶段升档不受最短间隔限制
+        :return: 档位是否变化
+        """
+        now = time.monotonic() if now is None else now
+        index = self.index
+        while index < len(self.ladder) - 1 and self.predicted_bitrate(index) > target_bitrate:
+            index += 1
+        if index == self.index and index > 0 and (fast or now - self.last_upgrade >= UPGRADE_HOLD) \
+                and target_bitrate > self.predicted_bitrate(index - 1) * UPGRADE_MARGIN:
+            index -= 1
+            self.last_upgrade = now
+        changed = index != self.index
+        self.index = index
+        return changed
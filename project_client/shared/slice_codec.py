@@ -0,0 +1,171 @@
+# 条带编码：把一帧画面切成若干水平条带，每个条带单独编码为一个小 JPEG，作为独立的帧发送
+# 丢包只损失一个条带，接收端用上一幅画面中对应的条带填补；条带在线程池中并行编码（cv2 编解码时释放 GIL）
+
+import concurrent.futures
+from collections import deque
+
+import cv2
+import numpy as np
+
+from shared.Video_packet_assembler import VideoPacketAssembler, frame_id_newer
+from shared.protocols import SLICE_HEADER
+
+DEFAULT_BAND_COUNT = 8
+BAND_ALIGNMENT = 16  # 条带高度按 JPEG 最小编码单元（16 行）对齐，条带边界不会产生额外的块效应
+
+
+def band_layout(height, band_count):
+    """
+    计算条带划分。
+    :param height: 画面高度
+    :param band_count: 期望的条带数（画面较矮时实际条带数可能更少）
+    :return: [(起始行, 条带高度)]
+    """
+    band_height = -(-height // band_count)
+    band_height = -(-band_height // BAND_ALIGNMENT) * BAND_ALIGNMENT
+    return [(y, min(band_height, height - y)) for y in range(0, height, band_height)]
+
+
+def decode_band(payload):
+    """
+    解码一个条带。
+    :param payload: 条带负载（SLICE_HEADER + JPEG）
+    :return: (条带前缀字段, 条带图像)，无效的条带返回 None
+    """
+    if len(payload) <= SLICE_HEADER.size:
+        return None
+    header = SLICE_HEADER.unpack_from(payload)
+    image = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8, offset=SLICE_HEADER.size), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    return header, image
+
+
+class SliceEncoder:
+    def __init__(self, band_count=DEFAULT_BAND_COUNT, max_workers=4):
+        """
+        条带编码器。
+        :param band_count: 每帧的条带数
+        :param max_workers: 并行编码的线程数
+        """
+        self.band_count = band_count
+        self.picture_id = 0
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    def encode(self, frame, quality):
+        """
+        把一帧画面编码为若干条带。
+        :param frame: BGR 图像
+        :param quality: JPEG 质量
+        :return: 条带负载列表（SLICE_HEADER + JPEG），按条带序号排列
+        """
+        height, width = frame.shape[:2]
+        bands = band_layout(height, self.band_count)
+        self.picture_id = picture_id = (self.picture_id + 1) & 0xFFFF
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+
+        def encode_band(band):
+            index, (y, band_height) = band
+            _, buffer = cv2.imencode(".jpg", frame[y:y + band_height], params)
+            return SLICE_HEADER.pack(picture_id, index, len(bands), y, band_height, width, height) + buffer.tobytes()
+
+        return list(self.executor.map(encode_band, enumerate(bands)))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class SliceAssembler(VideoPacketAssembler):
+    """
+    条带重组器：每个条带是一个独立的帧（有自己的帧 ID），按帧 ID 重组、请求重传和 FEC 恢复。
+    与整帧不同，条带之间互不依赖，一个条带完成时不丢弃比它旧的未完成条带，只记住已完成的帧 ID 以丢弃重复分片。
+    """
+
+    def __init__(self, window=16, timeout=0.5):
+        super().__init__(frame_width=0, frame_height=0, window=window, timeout=timeout)
+        self.done = deque(maxlen=4 * window)  # 最近完成的帧 ID
+
+    def _pending_frame(self, frame_id, total_packets):
+        if frame_id in self.done:
+            self.stats["late"] += 1
+            return None
+        return super()._pending_frame(frame_id, total_packets)
+
+    async def _complete(self, frame_id, pending):
+        """
+        输出完成的条带：(条带前缀字段, 条带图像)。
+        """
+        del self.frames[frame_id]
+        self.done.append(frame_id)
+        self.stats["completed"] += 1
+        view = memoryview(pending.buffer)[:pending.length]
+        try:
+            return await self._decode_and_resize(view)
+        finally:
+            self.pool.release(pending.buffer)
+
+    def _sync_decode_and_resize(self, video_data):
+        try:
+            return decode_band(video_data)
+        except Exception as e:
+            print(f"Error decoding video slice: {e}")
+            return None
+
+
+class SliceCompositor:
+    """
+    条带合成：画布上每个条带位置保存已收到的最新内容。一幅画面的条带收齐时立即输出；
+    下一幅画面的条带先到时，当前画面缺失的条带沿用画布上更早的内容后输出。
+    """
+
+    def __init__(self):
+        self.canvas = None
+        self.band_pictures = []  # 画布上每个条带来自的画面 ID
+        self.picture_id = None  # 当前正在收集的画面
+        self.band_count = 0
+        self.received = 0  # 当前画面已收到的条带位图
+        self.emitted = False
+        self.stats = {"pictures": 0, "concealed": 0, "late": 0}
+
+    def add_band(self, header, image):
+        """
+        把一个条带写入画布。
+        :param header: 条带前缀字段
+        :param image: 条带图像
+        :return: 有画面可以输出时返回画面（画布的拷贝）；否则返回 None。
+        """
+        picture_id, index, band_count, y, band_height, width, height = header
+        if index >= band_count or y + band_height > height or image.shape[:2] != (band_height, width):
+            return None
+        if self.canvas is None or self.canvas.shape[:2] != (height, width) or self.band_count != band_count:
+            self.canvas = np.zeros((height, width, 3), dtype=np.uint8)  # 分辨率或条带划分变化，重新开始
+            self.band_pictures = [None] * band_count
+            self.band_count = band_count
+            self.picture_id = None
+
+        output = None
+        if self.picture_id is None or frame_id_newer(picture_id, self.picture_id):
+            if self.picture_id is not None and not self.emitted:
+                # 新画面开始，当前画面缺失的条带不再等待
+                self.stats["concealed"] += band_count - bin(self.received).count("1")
+                output = self._emit()
+            self.picture_id = picture_id
+            self.received = 0
+            self.emitted = False
+        elif picture_id != self.picture_id:
+            self.stats["late"] += 1  # 已输出画面的迟到条带，仍可用于填补下一幅画面
+
+        previous = self.band_pictures[index]
+        if previous is None or previous == picture_id or frame_id_newer(picture_id, previous):
+            self.canvas[y:y + band_height] = image
+            self.band_pictures[index] = picture_id
+        if picture_id == self.picture_id:
+            self.received |= 1 << index
+            if self.received == (1 << band_count) - 1 and not self.emitted:
+                output = self._emit()
+        return output
+
+    def _emit(self):
+        self.emitted = True
+        self.stats["pictures"] += 1
+        return self.canvas.copy()
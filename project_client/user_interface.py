@@ -34,8 +34,12 @@ class OperationInterface:
         self.rtp_mode = "unconnected"
         self.cancel_ack = False
 
-    def connect_to_p2p(self, ip, port):
-        self.rtp_client.connect_to_p2p(ip, port)
+    def connect_to_p2p(self, ip, port, rtp_version=None, audio_codec=None, sample_rate=None):
+        self.rtp_client.connect_to_p2p(ip, port, rtp_version, audio_codec, sample_rate)
+
+    def set_stream(self, stream_id, rtp_version):
+        if self.rtp_client:
+            self.rtp_client.set_stream(stream_id, rtp_version)
 
     def stop_p2p(self):
         self.rtp_client.stop_p2p()
@@ -43,9 +47,14 @@ class OperationInterface:
     async def rtp_connect(self):
         self.rtp_client = RTPClient(server_ip, server_port, client_port,
                                     self.web_socket.client_id, self.conference_id, client_ip)
+        self.rtp_client.set_audio_codec(self.web_socket.audio_codec)
+        self.rtp_client.set_audio_format(*self.web_socket.audio_format)
         await self.web_socket.register_rtp_address(client_ip, self.rtp_client.client_port, self.conference_id)
+        # 会话建立时探测到服务器的路径 MTU，并告知服务器按此分包
+        await self.web_socket.set_rtp_mtu(await self.rtp_client.probe_server_mtu())
         print("RTP Client connected.")
         self.media_manager = MediaManager(self.rtp_client)
+        self.media_manager.enable_adaptive_bitrate()  # 收到 v2 接收报告后自动调整画面质量，此前保持固定档位
         self.media_manager.start_screen_recording()
         # self.media_manager.start_camera()
         self.media_manager.start_microphone()
@@ -60,7 +69,8 @@ class OperationInterface:
         print("open/close camera 开启/关闭摄像头（不能与屏幕共享同时开启）")
         print("open/close screen 开启/关闭屏幕共享（不能与摄像头同时开启）")
         print("open/close microphone 开启/关闭麦克风")
-        print("change quality 调整视频质量 (low,medium,high)")
+        print("change quality 调整视频质量 (low,medium,high,auto)")
+        print("slice <N>    条带模式：每帧切成 N 个条带分别发送（0 关闭）")
         print("help         显示帮助菜单")
         print("exit         退出界面")
         print("=================")
@@ -203,6 +213,12 @@ class OperationInterface:
                     self.media_manager.set_video_quality(quality)
                 except ValueError:
                     print("请输入正确格式: change + quality")
+            elif user_input.startswith("slice"):
+                try:
+                    _, bands = user_input.split(maxsplit=1)
+                    self.media_manager.set_slice_mode(int(bands))
+                except ValueError:
+                    print("请输入正确格式: slice + 条带数")
             elif user_input.startswith("send"):
                 try:
                     _, message = user_input.split(maxsplit=1)
@@ -3,6 +3,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from network.websocket_manager import WebSocketManager
 from shared.connection_manager import ConnectionManager
 from network.rtp_manager import RTPManager
+from network.media_workers import MediaPlane
+
+MEDIA_WORKERS = 1  # 媒体转发进程数，大于 1 时通过 SO_REUSEPORT 启动多进程媒体平面（仅 Linux）
 
 # 初始化 FastAPI 应用
 app = FastAPI()
@@ -38,4 +41,16 @@ async def startup_event():
     """
     在服务启动时运行：启动 RTP 服务器。
     """
-    await rtp_manager.start_udp_server(host="0.0.0.0", port=5555)
+    if MEDIA_WORKERS > 1:
+        rtp_manager.start_media_plane(MediaPlane(MEDIA_WORKERS), host="0.0.0.0", port=5555)
+    else:
+        await rtp_manager.start_udp_server(host="0.0.0.0", port=5555)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    在服务关闭时运行：停止媒体工作进程。
+    """
+    if rtp_manager.media_plane is not None:
+        rtp_manager.media_plane.stop()
@@ -0,0 +1,345 @@
+# 多进程 RTP 媒体平面：N 个工作进程通过 SO_REUSEPORT 绑定同一个 UDP 端口，按会议 ID 哈希分片
+# v2 包头只携带流 ID，控制进程分配流 ID 时保证 流 ID % 进程数 == 会议所属进程，
+# 端口组上挂一个经典 BPF 程序（SO_ATTACH_REUSEPORT_CBPF），内核直接把 v2 数据包交给 流 ID % 进程数 号进程；
+# 旧版包头（会议 ID 的 CRC32 无法用 BPF 计算）和内核不支持该选项时按四元组哈希分散，
+# 落到非归属进程的数据包经本机回环套接字转交给归属进程
+
+import ctypes
+import multiprocessing
+import select
+import socket
+import struct
+import zlib
+
+from network.rtp_manager import (CLIENT_HEADER, ForwardResampler, build_routes, compact_audio_packets, compact_to_legacy,
+                                 legacy_audio_packets, route_key, rewrite_rtp_packet)
+from network.socket_pool import RTPSocketPool
+from shared.path_mtu import probe_ack
+from shared.protocols import (AUDIO_PAYLOAD_TYPES, COMPACT_HEADER, PAYLOAD_NACK, PAYLOAD_PROBE, PAYLOAD_REPORT,
+                              PAYLOAD_VIDEO, PAYLOAD_VIDEO_FEC, PAYLOAD_VIDEO_SLICE, RTP_VERSION_COMPACT,
+                              STREAM_ID_FIELD, is_compact_packet)
+
+HANDOFF_HOST = "127.0.0.1"
+HANDOFF_BASE_PORT = 15555  # 工作进程 i 的转交端口为 HANDOFF_BASE_PORT + i
+WORKER_START_TIMEOUT = 10  # 等待工作进程绑定媒体端口的最长时间（秒）
+SO_ATTACH_REUSEPORT_CBPF = getattr(socket, 'SO_ATTACH_REUSEPORT_CBPF', 51)
+SOCK_FILTER = struct.Struct('HBBI')  # struct sock_filter {code, jt, jf, k}
+
+# 经典 BPF 指令码
+BPF_LD_W_LEN = 0x80  # A = 包长度（UDP 负载）
+BPF_LD_B_ABS = 0x30  # A = 负载[k]（1 字节）
+BPF_LD_W_ABS = 0x20  # A = 负载[k:k+4]（网络字节序）
+BPF_ALU_RSH_K = 0x74  # A >>= k
+BPF_ALU_MOD_K = 0x94  # A %= k
+BPF_JMP_JEQ_K = 0x15
+BPF_JMP_JGE_K = 0x35
+BPF_RET_A = 0x16
+BPF_RET_K = 0x06
+
+
+def shard_for(meeting_id_bytes, workers):
+    """
+    计算会议所属的工作进程编号。
+    :param meeting_id_bytes: 包头中的 4 字节会议 ID
+    :param workers: 工作进程数
+    """
+    return zlib.crc32(meeting_id_bytes) % workers
+
+
+def stream_steering_program(workers):
+    """
+    端口组的分发程序：v2 数据包返回 流 ID % 进程数（端口组中第几个套接字，即工作进程编号），
+    其他数据包返回 进程数（超出范围，内核退回按四元组哈希）。
+    :return: sock_filter 指令列表 [(code, jt, jf, k), ...]
+    """
+    return [
+        (BPF_LD_W_LEN, 0, 0, 0),
+        (BPF_JMP_JGE_K, 0, 6, COMPACT_HEADER.size),  # 不足 v2 包头长度 → 哈希
+        (BPF_LD_B_ABS, 0, 0, 0),
+        (BPF_ALU_RSH_K, 0, 0, 4),
+        (BPF_JMP_JEQ_K, 0, 3, RTP_VERSION_COMPACT),  # 旧版包头、MTU 探测 → 哈希
+        (BPF_LD_W_ABS, 0, 0, 4),
+        (BPF_ALU_MOD_K, 0, 0, workers),
+        (BPF_RET_A, 0, 0, 0),
+        (BPF_RET_K, 0, 0, workers),
+    ]
+
+
+def attach_stream_steering(sock, workers):
+    """
+    在 SO_REUSEPORT 端口组上挂载按流 ID 分发的 BPF 程序（Linux 4.5+）。
+    :return: 是否挂载成功，失败时数据包仍由用户态转交
+    """
+    program = stream_steering_program(workers)
+    filters = ctypes.create_string_buffer(b''.join(SOCK_FILTER.pack(*instruction) for instruction in program))
+    fprog = struct.pack('HP', len(program), ctypes.addressof(filters))  # struct sock_fprog {len, filter}
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, fprog)
+    except OSError as e:
+        print(f"Kernel stream steering unavailable ({e}), packets are handed off between workers.")
+        return False
+    return True
+
+
+def meeting_id_bytes(meeting_id):
+    """
+    将会议 ID 编码为包头中的 4 字节形式（与 RTPClient.create_rtp_packet 一致）。
+    """
+    return meeting_id.encode('utf-8').ljust(4, b'\0')[:4]
+
+
+class MediaWorker:
+    def __init__(self, index, workers, host, port, port_range, commands):
+        """
+        单个媒体工作进程，只负责转发归属于自己的会议。
+        :param index: 工作进程编号
+        :param workers: 工作进程总数
+        :param host: 媒体端口绑定地址
+        :param port: 媒体端口（所有工作进程共享）
+        :param port_range: 本进程可用的客户端套接字端口范围
+        :param commands: 接收成员变更命令的管道
+        """
+        self.index = index
+        self.workers = workers
+        self.commands = commands
+        self.clients = {}  # 存储 {meeting_id: {client_id: (ip, port)}}
+        self.routes = {}  # 存储 {原始路由键: RouteEntry}
+        self.stream_routes = {}  # 存储 {流 ID: RouteEntry}
+        self.members = {}  # 存储 {(meeting_id, client_id): (stream_id, rtp_version, 音频采样率)}
+        self.socket_pool = RTPSocketPool(port_range=port_range)
+        self.forward_buffer = bytearray(65536)
+        self.forward_resampler = ForwardResampler()
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)  # 8MB 接收缓冲区
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        # 端口组中套接字的序号即绑定顺序，MediaPlane 按编号依次启动工作进程，使序号与进程编号一致
+        attach_stream_steering(self.sock, workers)
+
+        self.handoff_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.handoff_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+        self.handoff_sock.bind((HANDOFF_HOST, HANDOFF_BASE_PORT + index))
+        self.handoff_sock.setblocking(False)
+
+    def serve_forever(self):
+        """
+        工作进程主循环：处理媒体包、转交包和成员变更命令。
+        """
+        print(f"Media worker {self.index}/{self.workers} started.")
+        sources = [self.sock, self.handoff_sock, self.commands]
+        while True:
+            readable, _, _ = select.select(sources, [], [])
+            if self.commands in readable:
+                command = self.commands.recv()
+                if command[0] == "stop":
+                    break
+                try:
+                    self.apply(command)
+                except Exception as e:
+                    print(f"Media worker {self.index} failed to apply {command}: {e}")
+            if self.sock in readable:
+                self.drain(self.sock, handoff=True)
+            if self.handoff_sock in readable:
+                self.drain(self.handoff_sock, handoff=False)
+        print(f"Media worker {self.index} stopped.")
+
+    def drain(self, sock, handoff):
+        """
+        取空套接字中的数据包。
+        :param sock: 套接字
+        :param handoff: 是否需要把非本进程的会议转交出去
+        """
+        while True:
+            try:
+                data, address = sock.recvfrom(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                print(f"Media worker {self.index} receive error: {e}")
+                return
+            if handoff and data and data[0] == PAYLOAD_PROBE:
+                sock.sendto(probe_ack(data), address)  # 路径 MTU 探测由收到它的进程直接回复
+                continue
+            compact = is_compact_packet(data)
+            if not compact and len(data) < CLIENT_HEADER.size:
+                continue
+            if handoff:  # 内核已按流 ID 分发时 v2 数据包总是落在归属进程，只有旧版包头需要转交
+                if compact:
+                    owner = STREAM_ID_FIELD.unpack_from(data, 4)[0] % self.workers
+                else:
+                    owner = shard_for(data[20:24], self.workers)
+                if owner != self.index:
+                    self.handoff_sock.sendto(data, (HANDOFF_HOST, HANDOFF_BASE_PORT + owner))
+                    continue
+            if compact:
+                self.forward_compact(data)
+            else:
+                self.forward(data)
+
+    def forward(self, data):
+        """
+        按路由快照转发旧版包头的数据包。
+        """
+        route = self.routes.get(data[4:24])
+        if route is None:
+            return
+        if data[0] in AUDIO_PAYLOAD_TYPES:
+            for receivers, packet in legacy_audio_packets(route, data, self.forward_resampler, self.forward_buffer):
+                self.send_all(receivers, packet)
+        elif data[0] == PAYLOAD_VIDEO:
+            packet = rewrite_rtp_packet(data, self.forward_buffer)
+            self.send_all(route.receivers, packet)
+            self.send_all(route.legacy_receivers, packet)
+
+    def forward_compact(self, data):
+        """
+        按流 ID 转发 v2 数据包，v2 接收端原样转发，旧版接收端改写包头，音频按接收端的采样率转换。
+        """
+        route = self.stream_routes.get(STREAM_ID_FIELD.unpack_from(data, 4)[0])
+        payload_type = data[0] & 0x0F
+        if route is not None and payload_type in (PAYLOAD_NACK, PAYLOAD_REPORT):
+            self.send_all((route.sender,), data)  # 重传请求和接收报告转发给该流的发送端
+            return
+        audio = payload_type in AUDIO_PAYLOAD_TYPES
+        if route is None or not audio and payload_type not in (PAYLOAD_VIDEO, PAYLOAD_VIDEO_FEC, PAYLOAD_VIDEO_SLICE):
+            return
+        if audio:
+            for receivers, packet in compact_audio_packets(route, data, self.forward_resampler, self.forward_buffer):
+                self.send_all(receivers, packet)
+            return
+        self.send_all(route.receivers, data)
+        if route.legacy_receivers and payload_type == PAYLOAD_VIDEO:  # 旧版接收端不认识校验包和条带
+            self.send_all(route.legacy_receivers, compact_to_legacy(data, route.client_id_bytes, self.forward_buffer))
+
+    def send_all(self, receivers, packet):
+        for client_id, sendto, client_address in receivers:
+            try:
+                sendto(packet, client_address)
+            except OSError as e:
+                print(f"Error forwarding data to {client_id} at {client_address}: {e}")
+
+    def apply(self, command):
+        """
+        应用控制进程发来的成员变更。
+        :param command: ("register", meeting_id, client_id, address, stream_id, rtp_version, sample_rate)
+                        或 ("unregister", meeting_id, client_id)
+        """
+        action, meeting_id, client_id = command[:3]
+        if action == "register":
+            self.socket_pool.acquire(client_id)
+            self.clients.setdefault(meeting_id, {})[client_id] = tuple(command[3])
+            self.members[(meeting_id, client_id)] = tuple(command[4:7])
+        elif action == "unregister":
+            if client_id not in self.clients.get(meeting_id, {}):
+                return
+            del self.clients[meeting_id][client_id]
+            self.routes.pop(route_key(meeting_id, client_id), None)
+            stream_id, _, _ = self.members.pop((meeting_id, client_id))
+            self.stream_routes.pop(stream_id, None)
+            self.forward_resampler.forget(stream_id)
+            if not self.clients[meeting_id]:
+                del self.clients[meeting_id]
+            if not any(client_id in clients for clients in self.clients.values()):
+                self.socket_pool.release(client_id)
+        if meeting_id in self.clients:
+            self.publish_routes(meeting_id)
+
+    def publish_routes(self, meeting_id):
+        """
+        为会议中的每个发送端发布新的路由快照。
+        """
+        members = []
+        for client_id, address in self.clients[meeting_id].items():
+            stream_id, rtp_version, sample_rate = self.members[(meeting_id, client_id)]
+            members.append((client_id, stream_id, rtp_version, self.socket_pool.get(client_id).sendto, address,
+                            sample_rate))
+        for entry in build_routes(meeting_id, members):
+            self.routes[route_key(meeting_id, entry.client_id)] = entry
+            self.stream_routes[entry.stream_id] = entry
+
+
+def run_media_worker(index, workers, host, port, port_range, commands):
+    """
+    工作进程入口。
+    """
+    try:
+        worker = MediaWorker(index, workers, host, port, port_range, commands)
+        commands.send(("ready", index))  # 媒体端口已绑定，控制进程可以启动下一个工作进程
+        worker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+class MediaPlane:
+    def __init__(self, workers, port_range=(6000, 7000)):
+        """
+        在控制进程（FastAPI/WebSocket）中管理媒体工作进程。
+        :param workers: 工作进程数
+        :param port_range: 所有工作进程共用的客户端套接字端口范围，按进程均分
+        """
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError("SO_REUSEPORT is not supported on this platform.")
+        self.workers = workers
+        self.port_range = port_range
+        self.processes = []
+        self.pipes = []
+
+    def start(self, host, port):
+        """
+        依次启动所有工作进程，每个进程绑定媒体端口后再启动下一个，使端口组中套接字的序号与进程编号一致。
+        :param host: 媒体端口绑定地址
+        :param port: 媒体端口
+        """
+        context = multiprocessing.get_context("spawn")
+        start, end = self.port_range
+        span = (end - start) // self.workers
+        for index in range(self.workers):
+            parent_conn, child_conn = context.Pipe()
+            worker_range = (start + index * span, start + (index + 1) * span)
+            process = context.Process(target=run_media_worker,
+                                      args=(index, self.workers, host, port, worker_range, child_conn),
+                                      daemon=True)
+            process.start()
+            self.processes.append(process)
+            self.pipes.append(parent_conn)
+            if not parent_conn.poll(WORKER_START_TIMEOUT):
+                raise RuntimeError(f"Media worker {index} failed to start.")
+            parent_conn.recv()
+        print(f"Media plane started with {self.workers} workers on {host}:{port}")
+
+    def align_stream_id(self, stream_id, meeting_id):
+        """
+        返回不小于 stream_id 且对进程数取模等于会议所属进程的流 ID，使 v2 数据包可以直接按流 ID 分片。
+        """
+        owner = shard_for(meeting_id_bytes(meeting_id), self.workers)
+        return stream_id + (owner - stream_id) % self.workers
+
+    def register(self, meeting_id, client_id, address, stream_id, rtp_version, sample_rate):
+        """
+        把客户端注册到会议所属的工作进程。
+        :param sample_rate: 客户端协商的音频采样率，转发给采样率不同的接收端时重采样
+        """
+        owner = shard_for(meeting_id_bytes(meeting_id), self.workers)
+        self.pipes[owner].send(("register", meeting_id, client_id, tuple(address), stream_id, rtp_version,
+                                sample_rate))
+
+    def unregister(self, meeting_id, client_id):
+        """
+        从会议所属的工作进程中移除客户端。
+        """
+        owner = shard_for(meeting_id_bytes(meeting_id), self.workers)
+        self.pipes[owner].send(("unregister", meeting_id, client_id))
+
+    def stop(self):
+        """
+        停止所有工作进程。
+        """
+        for pipe in self.pipes:
+            pipe.send(("stop", None, None))
+        for process in self.processes:
+            process.join(timeout=2)
+        self.processes.clear()
+        self.pipes.clear()
@@ -5,18 +5,223 @@ import subprocess
 import time
 import uuid
 from asyncio import Lock
+from collections import namedtuple
 from concurrent.futures import ThreadPoolExecutor
 
+from network.socket_pool import RTPSocketPool
+from network.udp_ingest import BatchedUDPReceiver
 from shared.Video_packet_assembler import VideoPacketAssembler
+from shared.audio_codec import create_encoder, decode_audio
+from shared.fec import FEC_HEADER, FecEncoder
+from shared.pacer import DEFAULT_PACING_RATE, PRIORITY_AUDIO, PRIORITY_REPAIR, PRIORITY_VIDEO, Pacer, PacerGroup
+from shared.packetizer import Packetizer
+from shared.path_mtu import DEFAULT_MTU, MIN_MTU, probe_ack
+from shared.rtcp import REPORT_INTERVAL, ReceiveStatistics, ReportTable
+from shared.resampler import Resampler
+from shared.slice_codec import SliceAssembler, SliceCompositor
+from shared.protocols import (AUDIO_CODEC_PCM, AUDIO_PAYLOAD_TYPES, COMPACT_HEADER, DEFAULT_FRAME_DURATION,
+                              DEFAULT_SAMPLE_RATE, LEGACY_SAMPLE_RATE, COMPACT_TIMESTAMP, FLAG_RETRANSMIT, FLAG_SLICE, FRAGMENT_FIELDS,
+                              LEGACY_DOWNLINK_HEADER, LEGACY_TIMESTAMP, LEGACY_UPLINK_HEADER, PAYLOAD_AUDIO, PAYLOAD_NACK,
+                              PAYLOAD_PROBE, PAYLOAD_REPORT, PAYLOAD_VIDEO, PAYLOAD_VIDEO_FEC, PAYLOAD_VIDEO_SLICE,
+                              RTP_VERSION_COMPACT, pack_nack, pack_report, unpack_nack, unpack_report,
+                              RTP_VERSION_LEGACY, SERVER_STREAM_ID, STREAM_ID_FIELD, UPLINK_LAYOUT, PacketView,
+                              is_compact_packet, media_timestamp)
 from shared.dynamic_video_frame_manager import DynamicVideoFrameManager
 from shared.connection_manager import ConnectionManager
 from shared.dynamic_audio_manager import DynamicAudioManager
 import cv2
-import pyaudio
 import numpy as np
 import math
 
-MAX_UDP_PACKET_SIZE = 1500  # 最大 UDP 数据包大小
+CLIENT_HEADER = LEGACY_UPLINK_HEADER  # 客户端 → 服务器
+SERVER_HEADER = LEGACY_DOWNLINK_HEADER  # 服务器 → 客户端
+SEQUENCE_FIELDS = FRAGMENT_FIELDS  # 序列号 + 总包数
+FRAME_FIELDS = struct.Struct('!HHH')  # v2 包头中的帧 ID + 分片序号 + 分片总数（偏移 8）
+
+# 路由快照：发送端所在会议、发送端 ID、流 ID、16 字节客户端 ID，以及已排除发送端的接收端列表
+# receivers 为支持 v2 包头的接收端，legacy_receivers 为只支持旧版包头的接收端，元素均为 (client_id, sendto, address)
+# sender 为发送端自身的 (client_id, sendto, address)，用于把 NACK 转发回发送端
+# 音频按采样率分组：sample_rate 为发送端协商的采样率，audio_receivers / legacy_audio_receivers 为采样率相同、
+# 可以直接转发的接收端，resampled_receivers 为 ((目标采样率, v2 接收端, 旧版接收端), ...)，转发前需要重采样
+RouteEntry = namedtuple('RouteEntry', ['meeting_id', 'client_id', 'stream_id', 'client_id_bytes',
+                                       'receivers', 'legacy_receivers', 'sender', 'sample_rate',
+                                       'audio_receivers', 'legacy_audio_receivers', 'resampled_receivers'])
+NACK_CHECK_INTERVAL = 0.02  # "same" 模式下检查未完成视频帧并发送 NACK 的周期（秒）
+
+
+def route_key(meeting_id, client_id):
+    """
+    计算客户端包头中的路由键（16 字节 client_id + 4 字节 meeting_id），与 RTPClient.create_rtp_packet 的编码一致。
+    :param meeting_id: 会议 ID
+    :param client_id: 客户端 ID (UUID 字符串)
+    :return: 20 字节的原始路由键
+    """
+    return uuid.UUID(client_id).bytes + meeting_id.encode('utf-8').ljust(4, b'\0')[:4]
+
+
+def rewrite_rtp_packet(data, out=None, payload=None):
+    """
+    将客户端格式的 RTP 包直接改写为接收端格式，只做内存拷贝，不解析 UUID、不重新打包负载。
+    :param data: 客户端发来的原始数据包
+    :param out: （可选）预分配的输出缓冲区，传入时原地改写并返回其 memoryview
+    :param payload: （可选）替换的负载（如重采样后的音频），为 None 时使用原数据包的负载
+    :return: 接收端格式的数据包
+    """
+    view = memoryview(data)
+    length = (len(view) - CLIENT_HEADER.size if payload is None else len(payload)) + SERVER_HEADER.size
+    packet = bytearray(length) if out is None else memoryview(out)[:length]
+    packet[0:4] = view[0:4]  # payload_type + 负载长度
+    if payload is not None:
+        payload_length = len(payload)
+        packet[1:4] = bytes(((payload_length >> 8) & 0xFF, 0, payload_length & 0xFF))
+    packet[4:12] = view[28:36]  # 时间戳（保留发送端的时间戳）
+    packet[12:16] = view[24:28]  # 序列号 + 总包数
+    packet[16:32] = view[4:20]  # 客户端 ID
+    packet[SERVER_HEADER.size:] = view[CLIENT_HEADER.size:] if payload is None else payload
+    return packet
+
+
+def compact_to_legacy(data, client_id_bytes, out, payload_type=None, payload=None):
+    """
+    将 v2 数据包改写为旧版接收端格式，用于转发给只支持旧版包头的客户端。
+    :param data: v2 数据包
+    :param client_id_bytes: 发送端的 16 字节客户端 ID
+    :param out: 预分配的输出缓冲区
+    :param payload_type: （可选）替换的负载类型，与 payload 一起给出
+    :param payload: （可选）替换的负载（如解码后的音频），为 None 时使用原数据包的负载
+    :return: 旧版格式数据包（out 的 memoryview）
+    """
+    view = memoryview(data)
+    if payload is None:
+        payload_type, payload = data[0] & 0x0F, view[COMPACT_HEADER.size:]
+    payload_length = len(payload)
+    _, _, _, _, _, fragment_index, fragment_count, timestamp = COMPACT_HEADER.unpack_from(view)
+    SERVER_HEADER.pack_into(out, 0, payload_type, (payload_length >> 8) & 0xFF, payload_length & 0xFF,
+                            LEGACY_TIMESTAMP.pack(timestamp), fragment_index, fragment_count, client_id_bytes)
+    packet = memoryview(out)[:SERVER_HEADER.size + payload_length]
+    packet[SERVER_HEADER.size:] = payload
+    return packet
+
+
+def compact_audio_to_legacy(data, client_id_bytes, out):
+    """
+    将 v2 音频包改写为旧版接收端格式。旧版客户端只能播放原始 PCM，μ-law 等压缩音频先解码。
+    :return: 旧版格式数据包（out 的 memoryview），无法解码时返回 None
+    """
+    payload_type = data[0] & 0x0F
+    if payload_type == PAYLOAD_AUDIO:
+        return compact_to_legacy(data, client_id_bytes, out)
+    pcm = decode_audio(payload_type, memoryview(data)[COMPACT_HEADER.size:])
+    return compact_to_legacy(data, client_id_bytes, out, PAYLOAD_AUDIO, pcm) if pcm else None
+
+
+def replace_compact_payload(data, payload_type, payload, out):
+    """
+    复制 v2 包头（流 ID、序列号和时间戳不变），替换负载类型和负载。
+    :return: 新数据包（out 的 memoryview）
+    """
+    packet = memoryview(out)[:COMPACT_HEADER.size + len(payload)]
+    packet[:COMPACT_HEADER.size] = memoryview(data)[:COMPACT_HEADER.size]
+    packet[0] = (data[0] & 0xF0) | payload_type
+    packet[COMPACT_HEADER.size:] = payload
+    return packet
+
+
+class ForwardResampler:
+    def __init__(self):
+        """
+        不经过混音的转发路径上的采样率转换：接收端协商的采样率与发送端不同时，把音频解码、重采样后以原始 PCM 转发。
+        每个 (发送流, 目标采样率) 一个重采样器，同一目标采样率的接收端共用一次转换结果。
+        """
+        self.resamplers = {}  # 存储 {(流 ID, 目标采样率): Resampler}
+
+    def resample(self, route, sample_rate, payload_type, payload):
+        """
+        :param route: 发送端的 RouteEntry
+        :param sample_rate: 目标采样率
+        :param payload_type: 音频负载类型
+        :param payload: 音频负载
+        :return: 目标采样率的 PCM 数据（bytes），无法解码时返回 None
+        """
+        pcm = decode_audio(payload_type, payload)
+        if not pcm:
+            return None
+        resampler = self.resamplers.get((route.stream_id, sample_rate))
+        if resampler is None or resampler.input_rate != route.sample_rate:
+            resampler = self.resamplers[(route.stream_id, sample_rate)] = Resampler(route.sample_rate, sample_rate)
+        return resampler.process(pcm).tobytes()
+
+    def forget(self, stream_id):
+        """
+        删除已注销的流的重采样器。
+        """
+        for key in [key for key in self.resamplers if key[0] == stream_id]:
+            del self.resamplers[key]
+
+
+def compact_audio_packets(route, data, forward_resampler, out):
+    """
+    按接收端的包头版本和采样率生成 v2 音频包的转发结果：采样率相同的 v2 接收端原样转发，
+    旧版接收端解码为 PCM 并改写包头，采样率不同的接收端先重采样。生成的数据包复用 out，须在取下一个之前发出。
+    :return: 依次生成 (接收端列表, 数据包)
+    """
+    if route.audio_receivers:
+        yield route.audio_receivers, data
+    if route.legacy_audio_receivers:
+        packet = compact_audio_to_legacy(data, route.client_id_bytes, out)
+        if packet is not None:
+            yield route.legacy_audio_receivers, packet
+    for sample_rate, receivers, legacy_receivers in route.resampled_receivers:
+        pcm = forward_resampler.resample(route, sample_rate, data[0] & 0x0F, memoryview(data)[COMPACT_HEADER.size:])
+        if pcm is None:
+            return
+        if receivers:
+            yield receivers, replace_compact_payload(data, PAYLOAD_AUDIO, pcm, out)
+        if legacy_receivers:
+            yield legacy_receivers, compact_to_legacy(data, route.client_id_bytes, out, PAYLOAD_AUDIO, pcm)
+
+
+def legacy_audio_packets(route, data, forward_resampler, out):
+    """
+    按接收端的采样率生成旧版包头音频包（44.1 kHz 原始 PCM）的转发结果，说明同 compact_audio_packets。
+    :return: 依次生成 (接收端列表, 数据包)
+    """
+    if route.audio_receivers or route.legacy_audio_receivers:
+        yield route.audio_receivers + route.legacy_audio_receivers, rewrite_rtp_packet(data, out)
+    for sample_rate, receivers, legacy_receivers in route.resampled_receivers:
+        pcm = forward_resampler.resample(route, sample_rate, data[0], memoryview(data)[CLIENT_HEADER.size:])
+        if pcm is None:
+            return
+        yield receivers + legacy_receivers, rewrite_rtp_packet(data, out, pcm)
+
+
+def build_routes(meeting_id, members):
+    """
+    根据会议成员构建每个发送端的路由快照。
+    :param meeting_id: 会议 ID
+    :param members: 成员列表 [(client_id, stream_id, rtp_version, sendto, address, 音频采样率), ...]，
+                    旧版客户端的采样率为 LEGACY_SAMPLE_RATE
+    :return: RouteEntry 列表
+    """
+    entries = []
+    for client_id, stream_id, _, sendto, address, sample_rate in members:
+        others = [member for member in members if member[0] != client_id]
+        compact = [member for member in others if member[2] == RTP_VERSION_COMPACT]
+        legacy = [member for member in others if member[2] != RTP_VERSION_COMPACT]
+        receivers = tuple((member[0], member[3], member[4]) for member in compact)
+        legacy_receivers = tuple((member[0], member[3], member[4]) for member in legacy)
+        resampled = []
+        for rate in sorted({member[5] for member in others} - {sample_rate}):
+            resampled.append((rate, tuple((member[0], member[3], member[4]) for member in compact if member[5] == rate),
+                              tuple((member[0], member[3], member[4]) for member in legacy if member[5] == rate)))
+        entries.append(RouteEntry(meeting_id, client_id, stream_id, uuid.UUID(client_id).bytes,
+                                  receivers, legacy_receivers, (client_id, sendto, address), sample_rate,
+                                  tuple(receiver for receiver, member in zip(receivers, compact)
+                                        if member[5] == sample_rate),
+                                  tuple(receiver for receiver, member in zip(legacy_receivers, legacy)
+                                        if member[5] == sample_rate),
+                                  tuple(resampled)))
+    return entries
 
 
 class RTPManager:
@@ -27,31 +232,75 @@ class RTPManager:
             cls._instance = super(RTPManager, cls).__new__(cls)
         return cls._instance
 
-    def __init__(self, websockets):
+    def __init__(self, websockets, port_range=(6000, 7000), max_sockets=None, offload=False, fec=False,
+                 pacing=True, priority=True, dscp=False, mix_audio=True, audio_sample_rate=DEFAULT_SAMPLE_RATE,
+                 audio_frame_duration=DEFAULT_FRAME_DURATION):
         """
         初始化 RTPManager，用于管理 RTP 数据包的创建、解析和转发。
+        :param websockets: WebSocketManager 实例
+        :param port_range: 每个客户端 RTP 套接字可用的端口范围 [start, end)
+        :param max_sockets: 同时打开的客户端套接字上限（默认等于端口范围大小）
+        :param offload: 是否在客户端套接字上启用 Linux UDP GSO（内核不支持时自动退回；启用 pacing 或 priority 时 GSO 不生效）
+        :param fec: 是否为服务器发往 v2 客户端的视频帧发送 XOR 校验包
+        :param pacing: 是否平滑发送服务器发往客户端的视频（转发的数据包不经过发送队列）
+        :param priority: 是否按优先级调度服务器自身发出的媒体（音频 > 视频 > 重传/FEC）；开启平滑发送或优先级调度时不使用 GSO
+        :param dscp: 是否按类别标记 DSCP（音频 EF，视频 AF41）
+        :param mix_audio: 是否在服务器混音（每个接收端收到一路除自己以外的混音），否则音频逐路转发
+        :param audio_sample_rate: 混音采样率，INIT 时作为首选采样率与客户端协商
+        :param audio_frame_duration: 混音节拍（毫秒），INIT 时作为首选帧长与客户端协商
         """
-        self.start_port = 6000  # RTP 服务器起始端口
+        self.socket_pool = RTPSocketPool(port_range=port_range, max_sockets=max_sockets)
         self.frame_interval = 1 / 30  # 目标帧率（每秒 30 帧）
         self.protocol = None
         self.transport = None
+        self.ingest = None  # 批量收包引擎（engine="batch" 时使用）
+        self.media_plane = None  # 多进程媒体平面（启用后由工作进程负责转发）
         self.clients = {}  # 存储 {meeting_id: {client_id: (ip, port)}}
-        self.client_sockets = {}  # 存储每个客户端的socket
+        self.routes = {}  # 存储 {原始路由键: RouteEntry}，由成员变更发布，转发时只读
+        self.stream_routes = {}  # 存储 {流 ID: RouteEntry}，v2 包头只需一次整数查找
+        self.stream_ids = {}  # 存储 {(meeting_id, client_id): 流 ID}
+        self.client_stream_ids = {}  # 存储 {client_id: 流 ID}，发送时按客户端 ID 直接查找，随注册和注销更新
+        self.client_versions = {}  # 存储 {client_id: 协商的 RTP 包头版本}
+        self.client_codecs = {}  # 存储 {client_id: (与服务器协商的音频编码, 点对点时对端使用的音频编码)}
+        self.audio_encoders = {}  # 存储 {client_id: 音频编码器}，服务器发往每个客户端的混音按该客户端协商的编码压缩
+        self.audio_sample_rate = audio_sample_rate
+        self.audio_frame_duration = audio_frame_duration
+        self.client_audio_formats = {}  # 存储 {client_id: 协商的 (采样率, 每帧时长)}
+        self.audio_resamplers = {}  # 存储 {client_id: (上行 Resampler, 下行 Resampler)}，客户端采样率与混音采样率不同时使用
+        self.client_mtus = {}  # 存储 {client_id: 客户端探测到的路径 MTU}
+        self.next_stream_id = SERVER_STREAM_ID + 1
+        self.forward_buffer = bytearray(65536)  # 转发时改写包头用的预分配缓冲区
+        self.forward_resampler = ForwardResampler()  # 不混音时，转发给采样率不同的接收端前重采样
+        self.packetizers = {}  # 存储 {client_id: Packetizer}，服务器发往每个客户端的视频流
+        self.audio_packetizers = {}  # 存储 {client_id: Packetizer}，服务器发往每个客户端的音频流（混音）
+        self.offload = offload
+        self.fec = fec
+        self.fec_encoders = {}  # 存储 {client_id: FecEncoder}，按各接收端的丢包率调整冗余
+        self.pacing = pacing
+        self.priority = priority
+        self.dscp = dscp
+        self.pacers = {}  # 存储 {client_id: Pacer}，服务器发往每个客户端的媒体发送调度器
+        self.pacer_group = PacerGroup()  # 所有客户端的 Pacer 共用一个发送线程
+        if offload and (pacing or priority):
+            print("UDP offload: GSO stays off while the pacer is enabled, paced packets are sent one at a time.")
+        self.nack_task = None  # "same" 模式下为上行视频请求重传的任务
+        self.uplink_stats = {}  # 存储 {(流 ID, 媒体类型): ReceiveStatistics}，服务器收到的 v2 上行流
+        self.downlink_reports = {}  # 存储 {client_id: ReportTable}，客户端对服务器自身发出的流的接收报告
+        self.report_task = None  # 向发送端发送上行接收报告的任务
+        self.mix_audio = mix_audio
+        self.mix_task = None  # 按节拍混音并发送的任务
+        self.client_sockets = self.socket_pool.sockets  # 存储每个客户端的socket（由套接字池管理）
         self.buffers = {}  # 存储 {meeting_id: {client_id: [data1, data2, ...]}}
         self.buffer_size = 1  # 默认缓冲区大小
         self.connection_manager = ConnectionManager()  # 保持连接管理逻辑
         self.dynamic_video_frame_manager = DynamicVideoFrameManager()
-        self.dynamic_audio_manager = DynamicAudioManager()
+        self.dynamic_audio_manager = DynamicAudioManager(audio_sample_rate, audio_frame_duration / 1000)
         self.websockets = websockets
 
-        # 初始化音频播放流
-        self.audio_player = pyaudio.PyAudio()
-        self.audio_stream = self.audio_player.open(format=pyaudio.paInt16,
-                                                   channels=1,
-                                                   rate=44100,
-                                                   output=True)
-        self.lock = asyncio.Lock()
+        self.lock = asyncio.Lock()  # 只保护成员变更，转发路径不加锁
         self.video_assemblers = {}  # 存储每个视频流的 VideoPacketAssembler
+        self.slice_assemblers = {}  # 存储条带模式视频流的 SliceAssembler（"same" 模式下服务器自己合成画面）
+        self.slice_compositors = {}  # 存储条带模式视频流的 SliceCompositor
         self.video_frame = {}  # 存储每个会议的客户端帧
         self.executor = ThreadPoolExecutor(max_workers=5)  # 最大线程池数
         self.mode = "default"
@@ -63,25 +312,78 @@ class RTPManager:
 
     async def register_socket(self, client_id):
         """
-        注册客户端的socket。
+        从套接字池为客户端分配 socket。
         :param client_id: 客户端 ID
+        :raises SocketPoolExhausted: 端口池已耗尽
         """
         if client_id in self.client_sockets:
             print(f"Client {client_id} socket already registered.")
             return
-        self.client_sockets[client_id] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        while True:
-            try:
-                self.client_sockets[client_id].bind(("0.0.0.0", self.start_port))
-                self.client_sockets[client_id].setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
-                                                          8 * 1024 * 1024)  # 8MB 接收缓冲区
-                self.client_sockets[client_id].setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
-                                                          8 * 1024 * 1024)  # 8MB 发送缓冲区
-                break
-            except OSError:
-                self.start_port += 1
-        client_address = self.client_sockets[client_id].getsockname()
-        print(f"Client {client_id} socket registered at {client_address}.")
+        client_address = self.socket_pool.acquire(client_id).getsockname()
+        print(f"Client {client_id} socket registered at {client_address}. Pool: {self.socket_pool.stats()}")
+
+    def release_socket(self, client_id):
+        """
+        客户端不再属于任何会议时关闭其 socket 并回收端口。
+        :param client_id: 客户端 ID
+        """
+        if any(client_id in clients for clients in self.clients.values()):
+            return
+        # 先停止发送调度器，避免它在端口回收（可能已分配给新客户端）之后继续用这个 socket 发送
+        pacer = self.pacers.pop(client_id, None)
+        if pacer is not None:
+            pacer.close()
+        self.socket_pool.release(client_id)
+        self.packetizers.pop(client_id, None)
+        self.audio_packetizers.pop(client_id, None)
+        self.audio_encoders.pop(client_id, None)
+        self.audio_resamplers.pop(client_id, None)
+        self.fec_encoders.pop(client_id, None)
+        self.downlink_reports.pop(client_id, None)
+        self.client_mtus.pop(client_id, None)  # 客户端每次建立 RTP 会话都会重新探测并发送 SET_MTU
+        if self.connection_manager.get_connection(client_id) is None:
+            self.forget_client(client_id)
+
+    def forget_client(self, client_id):
+        """
+        客户端断开 WebSocket 连接且不在任何会议中时，删除 INIT 时协商的包头版本、音频编码和音频格式。
+        仍保持连接的客户端退出会议后可能重新加入，协商结果要保留到连接断开。
+        :param client_id: 客户端 ID
+        """
+        if any(client_id in clients for clients in self.clients.values()):
+            return
+        self.client_versions.pop(client_id, None)
+        self.client_codecs.pop(client_id, None)
+        self.client_audio_formats.pop(client_id, None)
+        self.client_mtus.pop(client_id, None)
+        self.audio_encoders.pop(client_id, None)
+        self.audio_resamplers.pop(client_id, None)
+
+    def set_client_mtu(self, client_id, mtu):
+        """
+        记录客户端探测到的路径 MTU，服务器发往该客户端的数据包按此分包。
+        :param client_id: 客户端 ID
+        :param mtu: 路径 MTU
+        :return: 实际采用的 MTU
+        """
+        mtu = max(MIN_MTU, min(int(mtu), 65535))
+        self.client_mtus[client_id] = mtu
+        for packetizer in (self.packetizers.get(client_id), self.audio_packetizers.get(client_id)):
+            if packetizer is not None:
+                packetizer.set_mtu(mtu)
+        print(f"Client {client_id} path MTU set to {mtu}")
+        return mtu
+
+    def allocate_stream_id(self, meeting_id):
+        """
+        分配新的流 ID。启用多进程媒体平面时，流 ID 对进程数取模等于会议所属的工作进程。
+        :param meeting_id: 会议 ID
+        """
+        stream_id = self.next_stream_id
+        if self.media_plane is not None:
+            stream_id = self.media_plane.align_stream_id(stream_id, meeting_id)
+        self.next_stream_id = stream_id + 1
+        return stream_id
 
     async def register_client(self, meeting_id, client_id, address):
         """
@@ -89,8 +391,11 @@ class RTPManager:
         :param client_id: 客户端 ID
         :param meeting_id: 会议 ID
         :param address: 客户端的 (IP, Port)
+        :return: 分配给该客户端的流 ID
         """
         async with self.lock:
+            if self.media_plane is None:
+                await self.register_socket(client_id)  # 端口池耗尽时抛出 SocketPoolExhausted，不留下空会议
             # 初始化会议和客户端信息
             if meeting_id not in self.clients:
                 self.clients[meeting_id] = {}
@@ -98,11 +403,22 @@ class RTPManager:
                 print(f"Meeting {meeting_id} initialized.")
 
                 # self.start_stream_for_client(client_id, host=address[0], port=address[1]) # 相关管道发送的内容，这里并未完成
-            await self.register_socket(client_id)
             self.clients[meeting_id][client_id] = address
             self.buffers[meeting_id][client_id] = []  # 初始化缓冲区
+            if (meeting_id, client_id) not in self.stream_ids:
+                self.stream_ids[(meeting_id, client_id)] = self.allocate_stream_id(meeting_id)
+            stream_id = self.client_stream_ids[client_id] = self.stream_ids[(meeting_id, client_id)]
+            if self.media_plane is None:
+                self.publish_routes(meeting_id)
+                if self.mix_audio:
+                    self.dynamic_audio_manager.add_client(meeting_id, client_id)
+            else:
+                self.media_plane.register(meeting_id, client_id, address, stream_id,
+                                          self.client_versions.get(client_id, RTP_VERSION_LEGACY),
+                                          self.client_sample_rate(client_id))
             await self.register_meeting(meeting_id)  # 注册会议并启动视频帧转发任务
-            print(f"Client {client_id} registered to meeting {meeting_id}. Current clients: {self.clients}")
+            print(f"Client {client_id} registered to meeting {meeting_id} as stream {stream_id}. Current clients: {self.clients}")
+        return stream_id
 
     async def unregister_client(self, client_id, meeting_id):
         """
@@ -114,12 +430,44 @@ class RTPManager:
             if meeting_id in self.clients and client_id in self.clients[meeting_id]:
                 del self.clients[meeting_id][client_id]
                 del self.buffers[meeting_id][client_id]
+                self.routes.pop(route_key(meeting_id, client_id), None)
+                stream_id = self.stream_ids.pop((meeting_id, client_id), None)
+                self.stream_routes.pop(stream_id, None)
+                self.forward_resampler.forget(stream_id)
+                if self.client_stream_ids.get(client_id) == stream_id:
+                    # 客户端仍在其他会议中时改用那个会议的流 ID（注销很少发生，可以遍历）
+                    remaining = [stream_id_ for (_, client_id_), stream_id_ in self.stream_ids.items()
+                                 if client_id_ == client_id]
+                    if remaining:
+                        self.client_stream_ids[client_id] = remaining[0]
+                    else:
+                        del self.client_stream_ids[client_id]
                 if not self.clients[meeting_id]:  # 如果会议中无其他客户端，则删除会议
                     del self.clients[meeting_id]
                     del self.buffers[meeting_id]
+                elif self.media_plane is None:
+                    self.publish_routes(meeting_id)
+                if self.media_plane is None:
+                    self.release_socket(client_id)
+                else:
+                    self.media_plane.unregister(meeting_id, client_id)
                 print(f"Client {client_id} unregistered from meeting {meeting_id}. Current clients: {self.clients}")
                 self.dynamic_video_frame_manager.remove_client(meeting_id, client_id)
-                # self.dynamic_audio_manager.remove_client(meeting_id, client_id)
+                self.dynamic_audio_manager.remove_client(meeting_id, client_id)
+
+    def publish_routes(self, meeting_id):
+        """
+        为会议中的每个发送端发布新的不可变路由快照（接收端列表中已排除发送端自身）。
+        转发路径只读取快照，因此不需要加锁或复制字典。
+        :param meeting_id: 会议 ID
+        """
+        members = [(client_id, self.stream_ids[(meeting_id, client_id)],
+                    self.client_versions.get(client_id, RTP_VERSION_LEGACY),
+                    self.client_sockets[client_id].sendto, address, self.client_sample_rate(client_id))
+                   for client_id, address in self.clients[meeting_id].items()]
+        for entry in build_routes(meeting_id, members):
+            self.routes[route_key(meeting_id, entry.client_id)] = entry
+            self.stream_routes[entry.stream_id] = entry
 
     async def register_meeting(self, meeting_id):
         """
@@ -184,56 +532,32 @@ class RTPManager:
 
     def parse_rtp_packet(self, packet):
         """
-        解析 RTP 数据包。
+        解析客户端发来的 RTP 数据包。
         :param packet: RTP 数据包
-        :return: 数据包的字段字典和负载
+        :return: PacketView，包头字段按需解析，负载为零拷贝切片
         """
-        header_length = 1 + 2 + 2 + 2 + 16 + 4 + 1 + 8
-        # 1 字节 payload_type + 2 字节 payload_length + 2 字节 sequence_number +
-        # 2 字节 total_packets + 16 字节 client_id + 4 字节 meeting_id
+        return PacketView.parse(packet, UPLINK_LAYOUT)
 
-        if len(packet) < header_length:
-            raise ValueError("Packet is too short to be a valid RTP packet")
-
-        header = packet[:header_length]  # RTP 包头
-        payload = packet[header_length:]  # RTP 负载（实际的数据）
-
-        # 解析 RTP 头部
-        (payload_type, high_byte, low_byte,
-         client_id_bytes, meeting_id_bytes,
-         sequence_number, total_packets, timestamp_bytes) = struct.unpack('!BBH16s4sHH8s', header)
-
-        # 计算负载长度
-        payload_length = (high_byte << 8) | low_byte
-
-        # 将 client_id 转换为 UUID 字符串
-        client_id = str(uuid.UUID(bytes=client_id_bytes))
-
-        # 将 meeting_id 转换为字符串（假设它是一个编码后的字符串）
-        meeting_id = meeting_id_bytes.decode('utf-8').strip('\x00')
-
-        # 解析时间戳
-        timestamp = struct.unpack('!Q', timestamp_bytes)[0]  # 8 字节时间戳
-
-        # 返回解析后的数据
-        return {
-            'payload_type': payload_type,
-            'payload_length': payload_length,
-            'sequence_number': sequence_number,
-            'total_packets': total_packets,
-            'client_id': client_id,
-            'meeting_id': meeting_id,
-            'payload': payload,  # 返回负载数据
-            'timestamp': timestamp
-        }
-
-    async def start_udp_server(self, host, port):
+    async def start_udp_server(self, host, port, engine="protocol"):
         """
         启动 UDP 服务器，监听 RTP 数据包。
         :param host: 主机地址
         :param port: 监听端口
+        :param engine: 接收引擎，"protocol" 使用 asyncio 的 DatagramProtocol，"batch" 使用独立线程批量收包
         """
         loop = asyncio.get_event_loop()
+        if engine == "batch":
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)  # 8MB 接收缓冲区
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 8 * 1024 * 1024)  # 8MB 发送缓冲区
+            sock.bind((host, port))
+            self.ingest = BatchedUDPReceiver(sock, self.handle_batch, loop)
+            self.ingest.start()
+            self.report_task = asyncio.create_task(self.report_loop())
+            if self.mix_audio:
+                self.mix_task = asyncio.create_task(self.audio_mix_loop())
+            print(f"RTP UDP server (batch engine) started on {host}:{port}")
+            return
         self.transport, self.protocol = await loop.create_datagram_endpoint(
             lambda: RTPProtocol(self),
             local_addr=(host, port)
@@ -242,13 +566,364 @@ class RTPManager:
         sock = self.transport.get_extra_info('socket')  # 获取底层的套接字
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)  # 8MB 接收缓冲区
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 8 * 1024 * 1024)  # 8MB 发送缓冲区
+        self.report_task = asyncio.create_task(self.report_loop())
+        if self.mix_audio:
+            self.mix_task = asyncio.create_task(self.audio_mix_loop())
         print(f"RTP UDP server started on {host}:{port}")
 
+    def route_datagram(self, data, key, payload_type, sequence_number=None, total_packets=None):
+        """
+        转发或处理一个客户端 RTP 包。只按原始字节查找路由键，转发时直接改写包头，不构造字典或 UUID 对象。
+        :param data: 数据包（bytes 或 memoryview，调用返回后不再引用）
+        :param key: 20 字节路由键（client_id + meeting_id）
+        :param payload_type: 数据类型 (0x01: 视频, 0x02/0x07/0x08: PCM/μ-law/ADPCM 音频)
+        :param sequence_number: 包的序列号（可选，批量解析时已给出）
+        :param total_packets: 视频总包数（可选，批量解析时已给出）
+        """
+        route = self.routes.get(key)
+        if route is None:
+            return  # 未注册的客户端
+
+        # 根据负载类型来播放数据
+        if payload_type == 0x01:  # 视频类型
+            if self.mode == "same":
+                if sequence_number is None:
+                    sequence_number, total_packets = SEQUENCE_FIELDS.unpack_from(data, 24)
+                asyncio.create_task(self.play_video(route.client_id, route.meeting_id, bytes(data[CLIENT_HEADER.size:]),
+                                                    sequence_number, total_packets))
+            else:
+                packet = rewrite_rtp_packet(data, self.forward_buffer)
+                self.forward_to_receivers(route.receivers, packet)
+                self.forward_to_receivers(route.legacy_receivers, packet)
+
+        elif payload_type in AUDIO_PAYLOAD_TYPES:  # 音频类型
+            if self.mix_audio:
+                self.dynamic_audio_manager.add_or_update_client_audio(
+                    route.meeting_id, route.client_id, LEGACY_TIMESTAMP.unpack_from(data, 28)[0],
+                    self.mixer_input(route.client_id, payload_type, data[CLIENT_HEADER.size:]))
+                return
+            for receivers, packet in legacy_audio_packets(route, data, self.forward_resampler, self.forward_buffer):
+                self.forward_to_receivers(receivers, packet)
+
+    def route_compact(self, data):
+        """
+        转发或处理一个 v2 紧凑包头的数据包：按流 ID 一次整数查找，原样转发给 v2 接收端，
+        只有旧版接收端需要改写包头。
+        :param data: 数据包（bytes 或 memoryview，调用返回后不再引用）
+        """
+        stream_id = STREAM_ID_FIELD.unpack_from(data, 4)[0]
+        payload_type = data[0] & 0x0F
+        if payload_type == PAYLOAD_NACK:
+            self.route_nack(stream_id, data)
+            return
+        if payload_type == PAYLOAD_REPORT:
+            self.route_report(stream_id, data)
+            return
+        route = self.stream_routes.get(stream_id)
+        if route is None:
+            return  # 未注册的流
+        self.record_uplink(stream_id, payload_type, data)
+        if payload_type in (PAYLOAD_VIDEO, PAYLOAD_VIDEO_SLICE) and self.mode == "same":
+            _, _, stream_sequence, _, frame_id, fragment_index, fragment_count, _ = COMPACT_HEADER.unpack_from(data)
+            play = self.play_slice if payload_type == PAYLOAD_VIDEO_SLICE else self.play_video
+            asyncio.create_task(play(route.client_id, route.meeting_id, bytes(data[COMPACT_HEADER.size:]),
+                                     fragment_index, fragment_count, frame_id, stream_sequence))
+        elif payload_type == PAYLOAD_VIDEO_FEC:
+            if self.mode == "same":
+                asyncio.create_task(self.play_parity(route.client_id, route.meeting_id,
+                                                     bytes(data[COMPACT_HEADER.size:]), FRAME_FIELDS.unpack_from(data, 8)[0],
+                                                     bool(data[1] & FLAG_SLICE)))
+            else:
+                self.forward_to_receivers(route.receivers, data)  # 旧版接收端不认识校验包，不转发
+        elif payload_type == PAYLOAD_VIDEO_SLICE:
+            self.forward_to_receivers(route.receivers, data)  # 条带只能用 v2 包头表示，旧版接收端收不到
+        elif payload_type in AUDIO_PAYLOAD_TYPES and self.mix_audio:
+            self.dynamic_audio_manager.add_or_update_client_audio(
+                route.meeting_id, route.client_id, COMPACT_TIMESTAMP.unpack_from(data, 14)[0],
+                self.mixer_input(route.client_id, payload_type, data[COMPACT_HEADER.size:]))
+        elif payload_type in AUDIO_PAYLOAD_TYPES:
+            for receivers, packet in compact_audio_packets(route, data, self.forward_resampler, self.forward_buffer):
+                self.forward_to_receivers(receivers, packet)
+        elif payload_type == PAYLOAD_VIDEO:
+            self.forward_to_receivers(route.receivers, data)
+            if route.legacy_receivers:
+                self.forward_to_receivers(route.legacy_receivers,
+                                          compact_to_legacy(data, route.client_id_bytes, self.forward_buffer))
+
+    def route_nack(self, stream_id, data):
+        """
+        处理 NACK：针对客户端视频流的 NACK 转发给该流的发送端，针对服务器合成画面的 NACK 由服务器重传。
+        :param stream_id: 丢包的媒体流 ID
+        :param data: NACK 数据包
+        """
+        if stream_id != SERVER_STREAM_ID:
+            route = self.stream_routes.get(stream_id)
+            if route is not None:
+                self.forward_to_receivers((route.sender,), data)
+            return
+        try:
+            reporter_stream_id, sequences = unpack_nack(data[COMPACT_HEADER.size:])
+        except (ValueError, struct.error):
+            return
+        reporter = self.stream_routes.get(reporter_stream_id)
+        packetizer = self.packetizers.get(reporter.client_id) if reporter else None
+        if packetizer is None:
+            return
+        client_address = self.clients.get(reporter.meeting_id, {}).get(reporter.client_id)
+        if client_address:
+            packetizer.retransmit(self.egress_socket(reporter.client_id, PRIORITY_REPAIR), client_address, sequences)
+
+    def record_uplink(self, stream_id, payload_type, data):
+        """
+        把上行 v2 媒体包计入该流的接收统计（视频、条带和校验包共用一个序列号空间，音频单独统计）。
+        """
+        _, flags, stream_sequence, _, _, _, _, timestamp = COMPACT_HEADER.unpack_from(data)
+        audio = payload_type in AUDIO_PAYLOAD_TYPES
+        if flags & FLAG_RETRANSMIT or not audio and payload_type not in (PAYLOAD_VIDEO, PAYLOAD_VIDEO_SLICE,
+                                                                         PAYLOAD_VIDEO_FEC):
+            return
+        media_type = PAYLOAD_AUDIO if audio else PAYLOAD_VIDEO
+        stats = self.uplink_stats.get((stream_id, media_type))
+        if stats is None:
+            stats = self.uplink_stats[(stream_id, media_type)] = ReceiveStatistics()
+        stats.update(stream_sequence, timestamp, len(data))
+
+    def route_report(self, stream_id, data):
+        """
+        处理接收报告：关于客户端媒体流的报告转发给该流的发送端，关于服务器自身发出的流的报告由服务器记录，
+        并按该客户端的丢包率调整发往它的 FEC 冗余。
+        :param stream_id: 被统计的媒体流 ID
+        :param data: 接收报告数据包
+        """
+        if stream_id != SERVER_STREAM_ID:
+            route = self.stream_routes.get(stream_id)
+            if route is not None:
+                self.forward_to_receivers((route.sender,), data)
+            return
+        try:
+            reporter_stream_id, media_type, report = unpack_report(data[COMPACT_HEADER.size:])
+        except (ValueError, struct.error):
+            return
+        reporter = self.stream_routes.get(reporter_stream_id)
+        if reporter is None:
+            return
+        self.downlink_reports.setdefault(reporter.client_id, ReportTable()).add(reporter_stream_id, media_type, report)
+        fec = self.fec_encoders.get(reporter.client_id)
+        if fec and media_type == PAYLOAD_VIDEO:
+            fec.update_loss_rate(report["fraction_lost"])
+
+    async def report_loop(self):
+        """
+        周期性地把服务器对各上行流的接收统计作为接收报告发给发送端（报告方为 SERVER_STREAM_ID）。
+        """
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            for (stream_id, media_type), stats in list(self.uplink_stats.items()):
+                route = self.stream_routes.get(stream_id)
+                if route is None:
+                    del self.uplink_stats[(stream_id, media_type)]  # 流已注销
+                    continue
+                if stats.interval_packets:
+                    self.forward_to_receivers((route.sender,),
+                                              pack_report(stream_id, SERVER_STREAM_ID, media_type, stats.report()))
+
+    def egress_socket(self, client_id, priority):
+        """
+        获取服务器向客户端发送某一类别媒体使用的套接字：启用发送调度时为该客户端 Pacer 的对应入口，否则为原始套接字。
+        :param client_id: 客户端 ID
+        :param priority: PRIORITY_AUDIO、PRIORITY_VIDEO 或 PRIORITY_REPAIR
+        """
+        if not (self.pacing or self.priority):
+            return self.client_sockets[client_id]
+        pacer = self.pacers.get(client_id)
+        if pacer is None:
+            pacer = self.pacers[client_id] = Pacer(self.client_sockets[client_id],
+                                                   rate=DEFAULT_PACING_RATE if self.pacing else None,
+                                                   frame_interval=self.frame_interval, dscp=self.dscp,
+                                                   group=self.pacer_group)
+        return pacer.channel(priority)
+
+    def get_pacer_stats(self):
+        """
+        获取服务器发往各客户端的发送调度器统计。
+        :return: {client_id: Pacer.get_stats()}
+        """
+        return {client_id: pacer.get_stats() for client_id, pacer in self.pacers.items()}
+
+    def get_stream_statistics(self):
+        """
+        获取服务器侧的媒体路径质量统计。
+        :return: {"uplink": {(流 ID, 媒体类型): 最新接收报告}, "downlink": {client_id: 该客户端对服务器发出的流的报告}}
+        """
+        return {
+            "uplink": {key: stats.last_report for key, stats in self.uplink_stats.items()},
+            "downlink": {client_id: table.snapshot() for client_id, table in self.downlink_reports.items()},
+        }
+
+    def client_sample_rate(self, client_id):
+        """
+        客户端协商的音频采样率（旧客户端为 44.1 kHz）。
+        """
+        return self.client_audio_formats.get(client_id, (LEGACY_SAMPLE_RATE, None))[0]
+
+    def client_resamplers(self, client_id):
+        """
+        客户端协商的采样率与混音采样率不同时（如旧客户端的 44.1 kHz），返回该客户端的 (上行, 下行) 重采样器，否则返回 None。
+        """
+        sample_rate = self.client_sample_rate(client_id)
+        if sample_rate == self.audio_sample_rate:
+            return None
+        resamplers = self.audio_resamplers.get(client_id)
+        if resamplers is None:
+            resamplers = self.audio_resamplers[client_id] = (Resampler(sample_rate, self.audio_sample_rate),
+                                                             Resampler(self.audio_sample_rate, sample_rate))
+        return resamplers
+
+    def mixer_input(self, client_id, payload_type, payload):
+        """
+        把上行音频按负载类型解码为 PCM，并转换到混音采样率。
+        """
+        pcm = decode_audio(payload_type, payload)
+        resamplers = self.client_resamplers(client_id)
+        return resamplers[0].process(pcm).tobytes() if resamplers else pcm
+
+    async def audio_mix_loop(self):
+        """
+        按混音节拍为每个会议混音，把每个接收端的 mix-minus 结果转换到该接收端协商的采样率、按协商的音频编码压缩后，
+        作为服务器自身的音频流发出。
+        节拍按绝对时刻推进，处理耗时不会累积成漂移；落后超过一个节拍时直接跳到当前时刻。
+        """
+        tick = self.dynamic_audio_manager.tick
+        next_tick = time.monotonic()
+        while True:
+            next_tick += tick
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -tick:
+                next_tick = time.monotonic()
+            for meeting_id in list(self.dynamic_audio_manager.meetings):
+                clients = self.clients.get(meeting_id, {})
+                for client_id, payload in self.dynamic_audio_manager.mix_audio(meeting_id).items():
+                    client_address = clients.get(client_id)
+                    if client_address:
+                        resamplers = self.client_resamplers(client_id)
+                        if resamplers:
+                            payload = resamplers[1].process(payload)
+                        encoder = self.audio_encoders.get(client_id)
+                        if encoder is None:
+                            encoder = self.audio_encoders[client_id] = create_encoder(
+                                self.client_codecs.get(client_id, (AUDIO_CODEC_PCM,))[0])
+                        await self.send_data_to_client(client_id, client_address, encoder.encode(payload),
+                                                       data_type='audio', client_id_=self.server_id,
+                                                       payload_type=encoder.payload_type)
+
+    async def nack_loop(self):
+        """
+        "same" 模式下服务器自己重组上行视频，周期性地向发送端请求重传仍在等待期限内的丢失分片。
+        """
+        while self.video_assemblers or self.slice_assemblers:
+            await asyncio.sleep(NACK_CHECK_INTERVAL)
+            for (meeting_id, client_id), assembler in [*self.video_assemblers.items(), *self.slice_assemblers.items()]:
+                stream_id = self.stream_ids.get((meeting_id, client_id))
+                route = self.stream_routes.get(stream_id)
+                if route is None:
+                    continue
+                sequences = assembler.collect_nacks()
+                if sequences:
+                    self.forward_to_receivers((route.sender,), pack_nack(stream_id, SERVER_STREAM_ID, sequences))
+        self.nack_task = None
+
+    def forward_to_receivers(self, receivers, packet):
+        """
+        按路由快照同步转发数据包，sendto 返回前数据已拷贝进内核，因此可以复用转发缓冲区。
+        :param receivers: 路由快照中的接收端列表
+        :param packet: 数据包
+        """
+        for client_id, sendto, client_address in receivers:
+            try:
+                sendto(packet, client_address)
+            except Exception as e:
+                print(f"Error forwarding data to {client_id} at {client_address}: {e}")
+
+    def handle_batch(self, view, headers, lengths):
+        """
+        处理批量接收到的数据包。
+        :param view: 接收缓冲区的 memoryview（每个数据包占一个槽位）
+        :param headers: 以结构化 dtype 一次性解析出的包头数组
+        :param lengths: 每个数据包的实际长度
+        """
+        payload_types = headers['payload_type'].tolist()
+        keys = headers['route_key'].tolist()
+        sequence_numbers = headers['sequence_number'].tolist()
+        total_packets = headers['total_packets'].tolist()
+        slot_size = headers.dtype.itemsize
+        for index, length in enumerate(lengths):
+            offset = index * slot_size
+            if payload_types[index] >> 4 == RTP_VERSION_COMPACT:
+                if length >= COMPACT_HEADER.size:
+                    self.route_compact(view[offset:offset + length])
+                continue
+            if length < CLIENT_HEADER.size:
+                continue  # 丢弃无效包
+            self.route_datagram(view[offset:offset + length], keys[index], payload_types[index],
+                                sequence_numbers[index], total_packets[index])
+
+    def start_media_plane(self, media_plane, host, port):
+        """
+        启动多进程媒体平面，之后的成员变更会同步给会议所属的工作进程。
+        工作进程只做转发，"same" 模式的合成仍需单进程运行。
+        :param media_plane: MediaPlane 实例
+        :param host: 媒体端口绑定地址
+        :param port: 媒体端口
+        """
+        self.media_plane = media_plane
+        self.media_plane.start(host, port)
+
     async def encode_frame(self, frame):
         loop = asyncio.get_event_loop()
         return await loop.run_in_executor(self.executor, cv2.imencode, '.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 50])
 
-    async def play_video(self, client_id, meeting_id, video_payload, sequence_number, total_packets):
+    async def play_parity(self, client_id, meeting_id, parity_payload, frame_id, slice_=False):
+        """
+        用 FEC 校验包恢复丢失的视频分片（"same" 模式下服务器自己重组画面）。
+        :param slice_: 校验包是否保护视频条带
+        """
+        assembler = (self.slice_assemblers if slice_ else self.video_assemblers).get((meeting_id, client_id))
+        if assembler is None:
+            return
+        frame = await assembler.add_parity(parity_payload, frame_id)
+        if frame is not None and slice_:
+            frame = self.slice_compositors[(meeting_id, client_id)].add_band(*frame)
+        if frame is not None:
+            self.dynamic_video_frame_manager.add_or_update_client_frame(meeting_id, client_id, frame)
+
+    async def play_slice(self, client_id, meeting_id, slice_payload, sequence_number, total_packets, frame_id,
+                         stream_sequence):
+        """
+        "same" 模式下重组视频条带并合成该客户端的画面，缺失的条带沿用上一幅画面的内容。
+        :param slice_payload: 条带分片数据
+        :param sequence_number: 条带内分片序号
+        :param total_packets: 条带的分片总数
+        :param frame_id: 条带的帧 ID
+        :param stream_sequence: 流内序列号
+        """
+        key = (meeting_id, client_id)
+        if key not in self.slice_assemblers:
+            self.slice_assemblers[key] = SliceAssembler()
+            self.slice_compositors[key] = SliceCompositor()
+            if self.nack_task is None:
+                self.nack_task = asyncio.create_task(self.nack_loop())
+        band = await self.slice_assemblers[key].add_packet(slice_payload, sequence_number, total_packets, frame_id,
+                                                           stream_sequence)
+        if band is None:
+            return
+        frame = self.slice_compositors[key].add_band(*band)
+        if frame is not None:
+            self.dynamic_video_frame_manager.add_or_update_client_frame(meeting_id, client_id, frame)
+
+    async def play_video(self, client_id, meeting_id, video_payload, sequence_number, total_packets, frame_id=None,
+                         stream_sequence=None):
         """
         解析视频数据并显示，处理视频包的合并。
         :param video_payload: 视频数据
@@ -256,14 +931,19 @@ class RTPManager:
         :param meeting_id: 会议ID
         :param sequence_number: 视频包的序列号
         :param total_packets: 视频总包数
+        :param frame_id: 帧 ID（v2 包头，旧版包头为 None）
+        :param stream_sequence: 流内序列号（v2 包头，旧版包头为 None）
         """
         # 如果没有为该视频流初始化组装器，则创建一个新的
         if (meeting_id, client_id) not in self.video_assemblers:
             self.video_assemblers[(meeting_id, client_id)] = VideoPacketAssembler(frame_width=960, frame_height=540)
             self.video_assemblers[(meeting_id, client_id)].start_assembling(total_packets)
+            if stream_sequence is not None and self.nack_task is None:
+                self.nack_task = asyncio.create_task(self.nack_loop())
 
         # 将视频包添加到组装器中
-        frame = await self.video_assemblers[(meeting_id, client_id)].add_packet(video_payload, sequence_number, total_packets)
+        frame = await self.video_assemblers[(meeting_id, client_id)].add_packet(video_payload, sequence_number,
+                                                                                total_packets, frame_id, stream_sequence)
         if frame is not None:
             if self.mode == "same":
                 self.dynamic_video_frame_manager.add_or_update_client_frame(meeting_id, client_id, frame)
@@ -291,47 +971,80 @@ class RTPManager:
             # time.sleep(time_to_wait)  # 控制帧率，确保每秒显示 target_fps 帧
             # cv2.waitKey(1)
 
-    async def send_data_to_client(self, client_id, client_address, payload, data_type, client_id_=None):
+    async def send_data_to_client(self, client_id, client_address, payload, data_type, client_id_=None,
+                                  payload_type=None):
         """
         向单个客户端发送数据，支持数据分割。
         :param client_id: 客户端 ID
         :param client_address: 客户端地址 (IP, Port)
         :param video_payload: 要发送的数据（字节流）
         :param data_type: 数据类型 ('video' 或 'audio')
+        :param payload_type: 负载类型（默认由 data_type 决定，编码后的音频为 μ-law 或 ADPCM 的负载类型）
         """
-        # print(f"Sent {data_type} packet {sequence_number + 1}/{num_packets} to {client_id} at {client_address}.")
-        payload_type = 0x01 if data_type == 'video' else 0x02
-        total_packets = len(payload) // MAX_UDP_PACKET_SIZE + 1  # 计算视频帧的总包数
-        sequence_number = 0  # 初始化序列号
+        if payload_type is None:
+            payload_type = 0x01 if data_type == 'video' else 0x02
+        compact = self.client_versions.get(client_id) == RTP_VERSION_COMPACT
+        header_format = COMPACT_HEADER.format if compact else SERVER_HEADER.format
+        if payload_type in AUDIO_PAYLOAD_TYPES:
+            # 音频使用独立的分包器和序列号空间，接收端的抖动缓冲按序列号排序，不会把视频包误判为音频丢包
+            packetizer = self.audio_packetizers.get(client_id)
+            if packetizer is None:
+                packetizer = self.audio_packetizers[client_id] = Packetizer(
+                    header_format, self.client_mtus.get(client_id, DEFAULT_MTU))
+        else:
+            packetizer = self.packetizers.get(client_id)
+        if packetizer is None:
+            fec = self.fec and compact
+            packetizer = self.packetizers[client_id] = Packetizer(header_format,
+                                                                  self.client_mtus.get(client_id, DEFAULT_MTU),
+                                                                  FEC_HEADER.size if fec else 0)
+            if fec:
+                self.fec_encoders[client_id] = FecEncoder()
+            if compact:
+                packetizer.enable_history(slots=256)  # 响应客户端对合成画面的 NACK
+            if self.offload and not (self.pacing or self.priority):  # 经过发送调度器时逐包出队，不能整帧交给内核分段
+                packetizer.enable_offload(self.client_sockets[client_id])
+
+        if compact:
+            stream_id = self.stream_id_of(client_id_)
+            frame_id = packetizer.next_frame()
+            timestamp = media_timestamp()  # 同一帧的所有包共用一个时间戳
+
+            def header_fields(sequence_number, total_packets, payload_length):
+                return (RTP_VERSION_COMPACT << 4 | payload_type, 0, packetizer.next_sequence(), stream_id,
+                        frame_id, sequence_number, total_packets, timestamp)
+        else:
+            timestamp_bytes = struct.pack('!Q', int(time.time() * 1000))  # 同一帧的所有包共用一个时间戳
+            client_id_bytes = uuid.UUID(client_id_).bytes
+
+            def header_fields(sequence_number, total_packets, payload_length):
+                return (payload_type, (payload_length >> 8) & 0xFF, payload_length & 0xFF, timestamp_bytes,
+                        sequence_number, total_packets, client_id_bytes)
+
         try:
-            while len(payload) > MAX_UDP_PACKET_SIZE:
-                packet_part = payload[:MAX_UDP_PACKET_SIZE]
-                payload = payload[MAX_UDP_PACKET_SIZE:]
-                sequence_number += 1
-                rtp_packet = self.create_rtp_packet(
-                    payload_type=payload_type,
-                    payload=packet_part,
-                    sequence_number=sequence_number,
-                    total_packets=total_packets,
-                    client_id=client_id_
-                )
-                self.client_sockets[client_id].sendto(rtp_packet, client_address)
-
-            if payload:
-                sequence_number += 1
-                rtp_packet = self.create_rtp_packet(
-                    payload_type=payload_type,
-                    payload=payload,
-                    sequence_number=sequence_number,
-                    total_packets=total_packets,
-                    client_id=client_id_
-                )
-                self.client_sockets[client_id].sendto(rtp_packet, client_address)
+            sock = self.egress_socket(client_id, PRIORITY_VIDEO if payload_type == PAYLOAD_VIDEO else PRIORITY_AUDIO)
+            packetizer.send_frame(sock, client_address, payload, header_fields)
+            fec = self.fec_encoders.get(client_id)
+            if fec and payload_type == PAYLOAD_VIDEO:
+                for group, group_count, prefix, parity in fec.encode(payload, packetizer.payload_size):
+                    packetizer.send_packet(self.egress_socket(client_id, PRIORITY_REPAIR), client_address,
+                                           (RTP_VERSION_COMPACT << 4 | PAYLOAD_VIDEO_FEC, 0, packetizer.next_sequence(),
+                                            stream_id, frame_id, group, group_count, timestamp),
+                                           (prefix, parity))
         except Exception as e:
             print(f"Error sending data to {client_id} at {client_address}: {e}")
 
         return
 
+    def stream_id_of(self, client_id):
+        """
+        获取客户端当前的流 ID，服务器自身（合成画面、混音）使用 SERVER_STREAM_ID。
+        :param client_id: 客户端 ID
+        """
+        if client_id == self.server_id:
+            return SERVER_STREAM_ID
+        return self.client_stream_ids.get(client_id, SERVER_STREAM_ID)
+
     async def send_video_to_meeting(self, meeting_id, exclude_client_id=None):
         """
         向会议中的所有客户端实时发送合成的视频帧。
@@ -373,42 +1086,6 @@ class RTPManager:
             # 控制帧率
             await asyncio.sleep(self.frame_interval/2)
 
-    async def send_audio_to_meeting_1(self, meeting_id, data, exclude_client_id=None):
-        clients_snapshot = self.clients[meeting_id].copy()
-        tasks = []
-        async with self.lock:
-            if exclude_client_id in clients_snapshot:
-                for client_id, client_address in clients_snapshot.items():
-                    if client_id != exclude_client_id:
-                        tasks.append(
-                            self.forward_data(client_id, data, client_address)
-                        )
-        await asyncio.gather(*tasks)
-
-    async def send_video_to_meeting_1(self, meeting_id, data, exclude_client_id=None):
-        clients_snapshot = self.clients[meeting_id].copy()
-        tasks = []
-        async with self.lock:
-            if exclude_client_id in clients_snapshot:
-                for client_id, client_address in clients_snapshot.items():
-                    if client_id != exclude_client_id:
-                        tasks.append(
-                            self.forward_data(client_id, data, client_address)
-                        )
-        await asyncio.gather(*tasks)
-
-    async def forward_data(self, client_id, data, client_address):
-        """
-        转发数据到指定客户端。
-        :param client_id: 客户端 ID
-        :param data: 数据
-        :param client_address: 客户端地址
-        """
-        try:
-            self.client_sockets[client_id].sendto(data, client_address)
-        except Exception as e:
-            print(f"Error forwarding data to {client_id} at {client_address}: {e}")
-
 
 class RTPProtocol(asyncio.DatagramProtocol):
     def __init__(self, rtp_manager):
@@ -424,27 +1101,9 @@ class RTPProtocol(asyncio.DatagramProtocol):
         :param data: 数据包
         :param addr: 数据包来源地址 (IP, Port)
         """
-        rtp_data = self.rtp_manager.parse_rtp_packet(data)
-        payload_type = rtp_data["payload_type"]
-        client_id = rtp_data["client_id"]
-        meeting_id = rtp_data["meeting_id"]
-        payload = rtp_data['payload']
-        sequence_number = rtp_data.get("sequence_number", 0)
-        total_packets = rtp_data.get("total_packets", 1)
-        timestamp = rtp_data["timestamp"]
-
-        # print(f"Received RTP packet from {client_id} in meeting {meeting_id}")
-        # print(f"Payload type: {payload_type}, Payload length: {len(payload)}")
-
-        data_ = self.rtp_manager.create_rtp_packet(payload_type, payload, sequence_number, total_packets, client_id)
-        # 根据负载类型来播放数据
-        if payload_type == 0x01:  # 视频类型
-            if self.rtp_manager.mode == "same":
-                asyncio.create_task(self.rtp_manager.play_video(client_id, meeting_id,
-                                                                payload, sequence_number, total_packets))
-            else:
-                asyncio.create_task(self.rtp_manager.send_video_to_meeting_1(meeting_id, data_, exclude_client_id=client_id))
-
-        elif payload_type == 0x02:  # 音频类型
-            if meeting_id in self.rtp_manager.clients:
-                asyncio.create_task(self.rtp_manager.send_audio_to_meeting_1(meeting_id, data_, exclude_client_id=client_id))
+        if is_compact_packet(data):
+            self.rtp_manager.route_compact(data)
+        elif data and data[0] == PAYLOAD_PROBE:
+            self.rtp_manager.transport.sendto(probe_ack(data), addr)  # 路径 MTU 探测，原路回复
+        elif len(data) >= CLIENT_HEADER.size:
+            self.rtp_manager.route_datagram(data, data[4:24], data[0])
@@ -0,0 +1,84 @@
+# 每个客户端的 RTP 发送套接字池：端口范围有界，空闲端口 O(1) 分配，客户端离开后回收复用
+
+import socket
+from collections import deque
+
+
+class SocketPoolExhausted(Exception):
+    """端口池中没有可用端口。"""
+
+
+class RTPSocketPool:
+    def __init__(self, host="0.0.0.0", port_range=(6000, 7000), max_sockets=None, buffer_size=8 * 1024 * 1024):
+        """
+        初始化套接字池。
+        :param host: 绑定地址
+        :param port_range: 端口范围 [start, end)
+        :param max_sockets: 同时打开的套接字上限（默认等于端口范围大小）
+        :param buffer_size: 每个套接字的收发缓冲区大小
+        """
+        start, end = port_range
+        if end <= start:
+            raise ValueError("Invalid port range.")
+        self.host = host
+        self.max_sockets = min(max_sockets or end - start, end - start)
+        self.buffer_size = buffer_size
+        self.free_ports = deque(range(start, end))  # 空闲端口（先进先出，刚释放的端口最后复用）
+        self.sockets = {}  # 存储 {client_id: socket}
+        self.ports = {}  # 存储 {client_id: port}
+
+    def acquire(self, client_id):
+        """
+        为客户端分配一个已绑定的 UDP 套接字，已分配时直接返回原套接字。
+        :param client_id: 客户端 ID
+        :return: socket
+        """
+        if client_id in self.sockets:
+            return self.sockets[client_id]
+        if len(self.sockets) >= self.max_sockets:
+            raise SocketPoolExhausted(f"Socket pool limit reached ({self.max_sockets} sockets in use).")
+
+        # 最多把空闲列表轮询一遍，被其他进程占用的端口放回队尾
+        for _ in range(len(self.free_ports)):
+            port = self.free_ports.popleft()
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.bind((self.host, port))
+            except OSError:
+                sock.close()
+                self.free_ports.append(port)
+                continue
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.buffer_size)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.buffer_size)
+            self.sockets[client_id] = sock
+            self.ports[client_id] = port
+            return sock
+        raise SocketPoolExhausted("No free port available in the socket pool.")
+
+    def release(self, client_id):
+        """
+        关闭客户端的套接字并回收端口。
+        :param client_id: 客户端 ID
+        """
+        sock = self.sockets.pop(client_id, None)
+        if sock is None:
+            return
+        sock.close()
+        self.free_ports.append(self.ports.pop(client_id))
+
+    def get(self, client_id):
+        """
+        获取客户端的套接字。
+        :param client_id: 客户端 ID
+        """
+        return self.sockets.get(client_id)
+
+    def stats(self):
+        """
+        获取套接字池的使用情况。
+        """
+        return {
+            "in_use": len(self.sockets),
+            "free": len(self.free_ports),
+            "max_sockets": self.max_sockets
+        }
@@ -0,0 +1,136 @@
+# 批量 UDP 收包引擎：独立线程一次唤醒收取多个数据报，写入预分配的缓冲区池后整批交给事件循环处理
+
+import mmap
+import queue
+import select
+import socket
+import threading
+
+import numpy as np
+
+from shared.path_mtu import probe_ack
+from shared.protocols import PAYLOAD_PROBE
+
+# 每个数据报占用的槽位大小：需大于可接受的最大数据报（客户端 MTU 最大 65535，旧客户端的 PCM 音频包为 2084 字节），
+# 收满整个槽位的数据报视为被截断。批缓冲区用匿名 mmap 分配，只有实际写入的页面占用物理内存
+SLOT_SIZE = 65536
+BATCH_SIZE = 128  # 每批最多收取的数据报数量（一帧 1080p 画面约 100+ 个包）
+POOL_SIZE = 8  # 缓冲区池中的批缓冲区数量
+
+# 客户端包头的结构化 dtype，每条记录覆盖一个完整槽位，可以在连续的接收缓冲区上一次性解析整批包头
+HEADER_DTYPE = np.dtype({
+    'names': ['payload_type', 'route_key', 'sequence_number', 'total_packets'],
+    'formats': ['u1', 'V20', '>u2', '>u2'],
+    'offsets': [0, 4, 24, 26],
+    'itemsize': SLOT_SIZE,
+})
+
+
+class BatchedUDPReceiver:
+    def __init__(self, sock, handler, loop, batch_size=BATCH_SIZE, pool_size=POOL_SIZE):
+        """
+        初始化批量收包引擎。
+        :param sock: 已绑定的 UDP 套接字
+        :param handler: 在事件循环中调用的批处理函数 handler(view, headers, lengths)
+        :param loop: 事件循环
+        :param batch_size: 每批最多收取的数据报数量
+        :param pool_size: 批缓冲区数量
+        """
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.handler = handler
+        self.loop = loop
+        self.batch_size = batch_size
+        self.slot_size = HEADER_DTYPE.itemsize
+        self.free_buffers = queue.Queue()  # 空闲的批缓冲区
+        for _ in range(pool_size):
+            self.free_buffers.put(mmap.mmap(-1, batch_size * self.slot_size))
+        self.running = False
+        self.thread = None
+        # Windows 上没有 recvmsg_into，退回 recvfrom_into
+        self._recv_into = self._recvmsg_into if hasattr(sock, 'recvmsg_into') else self._recvfrom_into
+
+    def start(self):
+        """
+        启动收包线程。
+        """
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        停止收包线程并关闭套接字。
+        """
+        self.running = False
+        if self.thread:
+            self.thread.join()
+        self.sock.close()
+
+    def _recvmsg_into(self, slot):
+        nbytes, _, flags, address = self.sock.recvmsg_into([slot])
+        if flags & getattr(socket, 'MSG_TRUNC', 0):
+            return 0, address  # 截断的数据报直接丢弃
+        return nbytes, address
+
+    def _recvfrom_into(self, slot):
+        nbytes, address = self.sock.recvfrom_into(slot)
+        if nbytes == len(slot):
+            return 0, address  # recvfrom_into 不报告截断，收满槽位的数据报按截断丢弃
+        return nbytes, address
+
+    def _run(self):
+        """
+        收包线程：等待套接字可读后一次性取空内核缓冲区。
+        """
+        while self.running:
+            readable, _, _ = select.select([self.sock], [], [], 0.5)
+            if not readable:
+                continue
+            try:
+                buffer = self.free_buffers.get(timeout=0.5)  # 池为空说明事件循环处理不过来，稍后再收
+            except queue.Empty:
+                continue
+            lengths = self._drain(buffer)
+            if lengths:
+                self.loop.call_soon_threadsafe(self._dispatch, buffer, lengths)
+            else:
+                self.free_buffers.put(buffer)
+
+    def _drain(self, buffer):
+        """
+        将尽可能多的数据报收进同一个批缓冲区，每个数据报占一个槽位。
+        :return: 每个数据报的长度列表
+        """
+        view = memoryview(buffer)
+        lengths = []
+        while len(lengths) < self.batch_size:
+            offset = len(lengths) * self.slot_size
+            try:
+                nbytes, address = self._recv_into(view[offset:offset + self.slot_size])
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                print(f"Error receiving UDP batch: {e}")
+                break
+            if nbytes and buffer[offset] == PAYLOAD_PROBE:
+                # 路径 MTU 探测直接在收包线程中回复，槽位留给下一个数据报
+                try:
+                    self.sock.sendto(probe_ack(view[offset:offset + nbytes]), address)
+                except OSError:
+                    pass
+                continue
+            lengths.append(nbytes)
+        return lengths
+
+    def _dispatch(self, buffer, lengths):
+        """
+        在事件循环中处理一整批数据包，处理完后归还批缓冲区。
+        """
+        try:
+            headers = np.frombuffer(buffer, dtype=HEADER_DTYPE, count=len(lengths))
+            self.handler(memoryview(buffer), headers, lengths)
+        except Exception as e:
+            print(f"Error processing UDP batch: {e}")
+        finally:
+            self.free_buffers.put(buffer)
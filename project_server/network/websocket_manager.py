@@ -4,6 +4,9 @@ import websockets
 from shared.connection_manager import ConnectionManager
 from shared.meeting_manager import MeetingLifecycleManager
 from network.rtp_manager import RTPManager
+from network.socket_pool import SocketPoolExhausted
+from shared.protocols import (SERVER_AUDIO_CODECS, negotiate_audio_codec, negotiate_audio_format,
+                              negotiate_rtp_version)
 from network.data_router import DataRouter
 
 
@@ -25,11 +28,31 @@ class WebSocketManager:
                 # 生成或获取客户端 ID
                 client_id = init_data.get("client_id") or str(uuid.uuid4())
                 self.connection_manager.add_connection(client_id, websocket)
-                print(f"Client {client_id} initialized and connected.")
+                # 协商 RTP 包头版本，旧客户端不声明 rtp_versions 时使用旧版包头
+                rtp_version = negotiate_rtp_version(init_data.get("rtp_versions"))
+                self.rtp_manager.client_versions[client_id] = rtp_version
+                # 协商音频编码，旧客户端不声明 audio_codecs 时使用原始 PCM；
+                # 经服务器的会话不使用 ADPCM，另外记下客户端能解码的最优编码，点对点时告知对端
+                audio_codec = negotiate_audio_codec(init_data.get("audio_codecs"), SERVER_AUDIO_CODECS)
+                self.rtp_manager.client_codecs[client_id] = (audio_codec,
+                                                             negotiate_audio_codec(init_data.get("audio_codecs")))
+                self.rtp_manager.audio_encoders.pop(client_id, None)
+                # 协商音频采样率和帧长，首选服务器的混音格式；旧客户端不声明 sample_rates 时为 44.1 kHz
+                sample_rate, frame_duration = negotiate_audio_format(init_data.get("sample_rates"),
+                                                                     init_data.get("frame_durations"),
+                                                                     self.rtp_manager.audio_sample_rate,
+                                                                     self.rtp_manager.audio_frame_duration)
+                self.rtp_manager.client_audio_formats[client_id] = (sample_rate, frame_duration)
+                self.rtp_manager.audio_resamplers.pop(client_id, None)
+                print(f"Client {client_id} initialized and connected. RTP version: {rtp_version}, "
+                      f"audio: {audio_codec} {sample_rate} Hz / {frame_duration} ms")
                 # 回复初始化确认消息
                 init_ack = {
                     "action": "INIT_ACK",
                     "client_id": client_id,
+                    "rtp_version": rtp_version,
+                    "audio_codec": audio_codec,
+                    "audio_format": {"sample_rate": sample_rate, "frame_duration": frame_duration},
                     "message": "Connection established"
                 }
                 await websocket.send_json(init_ack)
@@ -67,12 +90,14 @@ class WebSocketManager:
             print(f"Client {client_id} disconnected. Reason: {e.code}, {e.reason}")
             self.connection_manager.remove_connection(client_id)
             await self.rtp_manager.unregister_client(client_id, self.connection_manager.get_meeting_id(client_id))
+            self.rtp_manager.forget_client(client_id)
             self.connection_manager.clean_up()
         except Exception as e:
             # 捕获其他异常
             print(f"Unexpected error for client {client_id}: {e}")
             self.connection_manager.remove_connection(client_id)
             await self.rtp_manager.unregister_client(client_id, self.connection_manager.get_meeting_id(client_id))
+            self.rtp_manager.forget_client(client_id)
             self.connection_manager.clean_up()
 
     async def process_message(self, client_id, data):
@@ -113,12 +138,37 @@ class WebSocketManager:
                         "message": "RTP IP and Port are required"
                     })
 
-                await self.rtp_manager.register_client(meeting_id, client_id, (rtp_ip, int(rtp_port)))
+                try:
+                    stream_id = await self.rtp_manager.register_client(meeting_id, client_id, (rtp_ip, int(rtp_port)))
+                except SocketPoolExhausted as e:
+                    await self.send_message(client_id, {
+                        "action": "ERROR",
+                        "message": f"RTP registration failed: {e}"
+                    })
+                    return
                 await self.send_message(client_id, {
                     "action": "REGISTER_RTP_ACK",
+                    "stream_id": stream_id,
+                    "rtp_version": self.rtp_manager.client_versions.get(client_id),
                     "message": f"RTP address registered: {rtp_ip}:{rtp_port}"
                 })
 
+            elif action == "SET_MTU":
+                # 客户端在 RTP 套接字上探测到的路径 MTU，用于服务器发往该客户端的分包大小
+                try:
+                    mtu = self.rtp_manager.set_client_mtu(client_id, data.get("mtu"))
+                except (TypeError, ValueError):
+                    await self.send_message(client_id, {
+                        "action": "ERROR",
+                        "message": "A numeric MTU is required"
+                    })
+                    return
+                await self.send_message(client_id, {
+                    "action": "SET_MTU_ACK",
+                    "mtu": mtu,
+                    "message": f"RTP path MTU set to {mtu}"
+                })
+
             # elif action == "SEND_AUDIO":
             #     # 音频流的路由 (通过 RTP)
             #     meeting_id = data.get("meeting_id")
@@ -289,7 +339,10 @@ class WebSocketManager:
             "message": "P2P address received",
             "ip": ip,
             "port": port,
-            "client_id": to_client_id
+            "client_id": to_client_id,
+            "rtp_version": self.rtp_manager.client_versions.get(to_client_id),
+            "audio_codec": self.rtp_manager.client_codecs.get(to_client_id, (None, None))[1],  # 对端能解码的音频编码
+            "sample_rate": self.rtp_manager.client_audio_formats.get(to_client_id, (None, None))[0]  # 对端播放的采样率
         })
 
     async def stop_p2p(self, client_id):
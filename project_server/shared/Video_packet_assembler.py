@@ -3,58 +3,303 @@ import ffmpeg
 import numpy as np
 import concurrent.futures
 import asyncio
+import time
+
+from shared.fec import FEC_HEADER, recover_fragment
+
+
+def frame_id_newer(frame_id, other):
+    """
+    判断 16 位回绕的帧 ID frame_id 是否比 other 新。
+    """
+    return 0 < ((frame_id - other) & 0xFFFF) < 0x8000
+
+
+FRAME_BUFFER_GRANULARITY = 64 * 1024  # 帧缓冲区按 64KB 取整分配，便于不同大小的帧复用
+NACK_DELAY = 0.02  # 帧的第一个分片到达后等待乱序分片和 FEC 的时间，之后才请求重传（秒）
+NACK_INTERVAL = 0.06  # 同一帧两次重传请求的间隔（秒）
+NACK_MAX_ROUNDS = 2  # 每帧最多请求重传的次数
+
+
+class FrameBufferPool:
+    """帧缓冲区池：帧解码或淘汰后归还缓冲区，后续帧直接复用，不再为每帧分配内存。"""
+
+    def __init__(self, limit=8):
+        self.free = []
+        self.limit = limit  # 最多缓存的空闲缓冲区数
+
+    def acquire(self, size):
+        for index, buffer in enumerate(self.free):
+            if len(buffer) >= size:
+                return self.free.pop(index)
+        return bytearray(-(-size // FRAME_BUFFER_GRANULARITY) * FRAME_BUFFER_GRANULARITY)
+
+    def release(self, buffer):
+        if buffer is not None and len(self.free) < self.limit:
+            self.free.append(buffer)
+
+
+class PendingFrame:
+    """
+    重组中的一帧：分片按 (序号 - 1) × 分片大小 直接写入连续缓冲区，位图记录已收到的分片。
+    分片大小从第一个非末尾分片得到（同一帧除末尾分片外大小相同），在此之前先到的末尾分片暂存在 tail 中。
+    """
+    __slots__ = ('total_packets', 'fragment_size', 'buffer', 'bitmap', 'received', 'length', 'tail', 'parities',
+                 'deadline', 'first_sequence', 'nack_after', 'nack_rounds')
+
+    def __init__(self, total_packets, deadline, nack_after):
+        self.total_packets = total_packets
+        self.fragment_size = None
+        self.buffer = None
+        self.bitmap = 0  # 第 i 位表示分片 i 已收到
+        self.received = 0
+        self.length = 0  # 整帧长度（收到末尾分片后确定）
+        self.tail = None
+        self.parities = []  # 尚未用到的校验分片 [(组内首个分片序号, 组大小, 长度异或, 校验数据)]
+        self.deadline = deadline
+        self.first_sequence = None  # 第 1 个分片的流内序列号（v2 包头，同一帧的数据分片序列号连续）
+        self.nack_after = nack_after  # 最早可以请求重传的时间
+        self.nack_rounds = 0
 
 
 class VideoPacketAssembler:
-    def __init__(self, frame_width, frame_height, packet_size=32767):
+    def __init__(self, frame_width, frame_height, packet_size=32767, window=4, timeout=0.5):
+        """
+        按帧 ID 重组视频帧，同时保留一个小窗口内的多个未完成帧，乱序和交错到达的分片不会混在一起。
+        :param window: 同时重组的最大帧数，超出时淘汰最旧的未完成帧
+        :param timeout: 未完成帧从收到第一个分片起的最长等待时间（秒）
+        """
         self.frame_width = frame_width
         self.frame_height = frame_height
         self.packet_size = packet_size  # 每个视频包的大小（最大值）
-        self.total_packets = 0  # 视频包的总数
-        self.packets_received = 0  # 已接收的视频包数
-        self.packets = {}  # 存储接收到的视频包
+        self.window = window
+        self.timeout = timeout
+        self.frames = {}  # 存储 {帧 ID: PendingFrame}
+        self.last_frame_id = None  # 最近一次输出的帧 ID，更旧的帧不再输出
+        self.legacy_frame_id = 0  # 旧版包头没有帧 ID，按分片序号回退推断新帧
+        self.legacy_last_sequence = 0
+        # 完成、迟到（比已输出的帧旧）、超时或被淘汰的帧数，以及由 FEC 恢复的分片数
+        self.stats = {"completed": 0, "late": 0, "evicted": 0, "recovered": 0, "nacked": 0}
+        self.pool = FrameBufferPool(limit=window + 2)
         self.executor = concurrent.futures.ThreadPoolExecutor()
 
-    def start_assembling(self, total_packets):
+    def start_assembling(self, total_packets=None):
         """
-        初始化视频包的合并。
-        :param total_packets: 视频包的总数
+        清空重组窗口。
         """
-        self.total_packets = total_packets
-        self.packets_received = 0
-        self.packets = {}  # 清空之前的包
+        for pending in self.frames.values():
+            self.pool.release(pending.buffer)
+        self.frames.clear()
+        self.last_frame_id = None
 
-    async def add_packet(self, packet_data, sequence_number, total_packets):
+    async def add_packet(self, packet_data, sequence_number, total_packets, frame_id=None, stream_sequence=None):
         """
         将视频包添加到组装器，并合并完整帧。
         :param packet_data: 视频包数据
-        :param sequence_number: 包的序列号
-        :return: 如果所有包合并完成，返回完整帧；否则返回 None。
+        :param sequence_number: 帧内分片序号（从 1 开始）
+        :param total_packets: 帧的分片总数
+        :param frame_id: 帧 ID（v2 包头）；旧版包头为 None，此时只能同时重组一帧
+        :param stream_sequence: 流内序列号（v2 包头），用于计算丢失分片的序列号并请求重传
+        :return: 如果某一帧合并完成且比已输出的帧新，返回完整帧；否则返回 None。
         """
         if sequence_number > total_packets or sequence_number <= 0:
             return None  # 丢弃无效包
+        if frame_id is None:
+            frame_id = self._legacy_frame_id(sequence_number)
+        pending = self._pending_frame(frame_id, total_packets)
+        if pending is None or not self._store(pending, sequence_number, packet_data):
+            return None
+        if stream_sequence is not None and pending.first_sequence is None:
+            pending.first_sequence = (stream_sequence - sequence_number + 1) & 0xFFFF
+        if pending.parities:
+            self._recover(pending)
+        if pending.received < pending.total_packets:
+            return None
+        return await self._complete(frame_id, pending)
 
-        # 存储接收到的视频包
-        # print(f"Received packet {sequence_number}.")
-        self.packets[sequence_number] = packet_data
-        self.packets_received += 1
-
-        # 检查是否所有包都已接收
-        if self.packets_received == total_packets:
-            # 按照序列号排序视频包并合并
-            sorted_packets = [self.packets[i] for i in range(1, total_packets + 1) if i in self.packets]
-
-            if len(sorted_packets) < total_packets:
-                return None  # 丢弃未完整的帧
-            video_frame = b''.join(sorted_packets)  # 合并所有视频包的数据
-            self.packets.clear()  # 清理已处理的包
-            self.packets_received = 0
-            # 异步解码
-            # print(f"Decoding video frame with {len(video_frame)} bytes.")
-            frame = await self._decode_and_resize(video_frame)
-            # print(f"{len(frame)}")
-            return frame
-        return None
+    async def add_parity(self, parity_data, frame_id):
+        """
+        添加 FEC 校验分片，组内只缺一个分片时立即恢复。
+        :param parity_data: 校验负载（FEC_HEADER 前缀 + 校验分片）
+        :param frame_id: 帧 ID
+        :return: 恢复后帧完整时返回完整帧；否则返回 None。
+        """
+        if len(parity_data) <= FEC_HEADER.size:
+            return None
+        total_packets, first, group_size, length_xor = FEC_HEADER.unpack_from(parity_data)
+        if first <= 0 or group_size <= 0 or first + group_size - 1 > total_packets:
+            return None
+        pending = self._pending_frame(frame_id, total_packets)
+        if pending is None:
+            return None
+        parity = bytes(parity_data[FEC_HEADER.size:])
+        if pending.fragment_size is None:
+            # 校验分片长度等于分片大小，可以提前确定缓冲区布局
+            if not self._allocate(pending, len(parity)):
+                return None
+        elif len(parity) != pending.fragment_size:
+            return None
+        pending.parities.append((first, group_size, length_xor, parity))
+        self._recover(pending)
+        if pending.received < pending.total_packets:
+            return None
+        return await self._complete(frame_id, pending)
+
+    def _pending_frame(self, frame_id, total_packets):
+        """
+        获取或创建重组中的帧，帧已过期（不比已输出的帧新）或窗口中放不下时返回 None。
+        """
+        if self.last_frame_id is not None and not frame_id_newer(frame_id, self.last_frame_id):
+            self.stats["late"] += 1  # 同一帧的重复分片或已被更新的帧取代
+            return None
+
+        now = time.monotonic()
+        self._evict_expired(now)
+        pending = self.frames.get(frame_id)
+        if pending is None:
+            if len(self.frames) >= self.window:
+                # 窗口已满时淘汰最旧的帧；新来的帧本身最旧时直接丢弃
+                origin = self.last_frame_id if self.last_frame_id is not None else (frame_id - 0x7FFF) & 0xFFFF
+                oldest = min([*self.frames, frame_id], key=lambda fid: (fid - origin) & 0xFFFF)
+                if oldest == frame_id:
+                    self.stats["late"] += 1
+                    return None
+                self._evict(oldest)
+            pending = self.frames[frame_id] = PendingFrame(total_packets, now + self.timeout, now + NACK_DELAY)
+        return pending if pending.total_packets == total_packets else None
+
+    async def _complete(self, frame_id, pending):
+        """
+        输出完整帧：比它旧的未完成帧不会再被输出，一并丢弃。
+        """
+        del self.frames[frame_id]
+        for older in [fid for fid in self.frames if not frame_id_newer(fid, frame_id)]:
+            self._evict(older)
+        self.last_frame_id = frame_id
+        self.stats["completed"] += 1
+        # 直接在帧缓冲区上解码，解码完成后归还缓冲区
+        view = memoryview(pending.buffer)[:pending.length]
+        try:
+            frame = await self._decode_and_resize(view)
+        finally:
+            self.pool.release(pending.buffer)
+        return frame
+
+    def collect_nacks(self):
+        """
+        收集仍在等待期限内的帧中丢失分片的流内序列号，由调用方周期性调用并发送 NACK。
+        :return: 需要请求重传的序列号列表
+        """
+        now = time.monotonic()
+        sequences = []
+        for pending in self.frames.values():
+            if (pending.first_sequence is None or pending.nack_rounds >= NACK_MAX_ROUNDS
+                    or now < pending.nack_after or now >= pending.deadline):
+                continue
+            missing = (((1 << pending.total_packets) - 1) << 1) & ~pending.bitmap
+            while missing:
+                index = (missing & -missing).bit_length() - 1
+                sequences.append((pending.first_sequence + index - 1) & 0xFFFF)
+                missing &= missing - 1
+            pending.nack_rounds += 1
+            pending.nack_after = now + NACK_INTERVAL
+        self.stats["nacked"] += len(sequences)
+        return sequences
+
+    def _recover(self, pending):
+        """
+        对每个只缺一个分片的组，用校验分片恢复缺失的分片。
+        """
+        if pending.fragment_size is None:
+            return
+        fragment_size = pending.fragment_size
+        for parity in list(pending.parities):
+            first, group_size, length_xor, parity_data = parity
+            missing = (((1 << group_size) - 1) << first) & ~pending.bitmap
+            if missing & (missing - 1):
+                continue  # 缺失两个及以上，等待更多分片
+            pending.parities.remove(parity)
+            if not missing:
+                continue
+            lost = missing.bit_length() - 1
+            view = memoryview(pending.buffer)
+            chunks, lengths = [], []
+            for index in range(first, first + group_size):
+                if index == lost:
+                    continue
+                offset = (index - 1) * fragment_size
+                length = fragment_size if index < pending.total_packets else pending.length - offset
+                chunks.append(view[offset:offset + length])
+                lengths.append(length)
+            if self._store(pending, lost, recover_fragment(parity_data, chunks, lengths, length_xor)):
+                self.stats["recovered"] += 1
+
+    def _store(self, pending, sequence_number, packet_data):
+        """
+        把分片拷贝到帧缓冲区中的对应位置。
+        :return: 分片是否被接收（重复或大小不一致的分片返回 False）
+        """
+        bit = 1 << sequence_number
+        if pending.bitmap & bit:
+            return False
+        if sequence_number < pending.total_packets:
+            if pending.fragment_size is None:
+                if not self._allocate(pending, len(packet_data)):
+                    return False
+            elif len(packet_data) != pending.fragment_size:
+                return False
+            offset = (sequence_number - 1) * pending.fragment_size
+            pending.buffer[offset:offset + pending.fragment_size] = packet_data
+        elif pending.fragment_size is None and pending.total_packets > 1:
+            pending.tail = bytes(packet_data)  # 分片大小未知，暂存末尾分片
+        else:
+            if pending.fragment_size is None:
+                self._allocate(pending, len(packet_data))  # 只有一个分片的帧
+            if not self._store_tail(pending, packet_data):
+                return False
+        pending.bitmap |= bit
+        pending.received += 1
+        return True
+
+    def _allocate(self, pending, fragment_size):
+        """
+        确定分片大小后分配帧缓冲区，并写入先到的末尾分片。
+        """
+        pending.fragment_size = fragment_size
+        pending.buffer = self.pool.acquire(pending.total_packets * fragment_size)
+        tail, pending.tail = pending.tail, None
+        return tail is None or self._store_tail(pending, tail)
+
+    def _store_tail(self, pending, packet_data):
+        if len(packet_data) > pending.fragment_size:
+            return False  # 末尾分片不可能比其他分片长
+        offset = (pending.total_packets - 1) * pending.fragment_size
+        pending.buffer[offset:offset + len(packet_data)] = packet_data
+        pending.length = offset + len(packet_data)
+        return True
+
+    def _legacy_frame_id(self, sequence_number):
+        """
+        旧版包头的帧推断：分片序号没有递增时认为开始了新的一帧。
+        """
+        if sequence_number <= self.legacy_last_sequence:
+            self.legacy_frame_id = (self.legacy_frame_id + 1) & 0xFFFF
+        self.legacy_last_sequence = sequence_number
+        return self.legacy_frame_id
+
+    def _evict_expired(self, now):
+        for frame_id in [fid for fid, pending in self.frames.items() if pending.deadline <= now]:
+            self._evict(frame_id)
+
+    def _evict(self, frame_id):
+        self.pool.release(self.frames.pop(frame_id).buffer)
+        self.stats["evicted"] += 1
+
+    def get_stats(self):
+        """
+        获取重组统计：完成、迟到、淘汰的帧数，以及窗口中未完成的帧数。
+        """
+        return dict(self.stats, pending=len(self.frames))
 
     def create_frame_from_data(self, video_data):
         """
@@ -1,50 +1,157 @@
 import numpy as np
-import time
-import math
+
+from shared.protocols import DEFAULT_SAMPLE_RATE
+
+# 服务器端混音（mix-minus）：每个会议按固定节拍混音，每个参与者的音频写入预分配的 int16 环形缓冲区，
+# 每个节拍只计算一次总和，再用向量化减法得到每个接收端"除自己以外所有人"的混音，每个接收端只收到一路音频
+
+DEFAULT_TICK = 0.02  # 混音节拍（秒）
+PLAYOUT_DELAY = 0.06  # 新数据写入位置领先混音读取位置的时间（秒），吸收网络抖动
+MAX_LATENCY = 0.2  # 写入位置领先读取位置超过该时间时（发送端时钟偏快）重新同步，丢弃积压
+GAP_THRESHOLD = 0.03  # 时间戳领先连续写入位置超过该时间时视为丢包，跳过这段（保持静音）
+
+
+def timestamp_delta(timestamp, previous):
+    """
+    两个毫秒时间戳之差，按有符号 32 位折算（兼容 v2 包头回绕的时间戳）。
+    """
+    return (timestamp - previous + 0x80000000) % 0x100000000 - 0x80000000
+
+
+class MeetingMix:
+    """
+    单个会议的混音状态：参与者的环形缓冲区是一个 (容量, 环长度) 的二维数组，每个参与者占一行。
+    环长度是节拍长度的整数倍，读取位置始终按节拍对齐，因此每次读取的窗口不会跨越环尾。
+    """
+
+    def __init__(self, frame_samples, ring_frames, capacity=4):
+        self.frame_samples = frame_samples
+        self.ring_samples = frame_samples * ring_frames
+        self.rows = {}  # 存储 {client_id: 行号}
+        self.clients = []  # 按行号排列的客户端 ID
+        self.sources = []  # 按行号排列的写入状态 [写入位置, 上一个时间戳, 上一个时间戳对应的位置]
+        self.read_position = 0  # 混音读取位置（绝对采样序号）
+        self.rings = None
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        rings = np.zeros((capacity, self.ring_samples), dtype=np.int16)
+        if self.rings is not None:
+            rings[:len(self.clients)] = self.rings[:len(self.clients)]
+        self.rings = rings
+        self.work = np.empty((capacity, self.frame_samples), dtype=np.int32)
+        self.total = np.empty(self.frame_samples, dtype=np.int32)
+        self.output = np.empty((capacity, self.frame_samples), dtype=np.int16)
+        self.active = np.zeros(capacity, dtype=bool)
+
+    def add_client(self, client_id):
+        if client_id in self.rows:
+            return self.rows[client_id]
+        if len(self.clients) == len(self.rings):
+            self._allocate(2 * len(self.rings))  # 容量不足时加倍，参与者变化很少
+        row = self.rows[client_id] = len(self.clients)
+        self.clients.append(client_id)
+        self.sources.append(None)
+        return row
+
+    def remove_client(self, client_id):
+        """
+        移除参与者：最后一行移到被移除的行，保持行号连续。
+        """
+        row = self.rows.pop(client_id, None)
+        if row is None:
+            return
+        last = len(self.clients) - 1
+        if row != last:
+            self.rings[row] = self.rings[last]
+            self.clients[row] = self.clients[last]
+            self.sources[row] = self.sources[last]
+            self.rows[self.clients[row]] = row
+        self.rings[last] = 0
+        self.clients.pop()
+        self.sources.pop()
 
 
 class DynamicAudioManager:
-    def __init__(self, sample_rate=44100, frame_size=1024, buffer_duration=1.0):
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE, tick=DEFAULT_TICK, buffer_duration=1.0):
         """
         初始化动态音频管理器。
-        :param sample_rate: 音频采样率（如 44100 Hz）。
-        :param frame_size: 每帧包含的采样点数（如 1024）。
-        :param buffer_duration: 缓冲区的时长（秒）。
+        :param sample_rate: 混音采样率（如 16000 Hz），采样率不同的客户端由 RTPManager 重采样。
+        :param tick: 混音节拍（秒），每个节拍输出一帧混音。
+        :param buffer_duration: 每个参与者环形缓冲区的时长（秒）。
         """
         self.sample_rate = sample_rate
-        self.frame_size = frame_size
-        self.buffer_duration = buffer_duration
-        self.audio_buffers = {}  # 存储每个会议的音频帧，键是会议 ID，值是 {客户端 ID: [(timestamp, payload)]} 的字典
-        self.max_frames = math.ceil((sample_rate * buffer_duration) / frame_size)  # 最大缓冲帧数
+        self.tick = tick
+        self.frame_samples = round(sample_rate * tick)  # 每个节拍的采样点数
+        self.ring_frames = max(int(buffer_duration / tick), 4)
+        self.delay_samples = round(sample_rate * PLAYOUT_DELAY)
+        self.max_latency_samples = round(sample_rate * MAX_LATENCY)
+        self.gap_samples = round(sample_rate * GAP_THRESHOLD)
+        self.meetings = {}  # 存储 {会议 ID: MeetingMix}
+        self.stats = {"ticks": 0, "resyncs": 0, "gaps": 0}
 
     def initialize_meeting(self, meeting_id):
         """
-        初始化会议的音频缓冲区。
+        初始化会议的混音状态。
         :param meeting_id: 会议 ID。
         """
-        if meeting_id not in self.audio_buffers:
-            self.audio_buffers[meeting_id] = {}
+        if meeting_id not in self.meetings:
+            self.meetings[meeting_id] = MeetingMix(self.frame_samples, self.ring_frames)
+        return self.meetings[meeting_id]
 
-    def add_or_update_client_audio(self, meeting_id, client_id, timestamp, payload):
+    def add_client(self, meeting_id, client_id):
         """
-        添加或更新某个客户端的音频帧。
+        把客户端加入会议的混音（没有开麦克风的参与者也要收到其他人的混音）。
         :param meeting_id: 会议 ID。
         :param client_id: 客户端 ID。
-        :param timestamp: 音频帧的时间戳（毫秒级）。
-        :param payload: 音频帧的负载（PCM 数据）。
         """
-        if meeting_id not in self.audio_buffers:
-            self.initialize_meeting(meeting_id)
-
-        if client_id not in self.audio_buffers[meeting_id]:
-            self.audio_buffers[meeting_id][client_id] = []
-
-        # 添加帧到缓冲区
-        self.audio_buffers[meeting_id][client_id].append((timestamp, payload))
+        self.initialize_meeting(meeting_id).add_client(client_id)
 
-        # 保持缓冲区大小
-        if len(self.audio_buffers[meeting_id][client_id]) > self.max_frames:
-            self.audio_buffers[meeting_id][client_id].pop(0)
+    def add_or_update_client_audio(self, meeting_id, client_id, timestamp, payload):
+        """
+        把某个客户端的一段音频写入其环形缓冲区。
+        同一发送端的音频按到达顺序连续写入；时间戳明显超前时（中间有丢包）跳过相应的长度，
+        写入位置落后于读取位置或领先过多时重新对齐到 读取位置 + 播放延迟。
+        :param meeting_id: 会议 ID。
+        :param client_id: 客户端 ID。
+        :param timestamp: 音频帧的时间戳（毫秒级，同一帧的各分片时间戳相同）。
+        :param payload: 音频帧的负载（16 位单声道 PCM，bytes 或 memoryview）。
+        """
+        meeting = self.initialize_meeting(meeting_id)
+        row = meeting.add_client(client_id)
+        samples = np.frombuffer(payload, dtype=np.int16, count=len(payload) // 2)
+        count = len(samples)
+        if count == 0:
+            return
+        if count > meeting.ring_samples - self.max_latency_samples:
+            samples = samples[-(meeting.ring_samples - self.max_latency_samples):]
+            count = len(samples)
+
+        source = meeting.sources[row]
+        read_position = meeting.read_position
+        if source is None:
+            position = read_position + self.delay_samples
+            source = meeting.sources[row] = [position, timestamp, position]
+        else:
+            position, last_timestamp, last_position = source
+            expected = last_position + timestamp_delta(timestamp, last_timestamp) * self.sample_rate // 1000
+            if expected - position > self.gap_samples:
+                position = expected  # 丢失的音频保持静音
+                self.stats["gaps"] += 1
+            if timestamp != last_timestamp:
+                source[1], source[2] = timestamp, position
+        if position < read_position or position + count > read_position + self.max_latency_samples:
+            # 迟到或积压过多（两端时钟偏差）：重新对齐
+            position = read_position + self.delay_samples
+            source[1], source[2] = timestamp, position
+            self.stats["resyncs"] += 1
+
+        start = position % meeting.ring_samples
+        first = min(count, meeting.ring_samples - start)
+        ring = meeting.rings[row]
+        ring[start:start + first] = samples[:first]
+        ring[:count - first] = samples[first:]
+        source[0] = position + count
 
     def remove_client(self, meeting_id, client_id):
         """
@@ -52,55 +159,49 @@ class DynamicAudioManager:
         :param meeting_id: 会议 ID。
         :param client_id: 客户端 ID。
         """
-        if meeting_id in self.audio_buffers and client_id in self.audio_buffers[meeting_id]:
-            del self.audio_buffers[meeting_id][client_id]
+        meeting = self.meetings.get(meeting_id)
+        if meeting is None:
+            return
+        meeting.remove_client(client_id)
+        if not meeting.clients:
+            del self.meetings[meeting_id]
 
     def mix_audio(self, meeting_id):
         """
-        混合某个会议的所有客户端音频帧。
+        混合某个会议当前节拍的音频，并推进读取位置。
+        总和只计算一次，每个接收端的输出为 总和 - 自己的音频，再裁剪到 int16 范围。
         :param meeting_id: 会议 ID。
-        :return: 混合后的音频帧（PCM 数据）。
+        :return: {客户端 ID: 该客户端应收到的混音（PCM 数据）}，除自己以外没有人在说话的接收端不输出
         """
-        if meeting_id not in self.audio_buffers or not self.audio_buffers[meeting_id]:
-            return None
-
-        # 获取当前会议的所有客户端音频缓冲区
-        client_buffers = self.audio_buffers[meeting_id]
-        if not client_buffers:
-            return None
-
-        # 对齐时间戳并混合
-        mixed_audio = None
-        for client_id, frames in client_buffers.items():
-            # 解压时间戳和负载，按时间戳排序
-            frames = sorted(frames, key=lambda x: x[0])
-            payloads = [np.frombuffer(frame[1], dtype=np.int16) for frame in frames]
-
-            # 累加音频数据
-            if mixed_audio is None:
-                mixed_audio = np.sum(payloads, axis=0, dtype=np.int32)
-            else:
-                mixed_audio += np.sum(payloads, axis=0, dtype=np.int32)
-
-        if mixed_audio is None:
-            return None
-
-        # 防止溢出并裁剪范围到 [-32768, 32767]
-        mixed_audio = np.clip(mixed_audio, -32768, 32767).astype(np.int16)
-
-        return mixed_audio.tobytes()
-
-    def get_mixed_audio(self, meeting_id):
+        meeting = self.meetings.get(meeting_id)
+        if meeting is None or not meeting.clients:
+            return {}
+        count = len(meeting.clients)
+        start = meeting.read_position % meeting.ring_samples
+        window = meeting.rings[:count, start:start + self.frame_samples]
+        active = meeting.active[:count]
+        for row, source in enumerate(meeting.sources):
+            active[row] = source is not None and source[0] > meeting.read_position
+        meeting.read_position += self.frame_samples
+        self.stats["ticks"] += 1
+        speakers = int(active.sum())
+        if speakers == 0:
+            return {}
+
+        work = meeting.work[:count]
+        output = meeting.output[:count]
+        np.copyto(work, window)
+        window[:] = 0  # 已读取的部分清零，发送端中断时不会重复播放旧数据
+        np.sum(work, axis=0, out=meeting.total)
+        np.subtract(meeting.total, work, out=work)
+        np.clip(work, -32768, 32767, out=work)
+        np.copyto(output, work, casting='unsafe')
+        return {client_id: output[row].tobytes() for row, client_id in enumerate(meeting.clients)
+                if speakers - active[row] > 0}
+
+    def get_stats(self):
         """
-        获取并输出某个会议的混合音频。
-        :param meeting_id: 会议 ID。
-        :return: 混合后的音频帧。
+        获取混音统计：混音节拍数、重新对齐次数、检测到的丢包间隙数，以及每个会议的参与者数。
         """
-        mixed_audio = self.mix_audio(meeting_id)
-
-        # 清空已处理的缓冲区
-        if meeting_id in self.audio_buffers:
-            for client_id in self.audio_buffers[meeting_id]:
-                self.audio_buffers[meeting_id][client_id] = []
-
-        return mixed_audio
+        return dict(self.stats, meetings={meeting_id: len(meeting.clients)
+                                          for meeting_id, meeting in self.meetings.items()})
@@ -0,0 +1,310 @@
+# 发送调度：媒体数据包按类别进入优先级队列，由独立线程严格按优先级发出（音频 > 视频 > 重传/FEC），
+# 视频和修复包可以按令牌桶速率平滑发送（pacing）：一帧的上百个数据包分散在帧间隔内发送，
+# 而不是在几百微秒内突发，避免交换机缓冲区和接收端 SO_RCVBUF 溢出，也不会让音频排在整帧视频之后
+# 控制包（NACK、接收报告、MTU 探测）直接用原始套接字发送，不经过队列；
+# 队列中保存分包器给出的缓冲区列表（包头 + 负载切片），出队时仍以 scatter-gather 方式发送，只读的负载切片不拷贝；
+# 服务器为每个客户端一个 Pacer，这些 Pacer 加入同一个 PacerGroup，由一个线程统一发送
+
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+DEFAULT_PACING_RATE = 1_250_000  # 默认的最低发送速率（字节/秒，10 Mbit/s）
+DEFAULT_FRAME_INTERVAL = 1 / 24
+FRAME_SPREAD = 0.5  # 队列中的数据最多在 FRAME_SPREAD 个帧间隔内发完，留出余量给下一帧
+BURST_TIME = 0.005  # 令牌桶容量（秒），空闲后最多连续发送这么长时间的数据
+PACING_FACTOR = 2.5  # 码率自适应给出目标码率时，发送速率取目标码率的倍数
+SEND_BATCH = 16  # 每次加锁最多取出的包数，高优先级包最多等待这么多个低优先级包
+
+# 发送类别，数值越小优先级越高
+PRIORITY_AUDIO = 0
+PRIORITY_VIDEO = 1
+PRIORITY_REPAIR = 2  # 重传和 FEC 校验包
+PRIORITY_NAMES = ("audio", "video", "repair")
+
+# 各类别的 IP_TOS 字节（DSCP << 2）：音频 EF (46)，视频和修复包 AF41 (34)
+DSCP_TOS = (0xB8, 0x88, 0x88)
+IP_TOS = getattr(socket, 'IP_TOS', 1)
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')  # Windows 上没有 sendmsg
+
+
+def hold(buffer):
+    """
+    入队前固定缓冲区内容：bytes 和只读的 memoryview（如编码器输出的负载切片）直接引用，
+    可写的缓冲区（分包器复用的包头、GSO 缓冲区、发送历史）会被继续改写，需要拷贝。
+    """
+    if isinstance(buffer, bytes) or (isinstance(buffer, memoryview) and buffer.readonly):
+        return buffer
+    return bytes(buffer)
+
+
+class PacerChannel:
+    """
+    某一发送类别的入口，对分包器来说它就是套接字（提供 sendmsg/sendto）。
+    """
+
+    def __init__(self, pacer, priority):
+        self.pacer = pacer
+        self.priority = priority
+
+    def sendto(self, data, address):
+        return self.pacer.enqueue((hold(data),), address, self.priority)
+
+    def sendmsg(self, buffers, ancdata=(), flags=0, address=None):
+        if ancdata:
+            raise ValueError("Pacer does not support ancillary data, disable GSO when pacing.")
+        return self.pacer.enqueue(tuple(hold(buffer) for buffer in buffers), address, self.priority)
+
+
+class Pacer:
+    def __init__(self, sock, rate=DEFAULT_PACING_RATE, frame_interval=DEFAULT_FRAME_INTERVAL, dscp=False, group=None):
+        """
+        单个套接字的发送调度器，通过 channel() 获取各类别的入口。数据包以缓冲区列表入队，只拷贝可写的缓冲区（见 hold()），
+        因此分包器可以继续复用包头缓冲区，负载切片则不拷贝。
+        不支持 GSO 的辅助数据：数据包逐个出队发送，使用 Pacer 时不启用 GSO。
+        :param sock: UDP 套接字
+        :param rate: 配置的发送速率（字节/秒），为 None 时不限速、只按优先级发送；
+                     队列积压较多时实际速率会提高到 积压量 / (FRAME_SPREAD × 帧间隔)
+        :param frame_interval: 帧间隔（秒）
+        :param dscp: 是否按类别设置 IP_TOS（需要 sendmsg 辅助数据，Windows 上不可用）
+        :param group: PacerGroup，由组的线程发送；为 None 时使用自己的发送线程
+        """
+        self.sock = sock
+        self.rate = rate
+        self.frame_interval = frame_interval
+        self.current_rate = rate  # 当前实际的发送速率
+        self.queues = tuple(deque() for _ in PRIORITY_NAMES)  # 每个类别存储 (入队时刻, 缓冲区列表, 字节数, 目标地址)
+        self.queued_bytes = 0  # 受速率限制的（视频和修复包）积压字节数
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.dscp = dscp and hasattr(sock, 'sendmsg')
+        if dscp and not self.dscp:
+            print("DSCP marking requires sendmsg, packets are sent unmarked.")
+        self.tos = [[(socket.IPPROTO_IP, IP_TOS, struct.pack('i', tos))] for tos in DSCP_TOS]
+        self.queue_delay = [0.0] * len(PRIORITY_NAMES)  # 各类别数据包在队列中的平均等待时间（秒，指数平滑）
+        self.sent_packets = [0] * len(PRIORITY_NAMES)
+        self.group = group
+        self.condition = group.condition if group is not None else threading.Condition()
+        self.running = True
+        self.thread = None
+        if group is not None:
+            group.add(self)
+        else:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def channel(self, priority):
+        """
+        获取某一发送类别的入口。
+        :param priority: PRIORITY_AUDIO、PRIORITY_VIDEO 或 PRIORITY_REPAIR
+        """
+        return PacerChannel(self, priority)
+
+    def set_rate(self, rate, frame_interval=None):
+        """
+        设置发送速率。
+        :param rate: 字节/秒，为 None 时不限速
+        :param frame_interval: 帧间隔（秒，None 表示保持不变）
+        """
+        with self.condition:
+            self.rate = rate
+            if rate is None or self.current_rate is None:
+                self.current_rate = rate
+            if frame_interval:
+                self.frame_interval = frame_interval
+
+    def enqueue(self, buffers, address, priority):
+        """
+        数据包入队。
+        :param buffers: 组成数据包的缓冲区（调用方不再改写）
+        :param address: 目标地址 (IP, Port)
+        :param priority: 发送类别
+        :return: 数据包字节数
+        """
+        size = sum(len(buffer) for buffer in buffers)
+        with self.condition:
+            self.queues[priority].append((time.monotonic(), buffers, size, address))
+            if priority != PRIORITY_AUDIO:
+                self.queued_bytes += size
+                if self.rate is not None:
+                    # 新的一帧入队时提高速率，保证积压的数据在帧间隔内发完
+                    self.current_rate = max(self.rate, self.queued_bytes / (self.frame_interval * FRAME_SPREAD))
+            self.condition.notify()
+        return size
+
+    def _take(self):
+        """
+        按严格优先级取出一批数据包（调用时持有锁）：音频不受令牌限制，视频和修复包在令牌耗尽时停止。
+        :return: (批次 [(类别, 入队时刻, 缓冲区列表, 字节数, 目标地址)], 需要等待的时间)
+        """
+        rate = self.current_rate
+        if rate is not None:
+            now = time.monotonic()
+            self.tokens = min(rate * BURST_TIME, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+        batch = []
+        for priority, queue in enumerate(self.queues):
+            while queue and len(batch) < SEND_BATCH:
+                if priority != PRIORITY_AUDIO and rate is not None and self.tokens <= 0:
+                    break
+                item = queue.popleft()
+                if priority != PRIORITY_AUDIO:
+                    self.queued_bytes -= item[2]
+                if rate is not None:
+                    self.tokens -= item[2]
+                batch.append((priority, *item))
+            if queue:
+                break  # 高优先级队列未清空时不发送低优先级的包
+        if self.queued_bytes == 0:
+            self.current_rate = self.rate
+        wait = 0
+        if rate is not None and self.tokens <= 0 and (self.queues[PRIORITY_VIDEO] or self.queues[PRIORITY_REPAIR]):
+            wait = -self.tokens / rate
+        return batch, wait
+
+    def _run(self):
+        """
+        发送线程：按优先级和令牌桶取出数据包发送，令牌不足时睡眠到足够发送下一个包（有音频入队时立即唤醒）。
+        """
+        while True:
+            with self.condition:
+                while self.running and not any(self.queues):
+                    self.condition.wait()
+                if not self.running:
+                    return
+                batch, wait = self._take()
+
+            if self._send_batch(batch):
+                time.sleep(0.001)
+                wait = 0
+            if wait:
+                with self.condition:
+                    # 等待令牌期间音频入队会唤醒发送线程
+                    if self.running and not self.queues[PRIORITY_AUDIO]:
+                        self.condition.wait(wait)
+
+    def _send_batch(self, batch):
+        """
+        发送 _take() 取出的一批数据包（调用时不持有锁）。
+        :return: 内核发送缓冲区是否已满（未发出的包已放回各自队首，稍后重试）
+        """
+        for index, (priority, enqueued, buffers, size, address) in enumerate(batch):
+            try:
+                self._send(priority, buffers, address)
+            except BlockingIOError:
+                with self.condition:
+                    for priority_, *item in reversed(batch[index:]):
+                        self.queues[priority_].appendleft(tuple(item))
+                        if priority_ != PRIORITY_AUDIO:
+                            self.queued_bytes += item[2]
+                return True
+            except OSError as e:
+                print(f"Error sending paced packet to {address}: {e}")
+                continue
+            self.sent_packets[priority] += 1
+            self.queue_delay[priority] += (time.monotonic() - enqueued - self.queue_delay[priority]) / 16
+        return False
+
+    def _send(self, priority, buffers, address):
+        if self.dscp:
+            try:
+                self.sock.sendmsg(buffers, self.tos[priority], 0, address)
+                return
+            except BlockingIOError:
+                raise
+            except OSError as e:
+                print(f"DSCP marking unavailable ({e}), packets are sent unmarked.")
+                self.dscp = False
+        if HAS_SENDMSG:
+            self.sock.sendmsg(buffers, (), 0, address)
+        else:
+            self.sock.sendto(b''.join(buffers), address)
+
+    def get_stats(self):
+        """
+        获取发送队列的统计：当前发送速率（字节/秒，None 表示不限速）、积压字节数，
+        以及各类别的平均排队时延、队列中的包数和已发送的包数。
+        """
+        with self.condition:
+            return {
+                "pacing_rate": self.current_rate,
+                "queued_bytes": self.queued_bytes,
+                "dscp": self.dscp,
+                **{name: {"queue_delay": self.queue_delay[priority],
+                          "queued_packets": len(self.queues[priority]),
+                          "sent_packets": self.sent_packets[priority]}
+                   for priority, name in enumerate(PRIORITY_NAMES)},
+            }
+
+    def close(self):
+        """
+        停止发送线程（属于 PacerGroup 时从组中移除，并等待组的线程发完已经取出的数据包），
+        返回后不会再使用该套接字发送，队列中尚未发出的数据包被丢弃。
+        """
+        if self.group is not None:
+            self.group.remove(self)
+            return
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+
+class PacerGroup:
+    def __init__(self):
+        """
+        多个 Pacer 共用的发送线程：组内的 Pacer 共用一把锁，线程按各自的优先级和令牌桶轮流取出数据包发送，
+        所有 Pacer 都在等待令牌时睡眠到最早可以发送的时刻（有音频入队时立即唤醒）。
+        """
+        self.condition = threading.Condition()
+        self.pacers = []
+        self.sending = ()  # 发送线程正在发送（已取出、未加锁）的 Pacer
+        self.thread = None
+
+    def add(self, pacer):
+        with self.condition:
+            self.pacers.append(pacer)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def remove(self, pacer):
+        with self.condition:
+            pacer.running = False
+            if pacer in self.pacers:
+                self.pacers.remove(pacer)
+            while pacer in self.sending:
+                self.condition.wait()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not any(any(pacer.queues) for pacer in self.pacers):
+                    self.condition.wait()
+                batches, waits, ready = [], [], False
+                for pacer in self.pacers:
+                    if not any(pacer.queues):
+                        continue
+                    batch, wait = pacer._take()
+                    batches.append((pacer, batch))
+                    if wait:
+                        waits.append(wait)
+                    elif any(pacer.queues):
+                        ready = True  # 受 SEND_BATCH 限制还有包可以立即发送
+                self.sending = [pacer for pacer, _ in batches]
+
+            blocked = False
+            for pacer, batch in batches:
+                blocked = pacer._send_batch(batch) or blocked
+            with self.condition:
+                self.sending = ()
+                self.condition.notify_all()
+            if blocked:
+                time.sleep(0.001)
+                continue
+            if waits and not ready:
+                with self.condition:
+                    if not any(pacer.queues[PRIORITY_AUDIO] for pacer in self.pacers):
+                        self.condition.wait(min(waits))
@@ -0,0 +1,119 @@
+# 路径 MTU 探测：在 RTP 套接字上以 DF（禁止分片）发送不同大小的探测包，对端回复收到的大小，取最大的应答作为路径 MTU
+# 服务器和点对点对端收到 PAYLOAD_PROBE 后用 probe_ack 原路回复
+
+import asyncio
+import socket
+import struct
+import sys
+
+from shared.protocols import PAYLOAD_PROBE, PAYLOAD_PROBE_ACK
+
+DEFAULT_MTU = 1500  # 以太网 MTU，未探测或探测失败时使用
+MIN_MTU = 576  # IPv4 保证可达的最小 MTU
+IP_UDP_OVERHEAD = 28  # IPv4 头 20 字节 + UDP 头 8 字节
+MTU_PROBE_SIZES = (1500, 1492, 1472, 1400, 1280, 1200, 1000, MIN_MTU)  # 常见路径 MTU（PPPoE、隧道、IPv6 最小值等）
+
+# Linux 的 IP_MTU_DISCOVER 取值，旧版本 Python 的 socket 模块中没有这些常量
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_PROBE = getattr(socket, 'IP_PMTUDISC_PROBE', 3)  # 设置 DF，且忽略内核缓存的路径 MTU
+
+PROBE_HEADER = struct.Struct('!BBH')  # 类型, 保留, 探测包的 IP 层大小
+
+
+def payload_size_for_mtu(mtu, header_size):
+    """
+    由路径 MTU 计算每个数据包的负载大小，使 IP 头 + UDP 头 + RTP 包头 + 负载不超过 MTU。
+    :param mtu: 路径 MTU
+    :param header_size: RTP 包头长度（含路径上可能的包头改写余量）
+    """
+    return max(1, min(mtu, 65535) - IP_UDP_OVERHEAD - header_size)
+
+
+def probe_packet(size):
+    """
+    构造 IP 层大小恰为 size 的探测包。
+    """
+    packet = bytearray(size - IP_UDP_OVERHEAD)
+    PROBE_HEADER.pack_into(packet, 0, PAYLOAD_PROBE, 0, size)
+    return packet
+
+
+def probe_ack(data):
+    """
+    构造探测应答，只回复探测包携带的大小，应答本身很小，不受反向路径 MTU 影响。
+    :param data: 收到的探测包
+    """
+    return PROBE_HEADER.pack(PAYLOAD_PROBE_ACK, 0, PROBE_HEADER.unpack_from(data)[2])
+
+
+def supports_probing():
+    """
+    只有 Linux 可以在 UDP 套接字上强制 DF，其他平台上探测包会被分片，探测结果没有意义。
+    """
+    return sys.platform.startswith('linux') and hasattr(socket, 'IPPROTO_IP')
+
+
+class PathMTUProber:
+    def __init__(self, sock, timeout=0.3, attempts=3):
+        """
+        在已有的 RTP 套接字上探测路径 MTU，应答由套接字的接收循环交给 handle_ack。
+        :param sock: RTP 套接字
+        :param timeout: 每轮等待应答的时间（秒）
+        :param attempts: 没有任何应答时的重试轮数
+        """
+        self.sock = sock
+        self.timeout = timeout
+        self.attempts = attempts
+        self.acked = set()  # 当前探测中收到应答的大小
+        self.ack_event = asyncio.Event()
+        self.lock = asyncio.Lock()  # 同一时间只进行一次探测，应答不需要区分来源
+
+    def handle_ack(self, data):
+        """
+        处理探测应答。
+        :param data: 收到的 PAYLOAD_PROBE_ACK 数据包
+        """
+        if len(data) >= PROBE_HEADER.size:
+            self.acked.add(PROBE_HEADER.unpack_from(data)[2])
+            self.ack_event.set()
+
+    async def probe(self, address, max_mtu=DEFAULT_MTU):
+        """
+        并发发送所有候选大小的 DF 探测包，返回收到应答的最大大小。
+        :param address: 对端地址 (IP, Port)
+        :param max_mtu: 配置的 MTU 上限（如巨型帧网络可配置 9000）
+        :return: 路径 MTU；平台不支持或对端不回复时返回 max_mtu
+        """
+        if not supports_probing():
+            return max_mtu
+        sizes = [max_mtu] + [size for size in MTU_PROBE_SIZES if size < max_mtu]
+        async with self.lock:
+            self.acked.clear()
+            try:
+                previous = self.sock.getsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER)
+                self.sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+            except OSError as e:
+                print(f"Path MTU probing unavailable ({e}), using MTU {max_mtu}.")
+                return max_mtu
+            try:
+                for _ in range(self.attempts):
+                    for size in sizes:
+                        try:
+                            self.sock.sendto(probe_packet(size), address)
+                        except OSError:
+                            pass  # EMSGSIZE：超过本机接口 MTU
+                    self.ack_event.clear()
+                    try:
+                        await asyncio.wait_for(self.ack_event.wait(), self.timeout)
+                    except asyncio.TimeoutError:
+                        continue
+                    await asyncio.sleep(self.timeout / 4)  # 应答几乎同时到达，稍等收齐较大的探测应答
+                    break
+            finally:
+                self.sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, previous)
+            if not self.acked:
+                print(f"No path MTU probe answered by {address}, using MTU {max_mtu}.")
+                return max_mtu
+            mtu = max(self.acked)
+            print(f"Path MTU to {address}: {mtu}")
+            return mtu
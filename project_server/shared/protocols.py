@@ -1,6 +1,11 @@
 # 定义数据格式和协议
 
 import json
+import struct
+import time
+import uuid
+from collections import namedtuple
+from functools import lru_cache
 
 def create_text_message(sender, message):
     """生成文本消息"""
@@ -13,3 +18,281 @@ def create_text_message(sender, message):
 def parse_message(data):
     """解析消息"""
     return json.loads(data)
+
+
+# === RTP 包头 ===
+# 旧版（v1）包头在发送端和接收端各有一种布局；v2 是双向统一的紧凑包头，流 ID 在 INIT/REGISTER_RTP 时由服务器分配
+RTP_VERSION_LEGACY = 1
+RTP_VERSION_COMPACT = 2
+SUPPORTED_RTP_VERSIONS = [RTP_VERSION_COMPACT, RTP_VERSION_LEGACY]
+
+PAYLOAD_VIDEO = 0x01
+PAYLOAD_AUDIO = 0x02
+PAYLOAD_VIDEO_FEC = 0x03  # 视频 XOR 校验分片（仅 v2 包头，旧版接收端收不到）
+PAYLOAD_NACK = 0x04  # 重传请求：包头流 ID 为丢包的媒体流，负载为请求方流 ID + 丢失的流内序列号
+PAYLOAD_VIDEO_SLICE = 0x05  # 视频条带：每个条带是一个独立的 JPEG 帧，负载为 SLICE_HEADER + JPEG（仅 v2 包头）
+PAYLOAD_REPORT = 0x06  # 接收报告：包头流 ID 为被统计的媒体流，负载为 REPORT_BLOCK
+PAYLOAD_AUDIO_PCMU = 0x07  # G.711 μ-law 音频（每个采样 1 字节）
+PAYLOAD_AUDIO_ADPCM = 0x08  # IMA-ADPCM 音频：负载为 ADPCM_HEADER + 每字节两个 4 位编码
+PAYLOAD_PROBE = 0x7E  # 路径 MTU 探测包（接收端原样回复探测大小）
+PAYLOAD_PROBE_ACK = 0x7F  # 路径 MTU 探测应答
+
+AUDIO_PAYLOAD_TYPES = (PAYLOAD_AUDIO, PAYLOAD_AUDIO_PCMU, PAYLOAD_AUDIO_ADPCM)  # 负载类型标识音频编码
+
+# 音频编码，按优先级排列；INIT 时协商，旧客户端不声明 audio_codecs 时使用原始 PCM
+AUDIO_CODEC_PCM = "pcm"
+AUDIO_CODEC_PCMU = "pcmu"
+AUDIO_CODEC_ADPCM = "adpcm"
+SUPPORTED_AUDIO_CODECS = [AUDIO_CODEC_ADPCM, AUDIO_CODEC_PCMU, AUDIO_CODEC_PCM]  # 点对点：每端只编解码一路
+# 经服务器的会话不使用 ADPCM：服务器为每个接收端编码一路混音，ADPCM 逐采样递推的开销随接收端数线性增长
+SERVER_AUDIO_CODECS = [AUDIO_CODEC_PCMU, AUDIO_CODEC_PCM]
+
+# 音频格式（采样率和每帧时长），INIT 时协商；旧客户端不声明 sample_rates 时使用 44.1 kHz、每帧 1024 个采样
+SUPPORTED_SAMPLE_RATES = [16000, 48000, 44100, 32000, 8000]
+SUPPORTED_FRAME_DURATIONS = [20, 10, 40]  # 每帧时长（毫秒）
+DEFAULT_SAMPLE_RATE = 16000  # 语音使用 16 kHz：码率低、混音开销小
+DEFAULT_FRAME_DURATION = 20
+LEGACY_SAMPLE_RATE = 44100
+LEGACY_FRAME_SAMPLES = 1024
+
+SERVER_STREAM_ID = 0  # 服务器自身发出的流（如合成画面）
+
+FLAG_RETRANSMIT = 0x01  # v2 包头标志：重传的数据包
+FLAG_SLICE = 0x02  # v2 包头标志：该校验包保护的是视频条带（PAYLOAD_VIDEO_SLICE）
+
+# v2 包头（18 字节）：版本(高 4 位)|负载类型(低 4 位), 标志, 流内序列号, 流 ID, 帧 ID, 分片序号(从 1 开始), 分片总数, 媒体时间戳(毫秒)
+COMPACT_HEADER = struct.Struct('!BBHIHHHI')
+STREAM_ID_FIELD = struct.Struct('!I')  # 流 ID 位于偏移 4
+# 旧版客户端 → 服务器：payload_type, 长度高位, 长度低位, client_id, meeting_id, 序列号, 总包数, 时间戳
+LEGACY_UPLINK_HEADER = struct.Struct('!BBH16s4sHH8s')
+# 旧版服务器 → 客户端及点对点：payload_type, 长度高位, 长度低位, 时间戳, 序列号, 总包数, client_id
+LEGACY_DOWNLINK_HEADER = struct.Struct('!BBH8sHH16s')
+
+UINT16_FIELD = struct.Struct('!H')
+NACK_MAX_SEQUENCES = 256  # 单个 NACK 包最多携带的序列号数
+# 接收报告：请求方流 ID, 媒体类型（PAYLOAD_VIDEO/PAYLOAD_AUDIO）, 本周期丢包率（1/256）, 累计丢包数,
+# 扩展的最高序列号, 到达间隔抖动（微秒）, 排队时延（微秒）, 有效吞吐（字节/秒）
+REPORT_BLOCK = struct.Struct('!IBBIIIII')
+# IMA-ADPCM 包头：起始预测值, 起始步长索引, 末尾填充的半字节数（0 或 1）
+ADPCM_HEADER = struct.Struct('!hBB')
+FRAGMENT_FIELDS = struct.Struct('!HH')  # 序列号（分片序号）+ 总包数（分片总数）
+LEGACY_TIMESTAMP = struct.Struct('!Q')
+COMPACT_TIMESTAMP = struct.Struct('!I')
+# 视频条带前缀：画面 ID, 条带序号, 条带总数, 条带起始行, 条带高度, 画面宽度, 画面高度
+SLICE_HEADER = struct.Struct('!HBBHHHH')
+
+# 包头布局：版本、包头长度、分片字段偏移、时间戳偏移、时间戳格式、发送端 ID 偏移
+PacketLayout = namedtuple('PacketLayout', ['version', 'header_size', 'fragment_offset', 'timestamp_offset',
+                                           'timestamp_field', 'sender_offset'])
+UPLINK_LAYOUT = PacketLayout(RTP_VERSION_LEGACY, LEGACY_UPLINK_HEADER.size, 24, 28, LEGACY_TIMESTAMP, 4)
+DOWNLINK_LAYOUT = PacketLayout(RTP_VERSION_LEGACY, LEGACY_DOWNLINK_HEADER.size, 12, 4, LEGACY_TIMESTAMP, 16)
+COMPACT_LAYOUT = PacketLayout(RTP_VERSION_COMPACT, COMPACT_HEADER.size, 10, 14, COMPACT_TIMESTAMP, 4)
+
+
+def is_compact_packet(data):
+    """判断数据包是否使用 v2 紧凑包头（旧版包头首字节为负载类型，高 4 位为 0）"""
+    return len(data) >= COMPACT_HEADER.size and data[0] >> 4 == RTP_VERSION_COMPACT
+
+
+@lru_cache(maxsize=1024)
+def client_id_from_bytes(client_id_bytes):
+    """16 字节客户端 ID 转换为 UUID 字符串（同一发送端只转换一次）"""
+    return str(uuid.UUID(bytes=client_id_bytes))
+
+
+class PacketView:
+    """
+    RTP 数据包的零拷贝视图：包头字段按需用预编译的 struct 从 memoryview 中解析，负载是切片而不是拷贝。
+    视图引用接收缓冲区，缓冲区会被复用时需要在处理完之前保留或拷贝负载。
+    """
+    __slots__ = ('view', 'layout')
+
+    def __init__(self, data, layout):
+        """
+        :param data: 数据报（bytes/bytearray/memoryview）
+        :param layout: 包头布局（UPLINK_LAYOUT/DOWNLINK_LAYOUT/COMPACT_LAYOUT）
+        """
+        self.view = data if isinstance(data, memoryview) else memoryview(data)
+        self.layout = layout
+
+    @classmethod
+    def parse(cls, data, legacy_layout=DOWNLINK_LAYOUT):
+        """
+        根据首字节识别包头版本并创建视图。
+        :param data: 数据报
+        :param legacy_layout: 旧版包头的布局（服务器收包为 UPLINK_LAYOUT，客户端收包为 DOWNLINK_LAYOUT）
+        """
+        layout = COMPACT_LAYOUT if is_compact_packet(data) else legacy_layout
+        if len(data) < layout.header_size:
+            raise ValueError("Invalid RTP packet: Header size is too small")
+        return cls(data, layout)
+
+    @property
+    def compact(self):
+        return self.layout.version == RTP_VERSION_COMPACT
+
+    @property
+    def payload_type(self):
+        return self.view[0] & 0x0F if self.compact else self.view[0]
+
+    @property
+    def flags(self):
+        return self.view[1] if self.compact else 0
+
+    @property
+    def sequence_number(self):
+        """帧内分片序号（从 1 开始）"""
+        return UINT16_FIELD.unpack_from(self.view, self.layout.fragment_offset)[0]
+
+    @property
+    def total_packets(self):
+        return UINT16_FIELD.unpack_from(self.view, self.layout.fragment_offset + 2)[0]
+
+    @property
+    def fragment(self):
+        """(分片序号, 分片总数)"""
+        return FRAGMENT_FIELDS.unpack_from(self.view, self.layout.fragment_offset)
+
+    @property
+    def timestamp(self):
+        return self.layout.timestamp_field.unpack_from(self.view, self.layout.timestamp_offset)[0]
+
+    @property
+    def stream_id(self):
+        return STREAM_ID_FIELD.unpack_from(self.view, 4)[0] if self.compact else None
+
+    @property
+    def stream_sequence(self):
+        """v2 流内序列号，旧版包头没有该字段"""
+        return UINT16_FIELD.unpack_from(self.view, 2)[0] if self.compact else None
+
+    @property
+    def frame_id(self):
+        """v2 帧 ID，旧版包头没有该字段"""
+        return UINT16_FIELD.unpack_from(self.view, 8)[0] if self.compact else None
+
+    @property
+    def client_id_bytes(self):
+        if self.compact:
+            return None
+        offset = self.layout.sender_offset
+        return bytes(self.view[offset:offset + 16])
+
+    @property
+    def client_id(self):
+        """发送端标识：旧版为 UUID 字符串，v2 为流 ID"""
+        if self.compact:
+            return self.stream_id
+        return client_id_from_bytes(self.client_id_bytes)
+
+    @property
+    def meeting_id_bytes(self):
+        """旧版上行包头中的 4 字节会议 ID"""
+        return self.view[20:24] if self.layout is UPLINK_LAYOUT else None
+
+    @property
+    def payload(self):
+        return self.view[self.layout.header_size:]
+
+    @property
+    def payload_length(self):
+        return len(self.view) - self.layout.header_size
+
+
+def pack_nack(media_stream_id, reporter_stream_id, sequences):
+    """
+    构造 NACK 包。
+    :param media_stream_id: 丢包的媒体流 ID（服务器据此转发给发送端）
+    :param reporter_stream_id: 请求方的流 ID（服务器为 SERVER_STREAM_ID）
+    :param sequences: 丢失的流内序列号
+    """
+    sequences = sequences[:NACK_MAX_SEQUENCES]
+    return (COMPACT_HEADER.pack(RTP_VERSION_COMPACT << 4 | PAYLOAD_NACK, 0, 0, media_stream_id, 0, 1, 1,
+                                media_timestamp())
+            + STREAM_ID_FIELD.pack(reporter_stream_id) + struct.pack(f'!{len(sequences)}H', *sequences))
+
+
+def unpack_nack(payload):
+    """
+    解析 NACK 负载。
+    :return: (请求方流 ID, 序列号列表)
+    """
+    count = (len(payload) - STREAM_ID_FIELD.size) // 2
+    if count < 0:
+        raise ValueError("Invalid NACK packet")
+    return STREAM_ID_FIELD.unpack_from(payload)[0], list(struct.unpack_from(f'!{count}H', payload, STREAM_ID_FIELD.size))
+
+
+def pack_report(media_stream_id, reporter_stream_id, media_type, report):
+    """
+    构造接收报告包。
+    :param media_stream_id: 被统计的媒体流 ID（服务器据此转发给发送端）
+    :param reporter_stream_id: 报告方的流 ID（服务器为 SERVER_STREAM_ID）
+    :param media_type: 媒体类型（PAYLOAD_VIDEO/PAYLOAD_AUDIO）
+    :param report: ReceiveStatistics.report() 的结果
+    """
+    return (COMPACT_HEADER.pack(RTP_VERSION_COMPACT << 4 | PAYLOAD_REPORT, 0, 0, media_stream_id, 0, 1, 1,
+                                media_timestamp())
+            + REPORT_BLOCK.pack(reporter_stream_id, media_type, min(255, int(report["fraction_lost"] * 256)),
+                                min(report["cumulative_lost"], 0xFFFFFFFF), report["highest_sequence"] & 0xFFFFFFFF,
+                                min(int(report["jitter"] * 1000), 0xFFFFFFFF), min(int(report["delay"] * 1000), 0xFFFFFFFF),
+                                min(int(report["goodput"]), 0xFFFFFFFF)))
+
+
+def unpack_report(payload):
+    """
+    解析接收报告负载。
+    :return: (报告方流 ID, 媒体类型, 报告字典)，时间单位为毫秒
+    """
+    if len(payload) < REPORT_BLOCK.size:
+        raise ValueError("Invalid report packet")
+    reporter, media_type, fraction, lost, highest, jitter, delay, goodput = REPORT_BLOCK.unpack_from(payload)
+    return reporter, media_type, {"fraction_lost": fraction / 256, "cumulative_lost": lost, "highest_sequence": highest,
+                                  "jitter": jitter / 1000, "delay": delay / 1000, "goodput": goodput}
+
+
+def media_timestamp():
+    """32 位回绕的毫秒级媒体时间戳"""
+    return int(time.time() * 1000) & 0xFFFFFFFF
+
+
+def negotiate_rtp_version(offered_versions):
+    """从对方支持的版本中选出双方都支持的最高版本，对方未声明时使用旧版"""
+    for version in SUPPORTED_RTP_VERSIONS:
+        if version in (offered_versions or []):
+            return version
+    return RTP_VERSION_LEGACY
+
+
+def negotiate_audio_codec(offered_codecs, preferred_codecs=SUPPORTED_AUDIO_CODECS):
+    """从对方支持的音频编码中选出 preferred_codecs 中优先级最高的编码，对方未声明时使用原始 PCM"""
+    for codec in preferred_codecs:
+        if codec in (offered_codecs or []):
+            return codec
+    return AUDIO_CODEC_PCM
+
+
+def negotiate_audio_format(offered_rates, offered_durations, sample_rate=DEFAULT_SAMPLE_RATE,
+                           frame_duration=DEFAULT_FRAME_DURATION):
+    """
+    协商音频格式：本端首选的采样率和帧时长在对方支持的范围内时使用首选值，否则取对方列表中本端也支持的第一项。
+    对方未声明 sample_rates 时（旧客户端）返回 (LEGACY_SAMPLE_RATE, None)，帧长沿用旧客户端的 LEGACY_FRAME_SAMPLES。
+    :return: (采样率, 每帧时长（毫秒）)
+    """
+    if not offered_rates:
+        return LEGACY_SAMPLE_RATE, None
+    if sample_rate not in offered_rates:
+        sample_rate = next((rate for rate in offered_rates if rate in SUPPORTED_SAMPLE_RATES), LEGACY_SAMPLE_RATE)
+    if frame_duration not in (offered_durations or []):
+        frame_duration = next((duration for duration in offered_durations or []
+                               if duration in SUPPORTED_FRAME_DURATIONS), DEFAULT_FRAME_DURATION)
+    return sample_rate, frame_duration
+
+
+def audio_frame_samples(sample_rate, frame_duration):
+    """
+    每帧的采样点数，帧时长为 None（旧版格式）时为 LEGACY_FRAME_SAMPLES。
+    """
+    if frame_duration is None:
+        return LEGACY_FRAME_SAMPLES
+    return sample_rate * frame_duration // 1000
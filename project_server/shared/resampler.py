@@ -0,0 +1,62 @@
+# 音频重采样：16 位单声道 PCM 分段流式转换采样率（采集设备不支持协商的采样率时，以及服务器混音与旧客户端之间）。
+# 输出采样点按线性插值计算（np.interp），降采样前先用加窗 sinc 低通滤波（np.convolve）抑制混叠；
+# 分段之间保留滤波器历史和插值相位，连续的多段输出与一次性转换的结果一致
+
+import math
+
+import numpy as np
+
+FILTER_TAPS = 31  # 降采样低通滤波器的阶数（奇数，群时延 (FILTER_TAPS - 1) / 2 个输入采样）
+CUTOFF_MARGIN = 0.9  # 截止频率取输出奈奎斯特频率的比例
+
+
+def lowpass_taps(ratio, taps=FILTER_TAPS):
+    """
+    加窗 sinc 低通滤波器系数。
+    :param ratio: 截止频率 / 输入采样率
+    """
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = 2 * ratio * np.sinc(2 * ratio * n) * np.hamming(taps)
+    return kernel / kernel.sum()
+
+
+class Resampler:
+    def __init__(self, input_rate, output_rate):
+        """
+        流式重采样器，每个音频流一个实例。
+        :param input_rate: 输入采样率
+        :param output_rate: 输出采样率
+        """
+        self.input_rate = input_rate
+        self.output_rate = output_rate
+        self.step = input_rate / output_rate  # 相邻输出采样点之间的输入采样数
+        self.position = 0.0  # 下一个输出采样点相对本段第一个输入采样的位置（-1 为上一段的最后一个采样）
+        self.last = 0.0  # 上一段（滤波后）的最后一个采样，用于跨段插值
+        self.taps = lowpass_taps(CUTOFF_MARGIN * output_rate / input_rate / 2) if output_rate < input_rate else None
+        self.history = np.zeros(FILTER_TAPS - 1) if self.taps is not None else None
+
+    def process(self, data):
+        """
+        转换一段音频。
+        :param data: 16 位 PCM（bytes、memoryview 或 int16 数组）
+        :return: int16 数组，长度约为 输入长度 × output_rate / input_rate
+        """
+        samples = data if isinstance(data, np.ndarray) else np.frombuffer(data, dtype=np.int16,
+                                                                           count=len(data) // 2)
+        if self.input_rate == self.output_rate or not len(samples):
+            return samples.astype(np.int16, copy=False)
+        signal = samples.astype(np.float64)
+        if self.taps is not None:
+            extended = np.concatenate((self.history, signal))
+            self.history = extended[-(FILTER_TAPS - 1):]
+            signal = np.convolve(extended, self.taps, mode='valid')
+
+        count = len(signal)
+        # 本段可输出的采样点：位置 position + k × step ≤ count - 1
+        outputs = max(math.floor((count - 1 - self.position) / self.step) + 1, 0)
+        positions = self.position + self.step * np.arange(outputs)
+        # 输入前补上一段的最后一个采样，位置整体右移 1
+        output = np.interp(positions + 1, np.arange(count + 1), np.concatenate(((self.last,), signal)))
+        self.position += outputs * self.step - count
+        self.last = signal[-1]
+        return np.clip(np.round(output), -32768, 32767).astype(np.int16)
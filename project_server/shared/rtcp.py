@@ -0,0 +1,148 @@
+# 接收统计与接收报告（RTCP 风格）：接收端按流统计丢包、到达间隔抖动（RFC 3550 6.4.1）、排队时延和有效吞吐，
+# 周期性地以 PAYLOAD_REPORT 发回发送端；发送端汇总各接收端的报告，作为码率和 FEC 冗余调整的依据
+
+import time
+from collections import deque
+
+REPORT_INTERVAL = 0.5  # 接收报告的发送周期（秒）
+REPORT_TIMEOUT = 2.0  # 超过该时间没有更新的接收报告不再参与汇总（秒）
+DELAY_WINDOW = 20  # 基准传输时间取最近若干个报告周期中的最小值（约 10 秒），容忍两端时钟漂移
+
+
+def wrap_transit(transit):
+    """
+    把传输时间（到达时刻 - 媒体时间戳）折算到有符号 32 位范围内，兼容 v2 包头 32 位回绕的毫秒时间戳。
+    """
+    return (transit + 0x80000000) % 0x100000000 - 0x80000000
+
+
+class ReceiveStatistics:
+    """
+    单个媒体流的接收统计。两端时钟不同步，传输时间只用于计算差值：
+    抖动为相邻数据包传输时间之差的平滑值，排队时延为传输时间相对近期最小值的增量。
+    """
+
+    def __init__(self):
+        self.base_sequence = None
+        self.max_sequence = None
+        self.cycles = 0  # 序列号回绕次数 × 65536
+        self.received = 0
+        self.expected_prior = 0
+        self.received_prior = 0
+        self.transit = None
+        self.jitter = 0.0  # 毫秒
+        self.interval_start = time.monotonic()
+        self.interval_packets = 0
+        self.interval_bytes = 0
+        self.interval_transit = 0.0
+        self.interval_min_transit = None
+        self.min_transits = deque(maxlen=DELAY_WINDOW)  # 最近各报告周期的最小传输时间
+        self.last_report = None
+
+    def update(self, sequence, timestamp, size, arrival=None):
+        """
+        记录一个收到的数据包（重传的数据包不应计入）。
+        :param sequence: 流内序列号（旧版包头没有序列号时为 None，只统计抖动和吞吐）
+        :param timestamp: 媒体时间戳（毫秒）
+        :param size: 数据包长度
+        :param arrival: 到达时刻（毫秒，默认为当前时间）
+        """
+        if sequence is not None:
+            if self.max_sequence is None:
+                self.base_sequence = self.max_sequence = sequence
+            else:
+                delta = (sequence - self.max_sequence) & 0xFFFF
+                if 0 < delta < 0x8000:
+                    if sequence < self.max_sequence:
+                        self.cycles += 0x10000
+                    self.max_sequence = sequence
+            self.received += 1
+
+        transit = wrap_transit((time.time() * 1000 if arrival is None else arrival) - timestamp)
+        if self.transit is not None:
+            self.jitter += (abs(transit - self.transit) - self.jitter) / 16
+        self.transit = transit
+        self.interval_packets += 1
+        self.interval_bytes += size
+        self.interval_transit += transit
+        if self.interval_min_transit is None or transit < self.interval_min_transit:
+            self.interval_min_transit = transit
+
+    def report(self):
+        """
+        生成本周期的接收报告并开始新的统计周期。
+        :return: {"fraction_lost", "cumulative_lost", "highest_sequence", "jitter", "delay", "goodput"}，时间单位为毫秒
+        """
+        now = time.monotonic()
+        elapsed = max(now - self.interval_start, 1e-3)
+        if self.max_sequence is None:
+            extended = expected = 0
+        else:
+            extended = self.cycles + self.max_sequence
+            expected = extended - self.base_sequence + 1
+        expected_interval = expected - self.expected_prior
+        lost_interval = expected_interval - (self.received - self.received_prior)
+        self.expected_prior, self.received_prior = expected, self.received
+
+        delay = 0.0
+        if self.interval_packets:
+            self.min_transits.append(self.interval_min_transit)
+            delay = self.interval_transit / self.interval_packets - min(self.min_transits)
+        self.last_report = {
+            "fraction_lost": lost_interval / expected_interval if expected_interval > 0 and lost_interval > 0 else 0.0,
+            "cumulative_lost": max(expected - self.received, 0),
+            "highest_sequence": extended,
+            "jitter": self.jitter,
+            "delay": delay,
+            "goodput": self.interval_bytes / elapsed,
+        }
+        self.interval_start = now
+        self.interval_packets = self.interval_bytes = 0
+        self.interval_transit = 0.0
+        self.interval_min_transit = None
+        return self.last_report
+
+
+class ReportTable:
+    """
+    发送端收到的接收报告：按 (报告方流 ID, 媒体类型) 保存最新一份，汇总时取各接收端中最差的路径。
+    """
+
+    def __init__(self, timeout=REPORT_TIMEOUT):
+        self.timeout = timeout
+        self.reports = {}  # 存储 {(报告方流 ID, 媒体类型): (收到时刻, 报告)}
+
+    def add(self, reporter_stream_id, media_type, report):
+        self.reports[(reporter_stream_id, media_type)] = (time.monotonic(), report)
+
+    def remove(self, reporter_stream_id):
+        """
+        移除某个报告方的全部报告（对方离开会议时调用）。
+        """
+        for key in [key for key in self.reports if key[0] == reporter_stream_id]:
+            del self.reports[key]
+
+    def snapshot(self, media_type=None):
+        """
+        获取未过期的报告。
+        :return: {(报告方流 ID, 媒体类型): 报告}
+        """
+        now = time.monotonic()
+        return {key: report for key, (received_at, report) in self.reports.items()
+                if now - received_at <= self.timeout and (media_type is None or key[1] == media_type)}
+
+    def aggregate(self, media_type):
+        """
+        汇总某一媒体类型的报告：丢包率、抖动、排队时延取最大值，有效吞吐取最小值。
+        :return: 汇总字典（含接收端数 receivers），没有报告时返回 None
+        """
+        reports = list(self.snapshot(media_type).values())
+        if not reports:
+            return None
+        return {
+            "receivers": len(reports),
+            "fraction_lost": max(report["fraction_lost"] for report in reports),
+            "jitter": max(report["jitter"] for report in reports),
+            "delay": max(report["delay"] for report in reports),
+            "goodput": min(report["goodput"] for report in reports),
+        }